@@ -0,0 +1,395 @@
+"""Batched airdrop distribution.
+
+Recipients are loaded into ``airdrop_transfers`` under an airdrop name and
+paid by ``AirdropEngine.run``. Transfers are packed into as few transactions
+as fit the 1232-byte packet limit (21 system transfers from one payer), signed
+with a recent blockhash shared by all transactions for ``blockhash_ttl``
+seconds and sent ``concurrency`` at a time. Signature statuses are then polled
+in batches of 256 until every transaction is confirmed, failed or expired.
+
+Nothing is paid twice after a crash: the signature and the last valid block
+height of its blockhash are written to the database before the transaction is
+sent. A run starts by settling such transactions; one that is not found after
+its blockhash expired can no longer land, so its transfers go back to pending
+and are sent again in a new transaction.
+
+Usage::
+
+    python airdrop.py load NAME recipients.csv      # address,lamports per line
+    python airdrop.py run NAME --keypair payer.json [--rpc URL[,URL...]] [--concurrency 4]
+    python airdrop.py status NAME
+
+``bench_airdrop.py`` runs a distribution against ``mock_rpc.MockRpc``.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from async_db import SingleFlight
+
+logger = logging.getLogger("GrapheneBot.airdrop")
+
+MAX_TRANSACTION_SIZE = 1232
+MAX_SIGNATURE_STATUSES = 256
+
+
+def build_transaction(payer, transfers: List[Tuple[str, int]], blockhash):
+    """Signed transaction paying ``(address, lamports)`` pairs from ``payer`` (a ``Keypair``)."""
+    from solders.message import Message
+    from solders.pubkey import Pubkey
+    from solders.system_program import TransferParams, transfer
+    from solders.transaction import Transaction
+
+    instructions = [transfer(TransferParams(from_pubkey=payer.pubkey(), to_pubkey=Pubkey.from_string(address),
+                                            lamports=lamports))
+                    for address, lamports in transfers]
+    return Transaction([payer], Message.new_with_blockhash(instructions, payer.pubkey(), blockhash), blockhash)
+
+
+def transfers_per_transaction(payer) -> int:
+    """How many transfers to distinct recipients fit in one transaction.
+
+    Every such transfer adds the same number of bytes, so the first
+    overflowing size is the limit for all batches.
+    """
+    from solders.hash import Hash
+    from solders.keypair import Keypair
+
+    transfers = []
+    while True:
+        transfers.append((str(Keypair().pubkey()), 1))
+        if len(bytes(build_transaction(payer, transfers, Hash.default()))) > MAX_TRANSACTION_SIZE:
+            return len(transfers) - 1
+
+
+def add_recipients(db, name: str, recipients: Iterable[Tuple[str, int]], now: Optional[float] = None) -> int:
+    """Add recipients to an airdrop; addresses already in it are kept as they are."""
+    from sqlalchemy.dialects.sqlite import insert
+
+    from database import AirdropTransfer
+
+    now = time.time() if now is None else now
+    rows = [{"airdrop": name, "address": address, "lamports": int(lamports), "status": "pending", "updated_at": now}
+            for address, lamports in recipients]
+    if not rows:
+        return 0
+    return db.execute(insert(AirdropTransfer.__table__).on_conflict_do_nothing(), rows).rowcount
+
+
+def _pending(db, name: str, limit: int) -> List[Tuple[str, int]]:
+    from sqlalchemy import select
+
+    from database import AirdropTransfer
+
+    return [tuple(row) for row in db.execute(
+        select(AirdropTransfer.address, AirdropTransfer.lamports)
+        .where(AirdropTransfer.airdrop == name, AirdropTransfer.status == "pending")
+        .order_by(AirdropTransfer.address).limit(limit)
+    )]
+
+
+def _mark_sent(db, name: str, addresses: List[str], signature: str, last_valid_block_height: int):
+    from sqlalchemy import update
+
+    from database import AirdropTransfer
+
+    db.execute(update(AirdropTransfer)
+               .where(AirdropTransfer.airdrop == name, AirdropTransfer.address.in_(addresses),
+                      AirdropTransfer.status == "pending")
+               .values(status="sent", signature=signature, last_valid_block_height=last_valid_block_height,
+                       updated_at=time.time()))
+
+
+def _sent(db, name: str) -> Dict[str, int]:
+    """Signatures awaiting confirmation -> last valid block height."""
+    from sqlalchemy import select
+
+    from database import AirdropTransfer
+
+    return dict(db.execute(
+        select(AirdropTransfer.signature, AirdropTransfer.last_valid_block_height)
+        .where(AirdropTransfer.airdrop == name, AirdropTransfer.status == "sent").distinct()
+    ).all())
+
+
+def _resolve(db, name: str, confirmed: List[str], failed: Dict[str, str], expired: List[str]) -> int:
+    """Apply signature outcomes; returns the number of recipients confirmed."""
+    from sqlalchemy import update
+
+    from database import AirdropTransfer
+
+    now = time.time()
+    sent = (AirdropTransfer.airdrop == name, AirdropTransfer.status == "sent")
+    paid = 0
+    if confirmed:
+        paid = db.execute(update(AirdropTransfer).where(*sent, AirdropTransfer.signature.in_(confirmed))
+                          .values(status="confirmed", updated_at=now)).rowcount
+    for signature, error in failed.items():
+        db.execute(update(AirdropTransfer).where(*sent, AirdropTransfer.signature == signature)
+                   .values(status="failed", error=error, updated_at=now))
+    if expired:
+        db.execute(update(AirdropTransfer).where(*sent, AirdropTransfer.signature.in_(expired))
+                   .values(status="pending", signature=None, last_valid_block_height=None, updated_at=now))
+    return paid
+
+
+def summary(db, name: str) -> Dict[str, Tuple[int, int]]:
+    """status -> (recipients, lamports)"""
+    from sqlalchemy import func, select
+
+    from database import AirdropTransfer
+
+    return {status: (count, lamports or 0) for status, count, lamports in db.execute(
+        select(AirdropTransfer.status, func.count(), func.sum(AirdropTransfer.lamports))
+        .where(AirdropTransfer.airdrop == name).group_by(AirdropTransfer.status)
+    )}
+
+
+class BlockhashCache:
+    """Latest blockhash reused for ``ttl`` seconds; concurrent refreshes share one RPC."""
+
+    def __init__(self, client, ttl: float = 20.0, commitment: Optional[str] = None, clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.commitment = commitment
+        self.clock = clock
+        self._value = None
+        self._fetched_at = 0.0
+        self._flight = SingleFlight()
+        self.rpc_calls = 0
+
+    async def _fetch(self):
+        self.rpc_calls += 1
+        value = (await self.client.get_latest_blockhash(self.commitment)).value
+        self._value = (value.blockhash, value.last_valid_block_height)
+        self._fetched_at = self.clock()
+        return self._value
+
+    async def get(self):
+        """``(blockhash, last_valid_block_height)``"""
+        if self._value is not None and self.clock() - self._fetched_at < self.ttl:
+            return self._value
+        return await self._flight.do(None, self._fetch)
+
+    def invalidate(self):
+        self._value = None
+
+
+class AirdropEngine:
+    def __init__(self, client, database, payer, name: str, concurrency: int = 4, poll_interval: float = 1.0,
+                 blockhash_ttl: float = 20.0, commitment: str = "confirmed", batch_transactions: int = 32):
+        self.client = client
+        self.database = database
+        self.payer = payer
+        self.name = name
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.commitment = commitment
+        self.batch_transactions = batch_transactions
+        self.blockhashes = BlockhashCache(client, blockhash_ttl, commitment)
+        self.capacity = transfers_per_transaction(payer)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._fee_flight = SingleFlight()
+        self.fee_per_transaction: Optional[int] = None
+        self.transactions = 0
+        self.confirmed_transactions = 0
+        self.confirmed_recipients = 0
+        self.expired = 0
+        self.failed = 0
+        self.send_errors = 0
+
+    async def _fetch_fee(self, tx):
+        try:
+            self.fee_per_transaction = (await self.client.get_fee_for_message(tx.message, self.commitment)).value
+        except Exception:
+            logger.warning("Could not get the transaction fee", exc_info=True)
+
+    async def _fee(self, tx):
+        # All packed transactions have one signature and pay the same fee
+        if self.fee_per_transaction is None:
+            await self._fee_flight.do(None, self._fetch_fee, tx)
+
+    async def _send(self, transfers: List[Tuple[str, int]]):
+        async with self._semaphore:
+            blockhash, last_valid = await self.blockhashes.get()
+            tx = build_transaction(self.payer, transfers, blockhash)
+            await self._fee(tx)
+            signature = str(tx.signatures[0])
+            # Recorded before sending: after a crash the transfers wait for this signature or its expiry
+            await self.database.transaction(_mark_sent, self.name, [address for address, _ in transfers],
+                                            signature, last_valid)
+            self.transactions += 1
+            try:
+                await self.client.send_raw_transaction(bytes(tx))
+            except Exception:
+                # It may still have been forwarded, so it is settled like any other sent transaction
+                self.send_errors += 1
+                self.blockhashes.invalidate()
+                logger.warning("Sending %s failed", signature, exc_info=True)
+
+    def _pinned(self):
+        # An RpcPool routes every call on its own; the confirmation reads must come from one node
+        pin = getattr(self.client, "pin", None)
+        return pin() if pin is not None else self.client
+
+    async def _statuses(self, client, signatures: List[str], search_history: bool = False) -> list:
+        from solders.signature import Signature
+
+        statuses = []
+        for i in range(0, len(signatures), MAX_SIGNATURE_STATUSES):
+            chunk = [Signature.from_string(signature) for signature in signatures[i:i + MAX_SIGNATURE_STATUSES]]
+            statuses.extend((await client.get_signature_statuses(chunk, search_history)).value)
+        return statuses
+
+    async def _confirm(self):
+        """Poll sent transactions until each is confirmed, failed or expired."""
+        from solders.transaction_status import TransactionConfirmationStatus
+
+        accepted = [TransactionConfirmationStatus.Finalized]
+        if self.commitment != "finalized":
+            accepted.append(TransactionConfirmationStatus.Confirmed)
+        while True:
+            sent = await self.database.transaction(_sent, self.name)
+            if not sent:
+                return
+            # Height first: a signature still unknown after it cannot land later. Both reads go to
+            # one node, so a node that is behind cannot expire what another one has seen
+            client = self._pinned()
+            height = (await client.get_block_height(self.commitment)).value
+            signatures = list(sent)
+            statuses = dict(zip(signatures, await self._statuses(client, signatures)))
+            # Nodes answer from recent statuses only (a few minutes); before a transaction is
+            # given up and paid again, its signature is looked up in the full history
+            unknown = [signature for signature in signatures
+                       if statuses[signature] is None and height > sent[signature]]
+            if unknown:
+                statuses.update(zip(unknown, await self._statuses(client, unknown, search_history=True)))
+            confirmed, failed, expired = [], {}, []
+            for signature in signatures:
+                status = statuses[signature]
+                if status is None:
+                    if height > sent[signature]:
+                        expired.append(signature)
+                elif status.err is not None:
+                    failed[signature] = str(status.err)
+                elif status.confirmation_status in accepted:
+                    confirmed.append(signature)
+            if confirmed or failed or expired:
+                self.confirmed_recipients += await self.database.transaction(_resolve, self.name, confirmed,
+                                                                             failed, expired)
+                self.confirmed_transactions += len(confirmed)
+                self.failed += len(failed)
+                self.expired += len(expired)
+                if expired:
+                    logger.info("%d transactions expired, their transfers will be sent again", len(expired))
+            if len(confirmed) + len(failed) + len(expired) < len(sent):
+                await asyncio.sleep(self.poll_interval)
+
+    async def run(self) -> dict:
+        """Pay every pending recipient; returns the counters of this run."""
+        start = time.perf_counter()
+        await self._confirm()
+        while True:
+            pending = await self.database.transaction(_pending, self.name, self.capacity * self.batch_transactions)
+            if not pending:
+                break
+            groups = [pending[i:i + self.capacity] for i in range(0, len(pending), self.capacity)]
+            tasks = [asyncio.ensure_future(self._send(group)) for group in groups]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop sending; what was recorded as sent is settled by the next run
+                for task in tasks:
+                    task.cancel()
+                raise
+            await self._confirm()
+        return self.stats(time.perf_counter() - start)
+
+    def stats(self, seconds: float) -> dict:
+        fees = None if self.fee_per_transaction is None else self.fee_per_transaction * self.confirmed_transactions
+        return {
+            "transactions": self.transactions,
+            "confirmed_transactions": self.confirmed_transactions,
+            "confirmed_recipients": self.confirmed_recipients,
+            "expired": self.expired,
+            "failed": self.failed,
+            "send_errors": self.send_errors,
+            "blockhash_rpc_calls": self.blockhashes.rpc_calls,
+            "seconds": seconds,
+            "transactions_per_second": self.confirmed_transactions / seconds if seconds else 0.0,
+            "fee_lamports": fees,
+            "fee_per_recipient": fees / self.confirmed_recipients if fees is not None and self.confirmed_recipients
+            else None,
+        }
+
+
+def _read_recipients(path: str) -> Iterable[Tuple[str, int]]:
+    from balance_cache import parse_pubkey
+
+    with open(path, encoding="utf-8", newline="") as source:
+        for row in csv.reader(source):
+            if not row or row[0].strip().lower() == "address":
+                continue
+            yield str(parse_pubkey(row[0])), int(row[1])
+
+
+async def _run(args) -> dict:
+    from solders.keypair import Keypair
+
+    from async_db import DatabaseExecutor
+    from rpc_pool import RpcPool
+
+    with open(args.keypair, encoding="utf-8") as source:
+        payer = Keypair.from_bytes(bytes(json.load(source)))
+    database = DatabaseExecutor(workers=1)
+    client = RpcPool([url.strip() for url in args.rpc.split(",") if url.strip()])
+    try:
+        engine = AirdropEngine(client, database, payer, args.name, concurrency=args.concurrency)
+        return await engine.run()
+    finally:
+        await client.close()
+        database.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Distribute SOL to the recipients of an airdrop.")
+    parser.add_argument("command", choices=("load", "run", "status"))
+    parser.add_argument("name", help="airdrop name")
+    parser.add_argument("path", nargs="?", help="load: CSV file with address,lamports")
+    parser.add_argument("--keypair", help="run: payer keypair JSON (solana-keygen format)")
+    default_rpc = os.getenv("SOLANA_RPC_URLS", os.getenv("SOLANA_RPC_URL", "https://api.mainnet-beta.solana.com"))
+    parser.add_argument("--rpc", default=default_rpc, help="RPC URL, or several separated by commas")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    import database
+
+    if args.command == "load":
+        if not args.path:
+            parser.error("load needs a CSV file")
+        with database.get_session() as db:
+            added = add_recipients(db, args.name, _read_recipients(args.path))
+            db.commit()
+        print(f"{added} recipients added to {args.name}")
+    elif args.command == "run":
+        if not args.keypair:
+            parser.error("run needs --keypair")
+        stats = asyncio.run(_run(args))
+        fee = stats["fee_per_recipient"]
+        print(f"{stats['confirmed_recipients']} recipients paid in {stats['confirmed_transactions']} transactions, "
+              f"{stats['seconds']:.1f} s ({stats['transactions_per_second']:.1f} tx/s), "
+              f"fee {'?' if fee is None else f'{fee:.0f}'} lamports per recipient")
+    with database.get_session() as db:
+        for status, (count, lamports) in sorted(summary(db, args.name).items()):
+            print(f"{status:>10}: {count} recipients, {lamports} lamports")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
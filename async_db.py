@@ -0,0 +1,171 @@
+"""Database access that does not block the event loop.
+
+SQLAlchemy sessions here are synchronous, so every query runs on a small,
+dedicated thread pool. Its size bounds how many connections work on the
+database at once; handlers keep serving other chats while a query runs.
+
+``DatabaseSessionMiddleware`` gives each update its own ``UpdateSession`` as the
+``db`` handler argument. The session is opened on first use, committed when the
+handler returns and rolled back when it raises. Writes should go through
+``UpdateSession.transaction``: it commits in the same thread hop, so no write
+lock is held while the update waits for a database thread again. Write
+transactions also take an in-process lock, ``DatabaseExecutor.write_lock``:
+SQLite allows one writer at a time, and two deferred transactions upgrading to
+write locks fail with "database is locked" instead of waiting for each other.
+Stores that write without a session (locale, dedup, documents) take the same
+lock when it is passed to them.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def default_session_factory():
+    from database import get_session
+
+    # Objects go back to the event loop, which must never lazy-load expired attributes
+    return get_session(expire_on_commit=False)
+
+
+class DatabaseExecutor:
+    def __init__(self, workers: int = 4, session_factory: Optional[Callable[[], Any]] = None):
+        self.workers = workers
+        self.session_factory = session_factory or default_session_factory
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.write_lock = threading.Lock()
+        self.calls = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="graphene-db")
+        return self._executor
+
+    async def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking function on the database threads."""
+        self.calls += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def _transaction(self, fn: Callable, args: tuple) -> Any:
+        session = self.session_factory()
+        try:
+            with self.write_lock:
+                result = fn(session, *args)
+                session.commit()
+            return result
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    async def transaction(self, fn: Callable, *args: Any) -> Any:
+        """``fn(session, *args)`` in a session of its own, committed in the same thread hop."""
+        return await self.run(self._transaction, fn, args)
+
+    def session(self) -> "UpdateSession":
+        return UpdateSession(self)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution and its result.
+
+    A burst of updates from one user costs a single database operation; callers
+    that arrive after it finished start a new one.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable, *args: Any) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+            self.calls += 1
+        else:
+            self.shared += 1
+        # A cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+
+class UpdateSession:
+    """One SQLAlchemy session used from the database threads on behalf of an update."""
+
+    def __init__(self, database: DatabaseExecutor):
+        self.database = database
+        self._session = None
+        # A session is not thread-safe: calls are never in flight at the same time
+        self._lock = asyncio.Lock()
+
+    def _call(self, fn: Callable, args: tuple) -> Any:
+        if self._session is None:
+            self._session = self.database.session_factory()
+        return fn(self._session, *args)
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """``fn(session, *args)``; return plain values or loaded objects, not queries."""
+        async with self._lock:
+            return await self.database.run(self._call, fn, args)
+
+    def _call_and_commit(self, fn: Callable, args: tuple) -> Any:
+        with self.database.write_lock:
+            result = self._call(fn, args)
+            self._session.commit()
+        return result
+
+    async def transaction(self, fn: Callable, *args: Any) -> Any:
+        """Like ``run``, then commit before the thread is released."""
+        async with self._lock:
+            return await self.database.run(self._call_and_commit, fn, args)
+
+    def _finish(self, commit: bool):
+        try:
+            if commit:
+                with self.database.write_lock:
+                    self._session.commit()
+            else:
+                self._session.rollback()
+        finally:
+            self._session.close()
+            self._session = None
+
+    async def close(self, commit: bool = True):
+        async with self._lock:
+            if self._session is not None:
+                await self.database.run(self._finish, commit)
+
+
+class DatabaseSessionMiddleware:
+    """Update middleware that passes a per-update ``UpdateSession`` as ``db``.
+
+    A plain callable, so this module also imports under the aiogram 2 bot.
+    """
+
+    def __init__(self, database: DatabaseExecutor):
+        self.database = database
+
+    async def __call__(self, handler, event, data):
+        session = self.database.session()
+        data["db"] = session
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await session.close(commit=False)
+            raise
+        await session.close(commit=True)
+        return result
@@ -0,0 +1,130 @@
+"""Cached Solana balance lookups.
+
+Balances are cached per ``(address, commitment)`` for ``ttl`` seconds. Until
+``stale_ttl`` an expired value is still returned at once while one background
+refresh runs; older entries are fetched before answering. Concurrent lookups
+of the same address share one in-flight RPC. Addresses are parsed with
+``solders.Pubkey`` first, so malformed input never reaches the network.
+
+``fetch(pubkey, commitment)`` does the RPC and returns lamports, e.g.::
+
+    async def fetch(pubkey, commitment):
+        return (await client.get_balance(pubkey, commitment)).value
+
+``stats()["saved_calls"]`` is the number of RPCs avoided compared to one
+call per lookup: lookups minus RPCs made, background refreshes included.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from async_db import SingleFlight
+
+logger = logging.getLogger("GrapheneBot.balance_cache")
+
+
+class InvalidAddress(ValueError):
+    pass
+
+
+def parse_pubkey(address: str):
+    """``solders.Pubkey`` for a base58 address; raises ``InvalidAddress``."""
+    from solders.pubkey import Pubkey
+
+    try:
+        return Pubkey.from_string(address.strip())
+    except ValueError as exc:
+        raise InvalidAddress(f"Invalid Solana address: {address!r}") from exc
+
+
+class BalanceCache:
+    def __init__(self, fetch: Callable[..., Awaitable[int]], ttl: float = 10.0, stale_ttl: float = 60.0,
+                 maxsize: int = 10000, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.maxsize = maxsize
+        self.clock = clock
+        self._values: "OrderedDict[Hashable, Tuple[int, float]]" = OrderedDict()  # key -> (lamports, fetched_at)
+        self._flight = SingleFlight()
+        self._refreshes: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.rpc_calls = 0
+        self.errors = 0
+
+    async def _fetch(self, key: Hashable, pubkey, commitment) -> int:
+        self.rpc_calls += 1
+        try:
+            lamports = await self.fetch(pubkey, commitment)
+        except Exception:
+            self.errors += 1
+            raise
+        self._values[key] = (lamports, self.clock())
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+        return lamports
+
+    async def _refresh(self, key: Hashable, pubkey, commitment):
+        try:
+            await self._flight.do(key, self._fetch, key, pubkey, commitment)
+        except Exception:
+            logger.warning("Balance refresh for %s failed, serving the cached value", key[0], exc_info=True)
+        finally:
+            self._refreshes.pop(key, None)
+
+    async def get_balance(self, address: str, commitment: Optional[str] = None) -> int:
+        """Balance in lamports; raises ``InvalidAddress`` before any RPC."""
+        pubkey = parse_pubkey(address)
+        key = (str(pubkey), commitment)
+        cached = self._values.get(key)
+        if cached is not None:
+            lamports, fetched_at = cached
+            age = self.clock() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                self._values.move_to_end(key)
+                return lamports
+            if age < self.stale_ttl:
+                self.stale_hits += 1
+                if key not in self._refreshes:
+                    self._refreshes[key] = asyncio.ensure_future(self._refresh(key, pubkey, commitment))
+                return lamports
+        self.misses += 1
+        return await self._flight.do(key, self._fetch, key, pubkey, commitment)
+
+    def prime(self, balances: Dict[str, int], commitment: Optional[str] = None):
+        """Store balances fetched elsewhere (e.g. by a batch refresh) as fresh values."""
+        now = self.clock()
+        for address, lamports in balances.items():
+            key = (address, commitment)
+            self._values[key] = (lamports, now)
+            self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def invalidate(self, address: str, commitment: Optional[str] = None):
+        self._values.pop((str(parse_pubkey(address)), commitment), None)
+
+    async def close(self):
+        for task in list(self._refreshes.values()):
+            task.cancel()
+        self._refreshes.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._values),
+            "lookups": lookups,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self._flight.shared,
+            "rpc_calls": self.rpc_calls,
+            "saved_calls": lookups - self.rpc_calls,
+            "errors": self.errors,
+        }
@@ -0,0 +1,64 @@
+"""Airdrop throughput and fees: packed transactions vs one transfer per transaction.
+
+Starts ``mock_rpc.MockRpc`` on localhost (``RPC_LATENCY_MS`` per request,
+400 ms slots) and pays ``RECIPIENTS`` new addresses with ``AirdropEngine``,
+``CONCURRENCY`` sends at a time, into a fresh database. The same run is
+repeated with one transfer per transaction. Reported: transactions per
+second, lamports of fees per recipient and RPC requests by method.
+
+Run with ``python bench_airdrop.py``.
+"""
+import asyncio
+import os
+import tempfile
+
+from solana.rpc.async_api import AsyncClient
+from solders.keypair import Keypair
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from airdrop import AirdropEngine, add_recipients
+from async_db import DatabaseExecutor
+from database import Base
+from mock_rpc import MockRpc
+
+RECIPIENTS = int(os.getenv("RECIPIENTS", "2000"))
+RPC_LATENCY_MS = float(os.getenv("RPC_LATENCY_MS", "20"))
+CONCURRENCY = int(os.getenv("CONCURRENCY", "8"))
+
+
+async def distribute(label: str, capacity=None):
+    rpc = MockRpc(latency=RPC_LATENCY_MS / 1000)
+    client = AsyncClient(await rpc.start())
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        database = DatabaseExecutor(workers=1, session_factory=sessionmaker(bind=engine))
+        recipients = [(str(Keypair().pubkey()), 1_000_000) for _ in range(RECIPIENTS)]
+        await database.transaction(add_recipients, "bench", recipients)
+        airdrop = AirdropEngine(client, database, Keypair(), "bench", concurrency=CONCURRENCY, poll_interval=0.4)
+        if capacity:
+            airdrop.capacity = capacity
+        try:
+            stats = await airdrop.run()
+        finally:
+            await client.close()
+            await rpc.close()
+            database.close()
+            engine.dispose()
+    assert stats["confirmed_recipients"] == RECIPIENTS and len(rpc.received) == RECIPIENTS
+    requests = ", ".join(f"{method} {count}" for method, count in sorted(rpc.requests.items()))
+    print(f"{label:>9}: {stats['confirmed_transactions']:5d} tx in {stats['seconds']:6.2f} s "
+          f"({stats['transactions_per_second']:6.1f} tx/s, {RECIPIENTS / stats['seconds']:7.1f} recipients/s), "
+          f"fee {stats['fee_per_recipient']:6.1f} lamports/recipient")
+    print(f"{'':>11}RPC: {requests}")
+
+
+async def main():
+    print(f"{RECIPIENTS} recipients, {RPC_LATENCY_MS:.0f} ms RPC latency, concurrency {CONCURRENCY}")
+    await distribute("packed")
+    await distribute("unpacked", capacity=1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
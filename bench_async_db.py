@@ -0,0 +1,107 @@
+"""Event loop stall while many /start updates hit the database at once.
+
+``UPDATES`` updates from different users are fed to the dispatcher at the same
+time; each handler runs ``database.get_or_create_user`` and commits. A ticker
+task wakes up every millisecond and records how late it was: that is how long
+every other chat would have waited. "blocking" runs the queries in the handler
+like the old ``bot.get_or_create_user``, "executor" runs them through
+``DatabaseSessionMiddleware`` on the database threads.
+
+Run with ``python bench_async_db.py``.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import CommandStart
+from aiogram.types import Message, Update
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from async_db import DatabaseExecutor, DatabaseSessionMiddleware, UpdateSession
+from database import Base, get_or_create_user
+
+UPDATES = int(os.getenv("UPDATES", "200"))
+WORKERS = 4
+TICK = 0.001
+
+
+def make_update(update_id):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "Bench"},
+            "text": "/start",
+        },
+    })
+
+
+async def ticker(stalls, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        stalls.append(time.perf_counter() - start - TICK)
+
+
+async def run(blocking: bool, factory):
+    router = Router()
+    dp = Dispatcher()
+    database = DatabaseExecutor(workers=WORKERS, session_factory=factory)
+
+    if blocking:
+        @router.message(CommandStart())
+        async def start(message: Message):
+            db = factory()
+            try:
+                get_or_create_user(db, message.from_user.id)
+                db.commit()
+            finally:
+                db.close()
+    else:
+        dp.update.middleware(DatabaseSessionMiddleware(database))
+
+        @router.message(CommandStart())
+        async def start(message: Message, db: UpdateSession):
+            await db.transaction(get_or_create_user, message.from_user.id)
+
+    dp.include_router(router)
+    bot = Bot(token="42:TEST")
+    offset = 0 if blocking else UPDATES
+    updates = [make_update(offset + i) for i in range(1, UPDATES + 1)]
+
+    stalls, stop = [], asyncio.Event()
+    monitor = asyncio.create_task(ticker(stalls, stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    database.close()
+    await bot.session.close()
+    return elapsed, stalls
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine, expire_on_commit=False)
+        for blocking in (True, False):
+            elapsed, stalls = await run(blocking, factory)
+            stalls.sort()
+            label = "blocking" if blocking else "executor"
+            print(f"{label:>8}: {UPDATES} updates in {elapsed * 1000:7.1f} ms  "
+                  f"loop stall max {stalls[-1] * 1000:6.1f} ms  "
+                  f"p99 {stalls[int(len(stalls) * 0.99)] * 1000:6.1f} ms  "
+                  f"total {sum(stalls) * 1000:7.1f} ms  ({len(stalls)} ticks)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Micro-benchmark: if/elif gettext chain vs. ButtonIndex lookup.
+
+Run with ``python bench_buttons.py``.
+"""
+import gettext
+import timeit
+
+from buttons import ButtonIndex
+
+LABELS = {
+    "about": "ℹ️ About Project",
+    "whitepaper": "📜 Whitepaper",
+    "roadmap": "🗺️ Roadmap",
+    "team": "👥 Team",
+    "our_website": "🌍 Our Website",
+    "socials": "🔗 Social Media",
+    "twitter": "🐦 Twitter",
+    "telegram_channel": "✈️ Telegram Channel",
+    "language": "🌐 Language",
+    "back": "⬅️ Back",
+}
+LANGUAGE_BUTTONS = ["🇬🇧 English", "🇷🇺 Русский"]
+
+
+class FakeCatalog(gettext.NullTranslations):
+    def __init__(self, suffix):
+        super().__init__()
+        self._catalog = {msgid: f"{msgid} [{suffix}]" for msgid in LABELS.values()}
+
+    def gettext(self, message):
+        return self._catalog.get(message, message)
+
+
+class FakeI18n:
+    default_locale = "l0"
+
+    def __init__(self, n_locales):
+        self.locales = {f"l{i}": FakeCatalog(i) for i in range(n_locales)}
+
+    @property
+    def available_locales(self):
+        return tuple(self.locales)
+
+    def gettext(self, singular, locale=None):
+        if locale not in self.locales:
+            return singular
+        return self.locales[locale].gettext(singular)
+
+
+def chain_match(i18n, text, locale):
+    """Same order and lookups as the old handle_text_buttons chain."""
+    _ = i18n.gettext
+    order = ["about", "whitepaper", "roadmap", "team", "our_website", "socials",
+             "twitter", "telegram_channel", "language"]
+    for action in order:
+        if text == _(LABELS[action], locale=locale):
+            return action
+    if text in LANGUAGE_BUTTONS:
+        return "set_language"
+    if text == _(LABELS["back"], locale=locale):
+        return "back"
+    return None
+
+
+def run(n_locales, number=200_000):
+    i18n = FakeI18n(n_locales)
+    locale = f"l{n_locales - 1}"
+    text = i18n.gettext(LABELS["back"], locale=locale)
+    build = timeit.timeit(lambda: ButtonIndex(i18n, LABELS), number=100) / 100
+    index = ButtonIndex(i18n, LABELS)
+    assert chain_match(i18n, text, locale) == index.match(text).action == "back"
+    chain = timeit.timeit(lambda: chain_match(i18n, text, locale), number=number) / number
+    lookup = timeit.timeit(lambda: index.match(text), number=number) / number
+    print(f"{n_locales:>3} locales: chain {chain * 1e9:8.0f} ns  index {lookup * 1e9:6.0f} ns  "
+          f"speedup {chain / lookup:5.1f}x  build {build * 1e6:7.1f} us  entries {len(index)}")
+
+
+if __name__ == "__main__":
+    for n in (10, 50):
+        run(n)
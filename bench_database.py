@@ -0,0 +1,88 @@
+"""Write and read throughput of the "default" and "tuned" SQLite profiles.
+
+Each profile gets a fresh database file. ``USERS`` users are created with
+``database.get_or_create_user``, one transaction each, from ``WORKERS``
+concurrent tasks on a ``DatabaseExecutor`` like the bot does. Then every user
+is looked up by Telegram ID while the same number of balance updates run
+concurrently.
+
+Run with ``python bench_database.py``.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import update
+from sqlalchemy.orm import sessionmaker
+
+from async_db import DatabaseExecutor
+from database import Base, User, get_or_create_user, make_engine
+
+USERS = int(os.getenv("USERS", "2000"))
+WORKERS = 4
+
+
+def find_user(db, telegram_id):
+    return db.query(User.balance).filter(User.by_telegram_id(telegram_id)).scalar()
+
+
+def add_balance(db, telegram_id):
+    db.execute(update(User).where(User.by_telegram_id(telegram_id)).values(balance=User.balance + 1))
+
+
+async def in_parallel(database, fn, ids, transaction):
+    queue = list(ids)
+    call = database.transaction if transaction else database.run
+
+    async def worker():
+        while queue:
+            telegram_id = queue.pop()
+            if transaction:
+                await call(fn, telegram_id)
+            else:
+                await call(_read, fn, database.session_factory, telegram_id)
+
+    await asyncio.gather(*(worker() for _ in range(WORKERS)))
+
+
+def _read(fn, factory, telegram_id):
+    db = factory()
+    try:
+        return fn(db, telegram_id)
+    finally:
+        db.close()
+
+
+async def run(profile):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = make_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}", profile)
+        Base.metadata.create_all(engine)
+        database = DatabaseExecutor(workers=WORKERS, session_factory=sessionmaker(bind=engine, expire_on_commit=False))
+        ids = range(1, USERS + 1)
+
+        start = time.perf_counter()
+        await in_parallel(database, get_or_create_user, ids, transaction=True)
+        writes = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            in_parallel(database, find_user, ids, transaction=False),
+            in_parallel(database, add_balance, ids, transaction=True),
+        )
+        mixed = time.perf_counter() - start
+
+        database.close()
+        engine.dispose()
+    return writes, mixed
+
+
+async def main():
+    for profile in ("default", "tuned"):
+        writes, mixed = await run(profile)
+        print(f"{profile:>7}: inserts {USERS / writes:8.0f}/s  "
+              f"reads+updates {2 * USERS / mixed:8.0f}/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
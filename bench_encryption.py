@@ -0,0 +1,135 @@
+"""Cost of loading encrypted users: eager vs lazy decryption.
+
+``USERS`` users are written to a fresh database. Each scenario loads all of
+them through the ORM and reads some attributes:
+
+* eager, balance: the old mapping, ``EncryptedString`` decrypts every column
+  of every row while loading;
+* lazy, balance: ``database.User`` keeps ciphertexts, nothing is decrypted;
+* lazy, language: every language is decrypted on read, the memo is cold;
+* lazy, language again: same rows, decrypted values come from the memo.
+
+Then all Telegram IDs are decrypted with ``database.decrypt_many``, serially
+and in a process pool. Time is wall clock; memory is the tracemalloc peak of a
+second run.
+
+Run with ``python bench_encryption.py``.
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import Column, Integer, String, create_engine, insert, select
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+USERS = int(os.getenv("USERS", "100000"))
+# Large enough for every value, so the second language pass is served from the memo
+os.environ.setdefault("DECRYPT_CACHE_SIZE", str(USERS))
+
+import database  # noqa: E402
+from database import User, blind_index, decrypt, decrypt_many, encrypt  # noqa: E402
+
+WORKERS = os.cpu_count() or 1
+
+EagerBase = declarative_base()
+
+
+class EncryptedString(String):
+    """The old column type: decrypts while rows are loaded."""
+
+    def bind_processor(self, dialect):
+        def process(value):
+            return encrypt(value) if value is not None else value
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            return decrypt(value) if value is not None else value
+        return process
+
+
+class EagerUser(EagerBase):
+    """The mapping before lazy decryption."""
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(EncryptedString)
+    telegram_id_index = Column(String(64))
+    language = Column(EncryptedString)
+    balance = Column(Integer)
+
+
+def populate(engine):
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        batch = []
+        for telegram_id in range(1, USERS + 1):
+            batch.append({"telegram_id_encrypted": encrypt(str(telegram_id)), "telegram_id_index": blind_index(telegram_id),
+                          "language_encrypted": encrypt("ru" if telegram_id % 3 else "en"), "balance": telegram_id % 100})
+            if len(batch) == 10000:
+                conn.execute(insert(User), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(User), batch)
+
+
+def measure(fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        start = time.perf_counter()
+        populate(engine)
+        print(f"populated {USERS} users in {time.perf_counter() - start:.1f} s")
+        factory = sessionmaker(bind=engine)
+
+        def load(model, attribute, clear_memo=True):
+            def run():
+                if clear_memo:
+                    database.decrypt.cache_clear()
+                db = factory()
+                try:
+                    users = db.scalars(select(model)).all()
+                    for user in users:
+                        getattr(user, attribute)
+                finally:
+                    db.close()
+            return run
+
+        scenarios = [
+            ("eager, balance", load(EagerUser, "balance")),
+            ("lazy, balance", load(User, "balance")),
+            ("lazy, language", load(User, "language")),
+            ("lazy, language again", load(User, "language", clear_memo=False)),
+        ]
+        for label, fn in scenarios:
+            elapsed, peak = measure(fn)
+            print(f"{label:>21}: {elapsed:6.2f} s  peak {peak / 2 ** 20:6.1f} MiB")
+
+        with engine.connect() as conn:
+            ciphertexts = conn.execute(select(User.telegram_id_encrypted)).scalars().all()
+        start = time.perf_counter()
+        decrypt_many(ciphertexts)
+        serial = time.perf_counter() - start
+        with ProcessPoolExecutor(WORKERS) as pool:
+            decrypt_many(ciphertexts[:WORKERS], pool, chunk_size=1)  # Start the workers
+            start = time.perf_counter()
+            decrypt_many(ciphertexts, pool)
+            parallel = time.perf_counter() - start
+        print(f"{'decrypt_many':>21}: serial {serial:.2f} s, {WORKERS} processes {parallel:.2f} s")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Refreshing many wallet balances: per-address getBalance vs batched getMultipleAccounts.
+
+Starts ``mock_rpc.MockRpc`` on localhost with ``RPC_LATENCY_MS`` of latency
+per request and refreshes ``WALLETS`` random addresses through the real
+``AsyncClient``:
+
+* loop: one ``get_balance`` per address, one after another (what calling
+  ``bot.connect_wallet`` for each wallet amounts to);
+* batched: ``wallet_balances.refresh_balances``, 100 addresses per call and
+  ``CONCURRENCY`` calls at a time, then one bulk write to a fresh database.
+
+Run with ``python bench_wallet_balances.py``.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from solana.rpc.async_api import AsyncClient
+from solders.keypair import Keypair
+from solders.pubkey import Pubkey
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from async_db import DatabaseExecutor
+from database import Base, WalletBalance
+from mock_rpc import MockRpc
+from wallet_balances import refresh_balances
+
+WALLETS = int(os.getenv("WALLETS", "2000"))
+RPC_LATENCY_MS = float(os.getenv("RPC_LATENCY_MS", "20"))
+CONCURRENCY = int(os.getenv("CONCURRENCY", "4"))
+
+
+async def main():
+    addresses = [str(Keypair().pubkey()) for _ in range(WALLETS)]
+    rpc = MockRpc(latency=RPC_LATENCY_MS / 1000)
+    url = await rpc.start()
+    client = AsyncClient(url)
+    try:
+        start = time.perf_counter()
+        loop_balances = {}
+        for address in addresses:
+            loop_balances[address] = (await client.get_balance(Pubkey.from_string(address))).value
+        loop_time = time.perf_counter() - start
+        loop_calls = rpc.requests["getBalance"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            Base.metadata.create_all(engine)
+            database = DatabaseExecutor(workers=1, session_factory=sessionmaker(bind=engine))
+            start = time.perf_counter()
+            refresh = await refresh_balances(client, database, addresses, concurrency=CONCURRENCY)
+            batch_time = time.perf_counter() - start
+            with engine.connect() as conn:
+                stored = conn.execute(select(func.count()).select_from(WalletBalance)).scalar()
+            database.close()
+            engine.dispose()
+        batch_calls = rpc.requests["getMultipleAccounts"]
+        assert {address: lamports for address, (lamports, _) in refresh.balances.items()} == loop_balances
+    finally:
+        await client.close()
+        await rpc.close()
+
+    print(f"{WALLETS} wallets, {RPC_LATENCY_MS:.0f} ms RPC latency")
+    print(f"  loop:    {loop_calls:5d} RPC calls, {loop_time:6.2f} s")
+    print(f"  batched: {batch_calls:5d} RPC calls, {batch_time:6.2f} s (concurrency {CONCURRENCY}, "
+          f"{stored} rows written), {loop_time / batch_time:.0f}x faster")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""End-to-end webhook latency with and without inline webhook replies.
+
+A local mock Bot API server stands in for api.telegram.org and adds
+``API_LATENCY`` seconds to every call. Each update is POSTed to the webhook and
+timed until the webhook answered; the reply has reached "Telegram" by then in
+both modes.
+
+Run with ``python bench_webhook_reply.py``.
+"""
+import asyncio
+import statistics
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import ClientSession, web
+
+from webhook_reply import WebhookReplyMiddleware, WebhookReplyRequestMiddleware, respond
+
+API_LATENCY = 0.05
+UPDATES = 50
+TOKEN = "42:TEST"
+
+
+def make_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "text": "⬅️ Back",
+        },
+    }
+
+
+async def start_site(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run(inline: bool):
+    api_calls = []
+
+    async def api_handler(request):
+        api_calls.append(request.match_info["method"])
+        await asyncio.sleep(API_LATENCY)
+        return web.json_response({"ok": True, "result": {
+            "message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "Main menu."}})
+
+    api_app = web.Application()
+    api_app.router.add_post("/bot{token}/{method}", api_handler)
+    api_runner, api_url = await start_site(api_app)
+
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    router = Router()
+
+    @router.message()
+    async def back(message: Message):
+        await respond(message.reply("Main menu."))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    if inline:
+        dp.update.outer_middleware(WebhookReplyMiddleware())
+        bot.session.middleware(WebhookReplyRequestMiddleware())
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=False).register(app, path="/webhook")
+    runner, url = await start_site(app)
+
+    timings = []
+    async with ClientSession() as client:
+        for update_id in range(1, UPDATES + 1):
+            start = time.perf_counter()
+            async with client.post(f"{url}/webhook", json=make_update(update_id)) as response:
+                await response.read()
+            timings.append(time.perf_counter() - start)
+
+    await runner.cleanup()
+    await api_runner.cleanup()
+    await bot.session.close()
+    return timings, len(api_calls)
+
+
+async def main():
+    for inline in (False, True):
+        timings, calls = await run(inline)
+        label = "inline reply" if inline else "separate call"
+        print(f"{label:>13}: median {statistics.median(timings) * 1000:6.1f} ms  "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95)] * 1000:6.1f} ms  API calls {calls}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
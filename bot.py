@@ -10,13 +10,11 @@ import asyncio
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
 from aiogram.utils import executor
+from aiogram.utils.exceptions import RetryAfter
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-import solana
-from solana.rpc.async_api import AsyncClient
-from solders.keypair import Keypair
-from solders.transaction import Transaction
-from solders.system_program import TransferParams, transfer
-from database import SessionLocal, User
+from send_scheduler import SendScheduler
+from async_db import DatabaseExecutor, SingleFlight
+from balance_cache import BalanceCache, InvalidAddress
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -34,13 +32,52 @@ PROJECT_WEBSITE = os.getenv("PROJECT_WEBSITE", "https://example.com")
 SOCIAL_TWITTER = os.getenv("SOCIAL_TWITTER", "https://twitter.com/example")
 SOCIAL_TELEGRAM = os.getenv("SOCIAL_TELEGRAM", "https://t.me/example")
 
+# Ограничение исходящих сообщений (общий лимит и лимит на чат, повтор после 429)
+send_scheduler = SendScheduler(
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", "30")),
+    per_chat_rate=float(os.getenv("SEND_CHAT_RATE", "1")),
+    per_chat_burst=float(os.getenv("SEND_CHAT_BURST", "3")),
+    retry_after=lambda exc: exc.timeout if isinstance(exc, RetryAfter) else None,
+)
+
+class ScheduledBot(Bot):
+    """Bot, все запросы которого проходят через send_scheduler"""
+    async def request(self, method, data=None, *args, **kwargs):
+        chat_id = data.get("chat_id") if data else None
+        if not method.startswith(("send", "copy", "forward", "edit")):
+            chat_id = None
+        return await send_scheduler.submit(
+            chat_id, lambda: super(ScheduledBot, self).request(method, data, *args, **kwargs)
+        )
+
 # Инициализация бота и диспетчера
-bot = Bot(token=TELEGRAM_TOKEN)
+bot = ScheduledBot(token=TELEGRAM_TOKEN)
 dp = Dispatcher(bot)
 
-# Инициализация клиента Solana
+# Клиент Solana и база данных загружаются при первом обращении, а не при старте
 SOLANA_RPC_URL = os.getenv("SOLANA_RPC_URL", "https://api.mainnet-beta.solana.com")
-solana_client = AsyncClient(SOLANA_RPC_URL)
+# Несколько RPC через запятую: запросы идут на самый быстрый, при сбоях - на следующий
+SOLANA_RPC_URLS = [url.strip() for url in os.getenv("SOLANA_RPC_URLS", SOLANA_RPC_URL).split(",") if url.strip()]
+_solana_client = None
+
+def get_solana_client():
+    global _solana_client
+    if _solana_client is None:
+        from rpc_pool import RpcPool
+        _solana_client = RpcPool(SOLANA_RPC_URLS, timeout=float(os.getenv("SOLANA_RPC_TIMEOUT", "10")))
+    return _solana_client
+
+async def fetch_balance(pubkey, commitment):
+    return (await get_solana_client().get_balance(pubkey, commitment)).value
+
+# Балансы кошельков кешируются на BALANCE_CACHE_TTL секунд; до BALANCE_STALE_TTL
+# отдается прежнее значение, пока идет обновление
+balance_cache = BalanceCache(
+    fetch_balance,
+    ttl=float(os.getenv("BALANCE_CACHE_TTL", "10")),
+    stale_ttl=float(os.getenv("BALANCE_STALE_TTL", "60")),
+    maxsize=int(os.getenv("BALANCE_CACHE_SIZE", "10000")),
+)
 
 # Клавиатура для команд
 keyboard = ReplyKeyboardMarkup(
@@ -62,24 +99,25 @@ keyboard = ReplyKeyboardMarkup(
     resize_keyboard=True
 )
 
+# Запросы к базе выполняются в отдельном пуле потоков и не блокируют цикл событий
+db_executor = DatabaseExecutor(workers=int(os.getenv("DB_WORKERS", "4")))
+# Одновременные запросы одного пользователя выполняют один запрос к базе
+user_flight = SingleFlight()
+
 # Функция для получения или создания пользователя
-def get_or_create_user(telegram_id: str):
-    db = SessionLocal()
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        user = User(telegram_id=telegram_id)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    db.close()
-    return user
+async def get_or_create_user(telegram_id: str):
+    import database
+
+    return await user_flight.do(telegram_id, db_executor.transaction, database.get_or_create_user, telegram_id)
 
 # Пример функции для подключения кошелька
 async def connect_wallet(wallet_address: str):
     try:
-        # Проверка баланса кошелька
-        balance = await solana_client.get_balance(wallet_address)
-        return f"Ваш баланс: {balance['result']['value']} лампортов."
+        # Проверка баланса кошелька (адрес проверяется локально до запроса к RPC)
+        balance = await balance_cache.get_balance(wallet_address)
+        return f"Ваш баланс: {balance} лампортов."
+    except InvalidAddress:
+        return "Неверный адрес кошелька Solana."
     except Exception as e:
         return f"Ошибка подключения кошелька: {str(e)}"
 
@@ -87,7 +125,7 @@ async def connect_wallet(wallet_address: str):
 @dp.message_handler(commands=['start'])
 async def send_welcome(message: types.Message):
     """Обработчик команды /start"""
-    user = get_or_create_user(message.from_user.id)
+    user = await get_or_create_user(message.from_user.id)
     await message.reply(
         f"Привет, {message.from_user.first_name}! Ваш текущий баланс: {user.balance} токенов.\n\n"
         f"Ссылки на проект:\n"
@@ -119,7 +157,8 @@ async def buy_tokens(message: types.Message):
 @dp.message_handler(commands=['airdrop'])
 async def airdrop(message: types.Message):
     """Логика участия в эйрдропе"""
-    wallet_address = message.text.split(maxsplit=1)[-1]
+    parts = message.text.split(maxsplit=1)
+    wallet_address = parts[1].strip() if len(parts) > 1 else ""
     if not wallet_address:
         await message.reply("Пожалуйста, укажите адрес вашего кошелька Solana.")
         return
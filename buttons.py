@@ -0,0 +1,54 @@
+"""Lookup index for reply keyboard button labels.
+
+Incoming button presses are plain text messages, so the bot has to work out
+which button was pressed from its localized label. Instead of translating every
+candidate label on every message, the index translates them once per locale and
+maps each label straight to an action.
+"""
+from typing import Dict, NamedTuple, Optional
+
+
+class ButtonMatch(NamedTuple):
+    action: str
+    # Locale the label belongs to. None when the label is identical in several
+    # locales and the caller should keep the user's current locale.
+    locale: Optional[str]
+
+
+class ButtonIndex:
+    def __init__(self, i18n, buttons: Dict[str, str], static_buttons: Optional[Dict[str, ButtonMatch]] = None):
+        """
+        :param i18n: aiogram I18n instance holding the loaded catalogs
+        :param buttons: action -> msgid of the button label
+        :param static_buttons: untranslated label -> match (e.g. language buttons)
+        """
+        self.i18n = i18n
+        self.buttons = dict(buttons)
+        self.static_buttons = dict(static_buttons or {})
+        self._index: Dict[str, ButtonMatch] = {}
+        self.rebuild()
+
+    def rebuild(self):
+        """Re-translate all labels. Call after the catalogs were reloaded."""
+        index: Dict[str, ButtonMatch] = {}
+        for locale in self.i18n.available_locales:
+            for action, msgid in self.buttons.items():
+                label = self.i18n.gettext(msgid, locale=locale)
+                existing = index.get(label)
+                if existing is None:
+                    index[label] = ButtonMatch(action, locale)
+                elif existing.action == action and existing.locale != locale:
+                    index[label] = ButtonMatch(action, None)
+        # Untranslated msgids are what gettext returns for unknown locales
+        for action, msgid in self.buttons.items():
+            index.setdefault(msgid, ButtonMatch(action, None))
+        index.update(self.static_buttons)
+        self._index = index
+
+    def match(self, text: Optional[str]) -> Optional[ButtonMatch]:
+        if text is None:
+            return None
+        return self._index.get(text)
+
+    def __len__(self):
+        return len(self._index)
@@ -0,0 +1,81 @@
+"""Splitting of long texts into Telegram-sized messages.
+
+Telegram limits a message to 4096 characters counted in UTF-16 code units, so
+characters outside the BMP (most emoji) count twice. Texts are split at the
+largest boundary that fits: sections, then paragraphs, lines and words. Only a
+single word longer than the limit is cut, and never inside a surrogate pair.
+"""
+import re
+from typing import Dict, List
+
+MESSAGE_LIMIT = 4096
+
+# (pattern, joiner) from the coarsest to the finest boundary
+BOUNDARIES = [
+    (re.compile(r"\n\n(?=\d+\.\s)"), "\n\n"),  # Numbered sections
+    (re.compile(r"\n\n"), "\n\n"),  # Paragraphs
+    (re.compile(r"\n"), "\n"),  # Lines and table rows
+    (re.compile(r" "), " "),  # Words
+]
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _hard_split(text: str, limit: int) -> List[str]:
+    chunks, start, size = [], 0, 0
+    for i, char in enumerate(text):
+        width = 2 if ord(char) > 0xFFFF else 1
+        if size + width > limit:
+            chunks.append(text[start:i])
+            start, size = i, 0
+        size += width
+    chunks.append(text[start:])
+    return chunks
+
+
+def _split(text: str, limit: int, level: int) -> List[str]:
+    if utf16_len(text) <= limit:
+        return [text]
+    if level == len(BOUNDARIES):
+        return _hard_split(text, limit)
+    pattern, joiner = BOUNDARIES[level]
+    joiner_len = utf16_len(joiner)
+    chunks: List[str] = []
+    current, current_len = None, 0
+    for piece in pattern.split(text):
+        piece_len = utf16_len(piece)
+        if current is not None and current_len + joiner_len + piece_len <= limit:
+            current += joiner + piece
+            current_len += joiner_len + piece_len
+            continue
+        if current is not None:
+            chunks.append(current)
+        if piece_len <= limit:
+            current, current_len = piece, piece_len
+        else:
+            chunks.extend(_split(piece, limit, level + 1))
+            current, current_len = None, 0
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Split text into chunks of at most ``limit`` UTF-16 code units."""
+    return [chunk for chunk in _split(text, limit, 0) if chunk.strip()]
+
+
+def prechunk(contents: Dict[str, str], limit: int = MESSAGE_LIMIT) -> Dict[str, List[str]]:
+    """Split every locale of a content mapping once."""
+    return {locale: split_message(text, limit) for locale, text in contents.items()}
+
+
+async def send_chunks(bot, chat_id: int, chunks: List[str], **kwargs):
+    """Send chunks in order, each one after the previous was delivered.
+
+    Concurrent requests to one chat may arrive in any order, so they are not
+    overlapped. Pacing is left to the bot's session (``SendScheduler``).
+    """
+    return [await bot.send_message(chat_id, chunk, **kwargs) for chunk in chunks]
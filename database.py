@@ -1,43 +1,443 @@
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import create_engine, event, Column, ForeignKey, Index, Integer, BigInteger, Float, String, inspect, select, text, update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from dotenv import load_dotenv
+from concurrent.futures import Executor
+from functools import lru_cache
+from typing import Iterable, List, Optional
+import hashlib
+import hmac
+import logging
 import os
 
+logger = logging.getLogger("GrapheneBot.database")
+
+load_dotenv()
+
 # Настройка базы данных
-DATABASE_URL = "sqlite:///./graphene.db"
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./graphene.db")
+# "tuned": WAL и прагмы ниже; "default": настройки SQLite и SQLAlchemy по умолчанию
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Прагмы профиля "tuned", каждую можно переопределить через SQLITE_<ИМЯ>
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),  # Читатели не блокируют писателя
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # В WAL fsync только на checkpoint
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),  # мс ожидания блокировки
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # Отрицательное значение - КиБ (64 МиБ)
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+def make_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE):
+    """Движок с выбранным профилем; прагмы применяются к каждому новому соединению"""
+    if profile == "default" or not url.startswith("sqlite"):
+        return create_engine(url)
+    if profile != "tuned":
+        raise ValueError(f"Unknown DB_PROFILE: {profile}")
+    options = {}
+    if ":memory:" not in url and url.rstrip("/") != "sqlite:":
+        # Соединения переиспользуются потоками пула базы данных
+        options = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_SIZE, pool_timeout=DB_POOL_TIMEOUT)
+    new_engine = create_engine(
+        url,
+        connect_args={"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000, "check_same_thread": False},
+        **options,
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return new_engine
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-# Генерация ключа шифрования
-SECRET_KEY = os.getenv("SECRET_KEY", Fernet.generate_key().decode())
-fernet = Fernet(SECRET_KEY)
-
-# Пример шифрования и дешифрования
-class EncryptedString(String):
-    def bind_processor(self, dialect):
-        def process(value):
-            if value is not None:
-                return fernet.encrypt(value.encode()).decode()
-            return value
-        return process
-
-    def result_processor(self, dialect, coltype):
-        def process(value):
-            if value is not None:
-                return fernet.decrypt(value.encode()).decode()
-            return value
-        return process
+# Ключи шифрования. SECRET_KEYS - список через запятую: первым шифруются новые
+# значения, остальные только расшифровывают (ротация: новый ключ в начало,
+# затем reencrypt.py). Без переменных ключ создается один раз и хранится в
+# SECRET_KEY_FILE, чтобы после перезапуска данные оставались читаемыми
+SECRET_KEY_FILE = os.getenv("SECRET_KEY_FILE", "./graphene.key")
+
+def _persisted_key(path: str, new_key: str, name: str) -> str:
+    """Ключ из файла path; если файла нет, в него один раз записывается new_key"""
+    try:
+        with open(path) as key_file:
+            return key_file.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, "w") as key_file:
+            key_file.write(new_key)
+        logger.warning("%s is not set, generated a new key in %s", name, path)
+    except FileExistsError:
+        # Другой процесс создал файл одновременно с нами
+        with open(path) as key_file:
+            return key_file.read().strip()
+    except OSError:
+        logger.warning("%s is not set and %s is not writable: data will not survive a restart", name, path)
+    return new_key
+
+def load_keys() -> List[str]:
+    configured = os.getenv("SECRET_KEYS") or os.getenv("SECRET_KEY")
+    if configured:
+        return [key.strip() for key in configured.split(",") if key.strip()]
+    return [_persisted_key(SECRET_KEY_FILE, Fernet.generate_key().decode(), "SECRET_KEY")]
+
+SECRET_KEYS = load_keys()
+SECRET_KEY = SECRET_KEYS[0]
+fernet = MultiFernet([Fernet(key) for key in SECRET_KEYS])
+
+# Ключ слепого индекса не зависит от SECRET_KEYS: ротация ключей шифрования и
+# удаление старых ключей не меняют telegram_id_index. Без BLIND_INDEX_KEY ключ
+# записывается один раз в BLIND_INDEX_KEY_FILE; первое значение выводится из
+# самого старого ключа кольца, как раньше, поэтому индекс существующих баз
+# остается верным. При смене ключа индекс нужно пересчитать
+# (migrate_blind_index(rebuild=True)), иначе init_db откажется работать
+BLIND_INDEX_KEY_FILE = os.getenv("BLIND_INDEX_KEY_FILE", "./graphene.index.key")
+BLIND_INDEX_KEY = os.getenv("BLIND_INDEX_KEY") or _persisted_key(
+    BLIND_INDEX_KEY_FILE,
+    hmac.new(SECRET_KEYS[-1].encode(), b"graphene-blind-index", hashlib.sha256).hexdigest(),
+    "BLIND_INDEX_KEY",
+)
+
+def blind_index(value) -> str:
+    """Детерминированный HMAC-SHA256 от значения: по нему ищут, расшифровка не нужна"""
+    return hmac.new(BLIND_INDEX_KEY.encode(), str(value).encode(), hashlib.sha256).hexdigest()
+
+# Размер памяти шифротекст -> открытый текст
+DECRYPT_CACHE_SIZE = int(os.getenv("DECRYPT_CACHE_SIZE", "10000"))
+
+def encrypt(value: str) -> str:
+    return fernet.encrypt(value.encode()).decode()
+
+@lru_cache(maxsize=DECRYPT_CACHE_SIZE)
+def decrypt(ciphertext: str) -> str:
+    """Расшифровка с памятью: шифротекст одного значения не меняется, пока его не перезапишут"""
+    return fernet.decrypt(ciphertext.encode()).decode()
+
+def _decrypt_chunk(keys: List[str], ciphertexts: List[Optional[str]]) -> List[Optional[str]]:
+    chunk_fernet = MultiFernet([Fernet(key) for key in keys])
+    return [chunk_fernet.decrypt(value.encode()).decode() if value is not None else None for value in ciphertexts]
+
+def decrypt_many(ciphertexts: Iterable[Optional[str]], pool: Optional[Executor] = None, chunk_size: int = 2000) -> List[Optional[str]]:
+    """Расшифровка большого набора значений; с пулом процессов - параллельно по порциям.
+
+    Ключи передаются в каждую порцию, поэтому подходит и пул с запуском spawn.
+    """
+    values = list(ciphertexts)
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if pool is None:
+        results = [_decrypt_chunk(SECRET_KEYS, chunk) for chunk in chunks]
+    else:
+        results = pool.map(_decrypt_chunk, [SECRET_KEYS] * len(chunks), chunks)
+    return [value for chunk in results for value in chunk]
+
+def _encrypt_chunk(key: str, values: List[Optional[str]]) -> List[Optional[str]]:
+    chunk_fernet = Fernet(key)
+    return [chunk_fernet.encrypt(value.encode()).decode() if value is not None else None for value in values]
+
+def encrypt_many(values: Iterable[Optional[str]], pool: Optional[Executor] = None, chunk_size: int = 2000) -> List[Optional[str]]:
+    """Шифрование большого набора значений основным ключом, как decrypt_many"""
+    values = list(values)
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if pool is None:
+        results = [_encrypt_chunk(SECRET_KEY, chunk) for chunk in chunks]
+    else:
+        results = pool.map(_encrypt_chunk, [SECRET_KEY] * len(chunks), chunks)
+    return [value for chunk in results for value in chunk]
+
+class EncryptedAttribute:
+    """Открытое значение зашифрованной колонки; расшифровывается только при чтении.
+
+    Колонка хранит шифротекст как есть, поэтому загрузка строк (например, ради
+    balance) ничего не расшифровывает.
+    """
+
+    def __init__(self, column: str):
+        self.column = column
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        ciphertext = getattr(obj, self.column)
+        return decrypt(ciphertext) if ciphertext is not None else None
+
+    def __set__(self, obj, value):
+        setattr(obj, self.column, encrypt(str(value)) if value is not None else None)
 
 # Модель пользователя
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    telegram_id = Column(EncryptedString, unique=True, index=True)
-    language = Column(EncryptedString, default="en")
-    balance = Column(Integer, default=0)
+    # Fernet рандомизирован, поэтому искать по telegram_id нельзя; значение хранится для отображения.
+    # Колонки содержат шифротекст, открытые значения - telegram_id и language ниже
+    telegram_id_encrypted = Column("telegram_id", String, key="telegram_id_encrypted")
+    # Слепой индекс telegram_id: все поиски по Telegram ID идут через него
+    telegram_id_index = Column(String(64), unique=True, index=True)
+    language_encrypted = Column("language", String, key="language_encrypted", default=lambda: encrypt("en"))
+    balance = Column(Integer, default=0, index=True)
+
+    language = EncryptedAttribute("language_encrypted")
+    _telegram_id = EncryptedAttribute("telegram_id_encrypted")
+
+    @property
+    def telegram_id(self) -> Optional[str]:
+        return self._telegram_id
+
+    @telegram_id.setter
+    def telegram_id(self, value):
+        self._telegram_id = value
+        self.telegram_id_index = blind_index(value) if value is not None else None
+
+    @classmethod
+    def by_telegram_id(cls, telegram_id):
+        """Условие поиска пользователя по Telegram ID (проба уникального индекса)"""
+        return cls.telegram_id_index == blind_index(telegram_id)
+
+# Обработанные обновления Telegram (защита от повторной доставки вебхука)
+class ProcessedUpdate(Base):
+    __tablename__ = "processed_updates"
+
+    update_id = Column(BigInteger, primary_key=True)
+    seen_at = Column(Float, nullable=False, index=True)
+
+# Загруженные в Telegram документы: file_id по имени, языку и хешу текста
+class DocumentFile(Base):
+    __tablename__ = "document_files"
+
+    name = Column(String, primary_key=True)
+    locale = Column(String, primary_key=True)
+    content_hash = Column(String, primary_key=True)
+    file_id = Column(String, nullable=False)
+
+# Журнал баланса: только добавление записей. users.balance - текущая сумма записей
+# пользователя, меняется тем же запросом, что добавляет запись (см. ledger.py)
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+    __table_args__ = (Index("ix_ledger_entries_user_time", "user_id", "created_at"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)
+    operation = Column(String, index=True)  # Общий id записей одной массовой операции
+    created_at = Column(Float, nullable=False)
+
+# Снимки баланса: сумма записей пользователя с id <= last_entry_id. Снимок
+# считается по id, а не по времени: запись, добавленная позже с более ранним
+# created_at, попадает в следующий снимок
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    taken_at = Column(Float, primary_key=True)
+    balance = Column(Integer, nullable=False)
+    last_entry_id = Column(Integer, nullable=False, default=0)
+
+# Последние известные балансы кошельков Solana (см. wallet_balances.py)
+class WalletBalance(Base):
+    __tablename__ = "wallet_balances"
+
+    address = Column(String, primary_key=True)
+    lamports = Column(BigInteger, nullable=False)
+    slot = Column(BigInteger, nullable=False)  # Слот ответа RPC: более старый ответ не перезаписывает новый
+    updated_at = Column(Float, nullable=False)
+
+# Переводы эйрдропа (см. airdrop.py). Подпись записывается до отправки
+# транзакции, поэтому после сбоя перевод не отправляется повторно, пока не
+# истечет ее blockhash
+class AirdropTransfer(Base):
+    __tablename__ = "airdrop_transfers"
+
+    airdrop = Column(String, primary_key=True)
+    address = Column(String, primary_key=True)
+    lamports = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, sent, confirmed, failed
+    signature = Column(String, index=True)
+    last_valid_block_height = Column(BigInteger)
+    error = Column(String)
+    updated_at = Column(Float, nullable=False)
+
+# Прогресс долгих фоновых задач (например, перешифрования): последний обработанный id
+class JobCheckpoint(Base):
+    __tablename__ = "job_checkpoints"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    rows = Column(Integer, nullable=False, default=0)
+    updated_at = Column(Float, nullable=False)
+
+# Примененные миграции схемы (см. migrations.py); версия базы - максимальная version
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(Float, nullable=False)
+    seconds = Column(Float, nullable=False)
+
+# Заполнение слепого индекса в существующих базах порциями
+def migrate_blind_index(bind=None, chunk_size: int = 1000, rebuild: bool = False) -> int:
+    """Добавляет users.telegram_id_index и заполняет его, не загружая таблицу целиком.
+
+    Строки читаются порциями по возрастанию id. Дубликаты одного Telegram ID,
+    созданные раньше из-за неработающего поиска, сливаются в самую старую
+    запись: балансы складываются, язык берется из самой новой, записи журнала
+    баланса переходят к ней, а снимки обоих удаляются (их пересчитает
+    следующий ledger.snapshot). Строки, которые не расшифровываются текущим
+    SECRET_KEY, пропускаются. Возвращает число проиндексированных и слитых строк.
+    """
+    bind = bind if bind is not None else engine
+    # До миграции 3 журнала баланса еще нет
+    has_ledger = inspect(bind).has_table(LedgerEntry.__tablename__)
+    columns = {column["name"] for column in inspect(bind).get_columns(User.__tablename__)}
+    with bind.begin() as conn:
+        if "telegram_id_index" not in columns:
+            conn.execute(text("ALTER TABLE users ADD COLUMN telegram_id_index VARCHAR(64)"))
+        if rebuild:
+            conn.execute(update(User).values(telegram_id_index=None))
+    indexed = merged = skipped = 0
+    last_id = 0
+    session = sessionmaker(bind=bind)()
+    try:
+        while True:
+            # Шифротекст читается как есть и расшифровывается построчно
+            rows = session.execute(
+                select(User.id, User.telegram_id_encrypted.label("telegram_id"),
+                       User.language_encrypted.label("language"), User.balance)
+                .where(User.telegram_id_index.is_(None), User.id > last_id)
+                .order_by(User.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            indexes = {}
+            for row in rows:
+                if row.telegram_id is None:
+                    continue
+                try:
+                    indexes[row.id] = blind_index(fernet.decrypt(row.telegram_id.encode()).decode())
+                except InvalidToken:
+                    skipped += 1
+            owners = dict(session.execute(
+                select(User.telegram_id_index, User.id).where(User.telegram_id_index.in_(set(indexes.values())))
+            ).all())
+            updates, duplicates = [], []
+            for row in rows:
+                index = indexes.get(row.id)
+                if index is None:
+                    continue
+                owner = owners.get(index)
+                if owner is None:
+                    owners[index] = row.id
+                    updates.append({"id": row.id, "telegram_id_index": index})
+                else:
+                    duplicates.append((owner, row))
+            if updates:
+                session.execute(update(User), updates)
+            for owner, row in duplicates:
+                if has_ledger:
+                    session.execute(update(LedgerEntry).where(LedgerEntry.user_id == row.id).values(user_id=owner))
+                    session.execute(delete(BalanceSnapshot).where(BalanceSnapshot.user_id.in_((owner, row.id))))
+                session.execute(update(User).where(User.id == owner)
+                                .values(balance=User.balance + (row.balance or 0),
+                                        language_encrypted=row.language))
+                session.execute(delete(User).where(User.id == row.id))
+            session.commit()
+            indexed += len(updates)
+            merged += len(duplicates)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    with bind.begin() as conn:
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_telegram_id_index ON users (telegram_id_index)"))
+    if indexed or merged or skipped:
+        logger.info("Blind index: %d rows indexed, %d duplicates merged, %d not decryptable", indexed, merged, skipped)
+    return indexed + merged
+
+class BlindIndexMismatch(RuntimeError):
+    pass
+
+def check_blind_index(bind=None):
+    """Сверяет сохраненный слепой индекс одной строки с текущим BLIND_INDEX_KEY.
+
+    С другим ключом ни один поиск по Telegram ID не находит пользователя, а
+    get_or_create_user создает дубликаты, поэтому работать дальше нельзя.
+    """
+    bind = bind if bind is not None else engine
+    with bind.connect() as conn:
+        row = conn.execute(
+            select(User.telegram_id_encrypted, User.telegram_id_index)
+            .where(User.telegram_id_index.is_not(None)).order_by(User.id).limit(1)
+        ).first()
+    if row is None:
+        return
+    try:
+        telegram_id = decrypt(row.telegram_id_encrypted)
+    except InvalidToken:
+        logger.warning("Blind index check skipped: the sample row does not decrypt with SECRET_KEYS")
+        return
+    if blind_index(telegram_id) != row.telegram_id_index:
+        raise BlindIndexMismatch(
+            "telegram_id_index was built with another BLIND_INDEX_KEY: restore that key "
+            "or rebuild the index with migrate_blind_index(rebuild=True)"
+        )
+
+# Проверка версии схемы при первом обращении к базе, а не при импорте.
+# Миграции применяются отдельно: python migrations.py upgrade
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0") == "1"
+_initialized = False
+
+def init_db():
+    """Проверка версии схемы и ключа слепого индекса.
+
+    Устаревшая база - ошибка (или миграция при DB_AUTO_MIGRATE=1).
+    """
+    global _initialized
+    if not _initialized:
+        import migrations
+
+        if DB_AUTO_MIGRATE:
+            migrations.upgrade(engine)
+        else:
+            migrations.check(engine)
+        check_blind_index(engine)
+        _initialized = True
+
+def get_session(**kwargs):
+    """Новая сессия; при первом вызове проверяет версию схемы"""
+    init_db()
+    return SessionLocal(**kwargs)
+
+def get_or_create_user(db, telegram_id) -> User:
+    """Пользователь по Telegram ID; коммит за вызывающим.
 
-# Создание таблиц
-Base.metadata.create_all(bind=engine)
+    Существующий пользователь - одно чтение по слепому индексу, без записи.
+    Нового вставляет INSERT ... ON CONFLICT DO NOTHING RETURNING; если строку
+    успел вставить параллельный запрос, она читается еще раз.
+    """
+    index = blind_index(telegram_id)
+    query = select(User).where(User.telegram_id_index == index).execution_options(populate_existing=True)
+    user = db.scalars(query).first()
+    if user is None:
+        stmt = sqlite_insert(User).values(telegram_id_encrypted=encrypt(str(telegram_id)), telegram_id_index=index)
+        stmt = stmt.on_conflict_do_nothing(index_elements=[User.telegram_id_index]).returning(User)
+        user = db.scalars(stmt, execution_options={"populate_existing": True}).first() or db.scalars(query).one()
+    return user
@@ -0,0 +1,124 @@
+"""Dropping of re-delivered webhook updates.
+
+Telegram delivers an update again when the webhook answered slowly or with an
+error. ``UpdateDeduplicator`` remembers recently seen ``update_id``s in a ring
+buffer with a set for lookups and drops repeats before any handler runs. If
+the handler (or claiming the id) fails, the claim is released, so Telegram's
+redelivery of the update is handled instead of dropped. An optional store
+(``SQLiteUpdateStore``) shares the seen ids between processes and restarts.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Deque, Optional, Set, Tuple
+
+
+class SQLiteUpdateStore:
+    """Claims update ids in ``database.ProcessedUpdate``.
+
+    :param write_lock: held while writing, e.g. ``DatabaseExecutor.write_lock``
+    """
+
+    def __init__(self, ttl: float, prune_every: int = 1000, write_lock=None):
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.write_lock = write_lock or nullcontext()
+        self._claims = 0
+
+    def claim(self, update_id: int) -> bool:
+        """True if the id was not seen before; atomic across processes."""
+        from sqlalchemy import delete
+        from sqlalchemy.dialects.sqlite import insert
+
+        from database import ProcessedUpdate, engine, init_db
+
+        init_db()
+        now = time.time()
+        with self.write_lock, engine.begin() as conn:
+            result = conn.execute(
+                insert(ProcessedUpdate).values(update_id=update_id, seen_at=now).on_conflict_do_nothing()
+            )
+            self._claims += 1
+            if self._claims % self.prune_every == 0:
+                conn.execute(delete(ProcessedUpdate).where(ProcessedUpdate.seen_at < now - self.ttl))
+        return result.rowcount == 1
+
+    def release(self, update_id: int):
+        """Forget a claimed id whose handling failed."""
+        from sqlalchemy import delete
+
+        from database import ProcessedUpdate, engine
+
+        with self.write_lock, engine.begin() as conn:
+            conn.execute(delete(ProcessedUpdate).where(ProcessedUpdate.update_id == update_id))
+
+
+class UpdateDeduplicator:
+    def __init__(self, ttl: float = 3600, maxsize: int = 100000, store=None, clock=time.monotonic,
+                 run: Optional[Callable[..., Awaitable]] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.store = store
+        self.run = run or asyncio.to_thread  # Runs store calls off the event loop
+        self.clock = clock
+        self._ring: Deque[Tuple[int, float]] = deque()
+        self._seen: Set[int] = set()
+        self.dropped = 0
+
+    def _forget_oldest(self):
+        self._seen.discard(self._ring.popleft()[0])
+
+    def seen(self, update_id: int) -> bool:
+        """Check the in-memory window and record the id if it is new."""
+        now = self.clock()
+        while self._ring and self._ring[0][1] <= now:
+            self._forget_oldest()
+        if update_id in self._seen:
+            return True
+        while len(self._ring) >= self.maxsize:
+            self._forget_oldest()
+        self._seen.add(update_id)
+        self._ring.append((update_id, now + self.ttl))
+        return False
+
+    def forget(self, update_id: int):
+        """Remove an id from the in-memory window."""
+        if update_id not in self._seen:
+            return
+        self._seen.discard(update_id)
+        for entry in reversed(self._ring):
+            if entry[0] == update_id:
+                self._ring.remove(entry)
+                break
+
+    async def release(self, update_id: int):
+        self.forget(update_id)
+        if self.store is not None:
+            await self.run(self.store.release, update_id)
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        duplicate = self.seen(update_id)
+        if not duplicate and self.store is not None:
+            try:
+                duplicate = not await self.run(self.store.claim, update_id)
+            except Exception:
+                self.forget(update_id)
+                raise
+        if duplicate:
+            self.dropped += 1
+        return duplicate
+
+    async def __call__(self, handler, event, data):
+        """Outer update middleware."""
+        if await self.is_duplicate(event.update_id):
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            # Not handled: the redelivery must not be dropped
+            await self.release(event.update_id)
+            raise
+
+    def stats(self) -> dict:
+        return {"tracked": len(self._seen), "dropped": self.dropped}
@@ -0,0 +1,165 @@
+"""Upload-once delivery of long documents.
+
+Instead of sending a document as several text messages, it is sent as a .txt
+file. The first send uploads the file; Telegram's ``file_id`` of the upload is
+stored under the document name, locale and a hash of the text, and every later
+send reuses it with a single small API call. Changing the text changes the
+hash, so a new file is uploaded automatically.
+
+Only the first upload of a document is serialized; sends that reuse a stored
+``file_id`` run in parallel. A stored ``file_id`` is dropped only when
+Telegram says the file identifier itself is invalid, not for errors about
+the chat.
+"""
+import asyncio
+import hashlib
+import logging
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+logger = logging.getLogger("GrapheneBot.document_cache")
+
+Key = Tuple[str, str, str]
+
+# Parts of Telegram error descriptions about the file_id itself
+INVALID_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file_reference", "file reference")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def is_invalid_file_id(exc: TelegramBadRequest) -> bool:
+    message = exc.message.lower()
+    return any(part in message for part in INVALID_FILE_ID_ERRORS)
+
+
+class MemoryDocumentStore:
+    def __init__(self):
+        self.data: Dict[Key, str] = {}
+
+    def load(self, key: Key) -> Optional[str]:
+        return self.data.get(key)
+
+    def save(self, key: Key, file_id: str):
+        self.data[key] = file_id
+
+    def delete(self, key: Key):
+        self.data.pop(key, None)
+
+
+class SQLiteDocumentStore:
+    """Keeps file_ids in ``database.DocumentFile`` so they survive restarts.
+
+    :param write_lock: held while writing, e.g. ``DatabaseExecutor.write_lock``
+    """
+
+    def __init__(self, write_lock=None):
+        self.write_lock = write_lock or nullcontext()
+
+    def load(self, key: Key) -> Optional[str]:
+        from database import DocumentFile, get_session
+
+        db = get_session()
+        try:
+            row = db.get(DocumentFile, key)
+            return row.file_id if row else None
+        finally:
+            db.close()
+
+    def save(self, key: Key, file_id: str):
+        from database import DocumentFile, get_session
+
+        db = get_session()
+        try:
+            name, locale, digest = key
+            with self.write_lock:
+                db.merge(DocumentFile(name=name, locale=locale, content_hash=digest, file_id=file_id))
+                db.commit()
+        finally:
+            db.close()
+
+    def delete(self, key: Key):
+        from database import DocumentFile, get_session
+
+        db = get_session()
+        try:
+            with self.write_lock:
+                row = db.get(DocumentFile, key)
+                if row:
+                    db.delete(row)
+                    db.commit()
+        finally:
+            db.close()
+
+
+class DocumentCache:
+    def __init__(self, store=None, run: Optional[Callable[..., Awaitable]] = None):
+        self.store = store if store is not None else MemoryDocumentStore()
+        self.run = run or asyncio.to_thread  # Runs store calls off the event loop
+        self._file_ids: Dict[Key, str] = {}
+        self._locks: Dict[Key, asyncio.Lock] = {}
+        self.uploads = 0
+        self.reuses = 0
+
+    async def _file_id(self, key: Key) -> Optional[str]:
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = await self.run(self.store.load, key)
+            if file_id is not None:
+                self._file_ids[key] = file_id
+        return file_id
+
+    async def _forget(self, key: Key, file_id: str):
+        if self._file_ids.get(key, file_id) != file_id:
+            return  # Already replaced by a new upload
+        self._file_ids.pop(key, None)
+        await self.run(self.store.delete, key)
+
+    async def _reuse(self, bot, chat_id: int, key: Key, file_id: str, **kwargs):
+        """Send by ``file_id``; None if Telegram rejected the id itself."""
+        try:
+            result = await bot.send_document(chat_id, file_id, **kwargs)
+        except TelegramBadRequest as exc:
+            if not is_invalid_file_id(exc):
+                raise  # About this chat or request; the file is fine
+            logger.warning("Stored file_id for %s/%s was rejected, uploading again", key[0], key[1])
+            await self._forget(key, file_id)
+            return None
+        self.reuses += 1
+        return result
+
+    async def _upload(self, bot, chat_id: int, key: Key, text: str, filename: str, **kwargs):
+        document = BufferedInputFile(text.encode("utf-8"), filename=filename)
+        result = await bot.send_document(chat_id, document, **kwargs)
+        self.uploads += 1
+        file_id = result.document.file_id
+        self._file_ids[key] = file_id
+        await self.run(self.store.save, key, file_id)
+        return result
+
+    async def send(self, bot, chat_id: int, name: str, locale: str, text: str, filename: Optional[str] = None, **kwargs):
+        """Send ``text`` as a document, uploading it only the first time."""
+        key = (name, locale, content_hash(text))
+        filename = filename or f"{name}_{locale}.txt"
+        file_id = await self._file_id(key)
+        if file_id is not None:
+            result = await self._reuse(bot, chat_id, key, file_id, **kwargs)
+            if result is not None:
+                return result
+        # Concurrent first requests for one document wait for a single upload
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            file_id = await self._file_id(key)
+            if file_id is None:
+                return await self._upload(bot, chat_id, key, text, filename, **kwargs)
+        # Uploaded by another request while this one waited
+        result = await self._reuse(bot, chat_id, key, file_id, **kwargs)
+        if result is None:
+            result = await self._upload(bot, chat_id, key, text, filename, **kwargs)
+        return result
+
+    def stats(self) -> dict:
+        return {"uploads": self.uploads, "reuses": self.reuses, "cached": len(self._file_ids)}
@@ -0,0 +1,64 @@
+"""Inline keyboard menus that are edited in place.
+
+The reply keyboard menu sends a new message for every navigation step. With
+inline keyboards the bot edits the message that holds the menu instead, so a
+session keeps a single menu message in the chat. Buttons carry compact
+callback data: a prefix, a short action code and an optional argument, e.g.
+``n:a`` or ``n:l:ru``.
+"""
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+
+class MenuButton(NamedTuple):
+    label: str  # msgid, or the literal label when translate is False
+    action: Optional[str] = None
+    arg: Optional[str] = None
+    web_app: bool = False
+    translate: bool = True
+
+
+class InlineMenu:
+    def __init__(self, i18n, menus: Dict[str, List[List[MenuButton]]], codes: Dict[str, str],
+                 webapp_url: Callable[[], str], prefix: str = "n"):
+        """
+        :param menus: menu name -> rows of buttons
+        :param codes: action -> short code used in callback data; keep codes stable,
+            old messages still carry them
+        :param webapp_url: returns the URL of web app buttons
+        """
+        self.i18n = i18n
+        self.menus = menus
+        self.codes = codes
+        self.actions = {code: action for action, code in codes.items()}
+        self.webapp_url = webapp_url
+        self.prefix = prefix + ":"
+        self._keyboards: Dict[Tuple[str, str], InlineKeyboardMarkup] = {}
+
+    def encode(self, action: str, arg: Optional[str] = None) -> str:
+        data = self.prefix + self.codes[action]
+        return f"{data}:{arg}" if arg else data
+
+    def decode(self, data: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """(action, arg) of callback data, (None, None) if it is not ours."""
+        if not data or not data.startswith(self.prefix):
+            return None, None
+        code, _, arg = data[len(self.prefix):].partition(":")
+        return self.actions.get(code), arg or None
+
+    def _button(self, button: MenuButton, locale: str) -> InlineKeyboardButton:
+        text = self.i18n.gettext(button.label, locale=locale) if button.translate else button.label
+        if button.web_app:
+            return InlineKeyboardButton(text=text, web_app=WebAppInfo(url=self.webapp_url()))
+        return InlineKeyboardButton(text=text, callback_data=self.encode(button.action, button.arg))
+
+    def keyboard(self, menu: str, locale: str) -> InlineKeyboardMarkup:
+        markup = self._keyboards.get((menu, locale))
+        if markup is None:
+            rows = [[self._button(button, locale) for button in row] for row in self.menus[menu]]
+            markup = self._keyboards[(menu, locale)] = InlineKeyboardMarkup(inline_keyboard=rows)
+        return markup
+
+    def invalidate(self):
+        self._keyboards = {}
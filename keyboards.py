@@ -0,0 +1,93 @@
+"""Per-locale cache of reply keyboards.
+
+Keyboards only depend on the locale and on configured URLs, so each one is built
+once, frozen and stored together with its serialized ``reply_markup`` payload.
+``KeyboardPayloadSession`` sends that payload as is instead of dumping the model
+again on every request.
+"""
+import json
+from typing import Callable, Dict, Optional, Tuple
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import ReplyKeyboardMarkup
+from aiohttp import FormData
+from pydantic import ConfigDict
+
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """Shared between all replies, so it must not be modified."""
+    model_config = ConfigDict(frozen=True)
+
+
+def _prune(value):
+    # Same shape as BaseSession.prepare_value produces: no None fields
+    if isinstance(value, dict):
+        return {k: _prune(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_prune(v) for v in value if v is not None]
+    return value
+
+
+class KeyboardRegistry:
+    def __init__(self, builders: Optional[Dict[str, Callable[[str], ReplyKeyboardMarkup]]] = None):
+        """
+        :param builders: keyboard name -> function building the markup for a locale
+        """
+        self.builders = dict(builders or {})
+        self._markups: Dict[Tuple[str, str], FrozenReplyKeyboardMarkup] = {}
+        self._payloads: Dict[int, Tuple[FrozenReplyKeyboardMarkup, str]] = {}
+
+    def register(self, name: str, builder: Callable[[str], ReplyKeyboardMarkup]):
+        self.builders[name] = builder
+        for key in [key for key in self._markups if key[0] == name]:
+            self._payloads.pop(id(self._markups.pop(key)), None)
+
+    def get(self, name: str, locale: str) -> FrozenReplyKeyboardMarkup:
+        markup = self._markups.get((name, locale))
+        if markup is None:
+            built = self.builders[name](locale)
+            markup = FrozenReplyKeyboardMarkup.model_validate(built.model_dump())
+            self._payloads[id(markup)] = (markup, json.dumps(_prune(markup.model_dump(warnings=False))))
+            self._markups[(name, locale)] = markup
+        return markup
+
+    def payload(self, markup) -> Optional[str]:
+        """Serialized ``reply_markup`` for a markup returned by ``get``."""
+        entry = self._payloads.get(id(markup))
+        # Entries hold a reference to their markup, so a matching id() is only
+        # reused after the markup was dropped; the identity check covers that case
+        if entry is not None and entry[0] is markup:
+            return entry[1]
+        return None
+
+    def invalidate(self):
+        """Drop all cached keyboards, e.g. after locales or URLs changed."""
+        self._markups = {}
+        self._payloads = {}
+
+    def __len__(self):
+        return len(self._markups)
+
+
+class KeyboardPayloadSession(AiohttpSession):
+    """Aiohttp session that reuses the pre-serialized keyboards of a registry."""
+
+    def __init__(self, registry: KeyboardRegistry, **kwargs):
+        super().__init__(**kwargs)
+        self.registry = registry
+
+    def build_form_data(self, bot, method):
+        payload = self.registry.payload(getattr(method, "reply_markup", None))
+        if payload is None:
+            return super().build_form_data(bot, method)
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", payload)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
@@ -0,0 +1,170 @@
+"""Balance ledger.
+
+Every balance change is a row in ``ledger_entries``; rows are never updated or
+deleted. ``users.balance`` is the running total: it is changed by an SQL-side
+increment in the same transaction that appends the entry, so concurrent
+credits never overwrite each other. Crediting many users is two set-based
+statements, not a loop.
+
+``snapshot`` compacts the entries of every user into ``balance_snapshots``;
+``balance_as_of(T)`` starts from the latest snapshot before ``T`` and only sums
+the entries after it. A snapshot covers entries by id, up to its
+``last_entry_id``, so an entry is counted exactly once even if it was written
+after a snapshot that is newer than its ``created_at``.
+
+All functions take a SQLAlchemy session and leave the commit to the caller, so
+they run in the database threads like any other query
+(``await database_executor.transaction(ledger.credit, user_id, 10, "reward")``).
+In the bot, ``UserCache.credit`` and ``bulk_credit`` do this and also update
+the cached balances.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, text, update
+
+from database import BalanceSnapshot, LedgerEntry, User
+
+logger = logging.getLogger("GrapheneBot.ledger")
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+def credit(db, user_id: int, amount: int, reason: str, allow_negative: bool = False, now: Optional[float] = None) -> int:
+    """Add ``amount`` (negative to debit) to a user's balance; returns the entry id.
+
+    A debit below zero raises ``InsufficientBalance`` unless ``allow_negative``.
+    """
+    statement = update(User).where(User.id == user_id).values(balance=User.balance + amount)
+    if amount < 0 and not allow_negative:
+        statement = statement.where(User.balance + amount >= 0)
+    if db.execute(statement).rowcount != 1:
+        if db.get(User, user_id) is None:
+            raise LookupError(f"User {user_id} does not exist")
+        raise InsufficientBalance(f"User {user_id} cannot pay {-amount}")
+    return db.execute(insert(LedgerEntry).values(
+        user_id=user_id, amount=amount, reason=reason, created_at=time.time() if now is None else now,
+    )).inserted_primary_key[0]
+
+
+def bulk_credit(db, credits: Iterable[Tuple[int, int]], reason: str, now: Optional[float] = None) -> str:
+    """Credit many ``(user_id, amount)`` pairs; returns the operation id of the entries.
+
+    Entries are inserted with one executemany, balances are then updated by a
+    single UPDATE that sums the operation's entries per user.
+    """
+    operation = uuid.uuid4().hex
+    created_at = time.time() if now is None else now
+    rows = [{"user_id": user_id, "amount": amount, "reason": reason, "operation": operation, "created_at": created_at}
+            for user_id, amount in credits]
+    if not rows:
+        return operation
+    db.execute(insert(LedgerEntry), rows)
+    db.execute(text(
+        "UPDATE users SET balance = balance + ("
+        "SELECT SUM(e.amount) FROM ledger_entries e WHERE e.operation = :operation AND e.user_id = users.id) "
+        "WHERE id IN (SELECT user_id FROM ledger_entries WHERE operation = :operation)"
+    ), {"operation": operation})
+    return operation
+
+
+def credit_all(db, amount: int, reason: str, where=None, now: Optional[float] = None) -> int:
+    """Credit ``amount`` to every user matching ``where`` (all users by default).
+
+    Two set-based statements: INSERT ... SELECT of the entries and one UPDATE.
+    Returns the number of users credited.
+    """
+    operation = uuid.uuid4().hex
+    users = select(User.id)
+    if where is not None:
+        users = users.where(where)
+    created_at = time.time() if now is None else now
+    result = db.execute(insert(LedgerEntry).from_select(
+        ["user_id", "amount", "reason", "operation", "created_at"],
+        select(User.id, bindparam("amount", amount), bindparam("reason", reason),
+               bindparam("operation", operation), bindparam("created_at", created_at))
+        .where(User.id.in_(users)),
+    ))
+    db.execute(update(User).where(User.id.in_(select(LedgerEntry.user_id).where(LedgerEntry.operation == operation)))
+               .values(balance=User.balance + amount))
+    return result.rowcount
+
+
+def snapshot(db, until: Optional[float] = None, grace: float = 60.0) -> int:
+    """Snapshot the balance of every user with entries since their last snapshot.
+
+    The snapshot covers entries by id up to the last one before the first
+    entry newer than ``until`` (default: ``grace`` seconds ago, so writes still
+    in flight are not skipped); later entries are left for the next snapshot.
+    Returns the number of snapshots written.
+    """
+    until = time.time() - grace if until is None else until
+    result = db.execute(text(
+        "INSERT INTO balance_snapshots (user_id, taken_at, balance, last_entry_id) "
+        "SELECT e.user_id, :until, COALESCE(("
+        "  SELECT s.balance FROM balance_snapshots s WHERE s.user_id = e.user_id "
+        "  ORDER BY s.last_entry_id DESC LIMIT 1"
+        "), 0) + SUM(e.amount), MAX(e.id) "
+        "FROM ledger_entries e "
+        "WHERE e.id <= COALESCE("
+        "  (SELECT MIN(id) - 1 FROM ledger_entries WHERE created_at > :until), "
+        "  (SELECT MAX(id) FROM ledger_entries)"
+        ") AND e.id > COALESCE(("
+        "  SELECT MAX(s.last_entry_id) FROM balance_snapshots s WHERE s.user_id = e.user_id"
+        "), 0) "
+        "GROUP BY e.user_id"
+    ), {"until": until})
+    return result.rowcount
+
+
+def balance_as_of(db, user_id: int, at: float) -> int:
+    """Balance of a user at time ``at``: latest snapshot before it plus the entries after it."""
+    last = db.execute(
+        select(BalanceSnapshot.last_entry_id, BalanceSnapshot.balance)
+        .where(BalanceSnapshot.user_id == user_id, BalanceSnapshot.taken_at <= at)
+        .order_by(BalanceSnapshot.taken_at.desc()).limit(1)
+    ).first()
+    after, balance = (last.last_entry_id, last.balance) if last else (0, 0)
+    delta = db.execute(
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(LedgerEntry.user_id == user_id, LedgerEntry.id > after, LedgerEntry.created_at <= at)
+    ).scalar()
+    return balance + delta
+
+
+class Snapshotter:
+    """Takes a ledger snapshot every ``interval`` seconds in the database threads."""
+
+    def __init__(self, database, interval: float = 3600, grace: float = 60.0):
+        self.database = database
+        self.interval = interval
+        self.grace = grace
+        self._task: Optional[asyncio.Task] = None
+        self.snapshots = 0
+
+    async def run_once(self) -> int:
+        written = await self.database.transaction(snapshot, None, self.grace)
+        self.snapshots += written
+        return written
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ledger snapshot failed")
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
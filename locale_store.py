@@ -0,0 +1,164 @@
+"""User locale storage.
+
+``LocaleStore`` keeps recently used locales in a bounded LRU dict in front of a
+durable backend. Changes are written behind: they are collected and saved in
+batches by a background task, when the batch is full, or on shutdown.
+"""
+import asyncio
+import logging
+import sys
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("GrapheneBot.locale_store")
+
+_MISSING = object()  # Cached "backend has no locale for this user"
+
+
+class MemoryLocaleBackend:
+    """Process-local backend, used when no database is configured."""
+
+    def __init__(self):
+        self.data: Dict[int, str] = {}
+
+    def load(self, user_id: int) -> Optional[str]:
+        return self.data.get(user_id)
+
+    def save_many(self, locales: Dict[int, str]):
+        self.data.update(locales)
+
+
+class SQLiteLocaleBackend:
+    """Stores locales in ``database.User.language``, found by the telegram_id blind index.
+
+    :param write_lock: held while saving, e.g. ``DatabaseExecutor.write_lock``
+    """
+
+    def __init__(self, write_lock=None):
+        self.write_lock = write_lock or nullcontext()
+
+    def load(self, user_id: int) -> Optional[str]:
+        from database import User, get_session
+
+        db = get_session()
+        try:
+            user = db.query(User).filter(User.by_telegram_id(user_id)).first()
+            return user.language if user else None
+        finally:
+            db.close()
+
+    def save_many(self, locales: Dict[int, str]):
+        from database import User, get_session
+
+        db = get_session()
+        try:
+            with self.write_lock:
+                for user_id, locale in locales.items():
+                    user = db.query(User).filter(User.by_telegram_id(user_id)).first()
+                    if user:
+                        user.language = locale
+                    else:
+                        db.add(User(telegram_id=str(user_id), language=locale))
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+class LocaleStore:
+    def __init__(self, backend=None, maxsize: int = 10000, flush_interval: float = 5.0, batch_size: int = 100,
+                 run: Optional[Callable[..., Awaitable]] = None):
+        """
+        :param run: runs blocking backend calls off the event loop, ``asyncio.to_thread`` by default
+        """
+        self.backend = backend if backend is not None else MemoryLocaleBackend()
+        self.run = run or asyncio.to_thread
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cache: "OrderedDict[int, object]" = OrderedDict()
+        self._dirty: Dict[int, str] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    def _remember(self, user_id: int, value):
+        self._cache[user_id] = value
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[str]:
+        """Stored locale of a user, or None if the user never picked one."""
+        # Unflushed changes are never evicted, so check them first
+        locale = self._dirty.get(user_id)
+        if locale is not None:
+            self.hits += 1
+            return locale
+        value = self._cache.get(user_id)
+        if value is not None:
+            self.hits += 1
+            self._cache.move_to_end(user_id)
+            return None if value is _MISSING else value
+        self.misses += 1
+        locale = await self.run(self.backend.load, user_id)
+        if user_id not in self._dirty:
+            self._remember(user_id, _MISSING if locale is None else locale)
+        return locale
+
+    def set(self, user_id: int, locale: str):
+        self._remember(user_id, locale)
+        self._dirty[user_id] = locale
+        if len(self._dirty) >= self.batch_size:
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Write all pending changes to the backend in one batch."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch = dict(self._dirty)
+            try:
+                await self.run(self.backend.save_many, batch)
+            except Exception:
+                logger.exception("Failed to save %d user locales", len(batch))
+                return
+            for user_id, locale in batch.items():
+                # Keep entries that changed again while we were saving
+                if self._dirty.get(user_id) == locale:
+                    del self._dirty[user_id]
+            self.flushes += 1
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        memory = sys.getsizeof(self._cache) + sys.getsizeof(self._dirty)
+        memory += sum(sys.getsizeof(user_id) for user_id in self._cache)
+        return {
+            "size": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "flushes": self.flushes,
+            "memory_bytes": memory,
+        }
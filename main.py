@@ -1,5 +1,6 @@
 from aiogram import Bot, Dispatcher, Router, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
+from aiogram.types import CallbackQuery, Message, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandObject
 from aiogram.utils.i18n import I18n, FSMI18nMiddleware
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
@@ -8,6 +9,20 @@ import logging
 from dotenv import load_dotenv
 import os
 import asyncio
+from typing import NamedTuple, Optional
+
+from buttons import ButtonIndex, ButtonMatch
+from chunker import prechunk, send_chunks, split_message
+from dedup import SQLiteUpdateStore, UpdateDeduplicator
+from document_cache import DocumentCache, MemoryDocumentStore, SQLiteDocumentStore
+from inline_menu import InlineMenu, MenuButton
+from async_db import DatabaseExecutor
+from user_cache import UserCache
+from keyboards import KeyboardPayloadSession, KeyboardRegistry
+from locale_store import LocaleStore, MemoryLocaleBackend, SQLiteLocaleBackend
+from send_scheduler import SendScheduler
+from update_workers import QueuedRequestHandler
+from webhook_reply import WebhookReplyMiddleware, WebhookReplyRequestMiddleware, respond
 
 # Load environment variables
 load_dotenv()
@@ -25,9 +40,47 @@ SOCIAL_TWITTER = os.getenv("SOCIAL_TWITTER", "https://twitter.com/G3zGraph")  #
 SOCIAL_TELEGRAM_CHANNEL = os.getenv("SOCIAL_TELEGRAM", "https://t.me/g3zgraphene")  # Updated
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://v0-solana-token-app-gilt.vercel.app/en")  # Updated
 
+# User locale storage: "sqlite" keeps choices across restarts, "memory" is process-local
+LOCALE_BACKEND = os.getenv("LOCALE_BACKEND", "sqlite")
+LOCALE_CACHE_SIZE = int(os.getenv("LOCALE_CACHE_SIZE", "10000"))
+LOCALE_FLUSH_INTERVAL = float(os.getenv("LOCALE_FLUSH_INTERVAL", "5"))
+
+# Answer simple updates inline in the webhook HTTP response ("1" to enable)
+WEBHOOK_REPLY = os.getenv("WEBHOOK_REPLY", "0") == "1"
+# Process webhook updates in a bounded worker pool (0 keeps aiogram's unbounded background tasks)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "0"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
+# Drop re-delivered updates; "sqlite" also remembers them across instances
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "3600"))
+DEDUP_SIZE = int(os.getenv("DEDUP_SIZE", "100000"))
+
+# Threads that run database queries; bounds concurrent database work
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+# Cached users; balance changes are saved every USER_FLUSH_INTERVAL seconds (the language is in locale_store)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "5"))
+# Balance ledger snapshots for fast "balance as of" queries; 0 disables them
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "3600"))
+
 # Vercel deployment settings
 APP_BASE_URL = os.getenv("VERCEL_URL")  # Vercel provides this URL automatically
 
+# Outgoing message limits (Telegram allows ~30 msg/s overall and ~1 msg/s per chat)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+
+# "reply" keyboards send a new message per step, "inline" menus are edited in place
+MENU_MODE = os.getenv("MENU_MODE", "reply")
+
+# How whitepaper, roadmap and team are delivered: "messages" (text) or "file" (uploaded once, then reused)
+DOCUMENT_DELIVERY = os.getenv("DOCUMENT_DELIVERY", "messages")
+DOCUMENT_CACHE_BACKEND = os.getenv("DOCUMENT_CACHE_BACKEND", "sqlite")
+
 # --- Language Name Mapping ---
 LANG_NAME_MAP = {
     "en": "English",
@@ -35,25 +88,74 @@ LANG_NAME_MAP = {
 }
 
 # --- Bot, Dispatcher, Router ---
-bot = Bot(token=TELEGRAM_TOKEN)
-dp = Dispatcher()
+# Handlers are registered on the router at import; the bot, dispatcher and web
+# app are built on first use by get_bot(), get_dispatcher() and create_app()
+keyboard_registry = KeyboardRegistry()  # Keyboards are built once per locale
+database_executor = DatabaseExecutor(workers=DB_WORKERS)  # All blocking database calls run here
+user_cache = UserCache(database_executor, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, flush_interval=USER_FLUSH_INTERVAL)
+send_scheduler = SendScheduler(global_rate=SEND_GLOBAL_RATE, per_chat_rate=SEND_CHAT_RATE, per_chat_burst=SEND_CHAT_BURST)
+# Drops duplicates before any other work
+deduplicator = UpdateDeduplicator(
+    ttl=DEDUP_TTL,
+    maxsize=DEDUP_SIZE,
+    store=SQLiteUpdateStore(DEDUP_TTL, write_lock=database_executor.write_lock) if DEDUP_BACKEND == "sqlite" else None,
+    run=database_executor.run,
+)
+document_cache = DocumentCache(
+    SQLiteDocumentStore(write_lock=database_executor.write_lock) if DOCUMENT_CACHE_BACKEND == "sqlite" else MemoryDocumentStore(),
+    run=database_executor.run,
+)
 router = Router()
-dp.include_router(router)
 
 # --- Multilingual Support (i18n) ---
 i18n = I18n(path=LOCALES_DIR, default_locale="en", domain="graphene_bot")
-user_languages = {}  # In-memory storage for user language preferences
+locale_store = LocaleStore(
+    SQLiteLocaleBackend(write_lock=database_executor.write_lock) if LOCALE_BACKEND == "sqlite" else MemoryLocaleBackend(),
+    maxsize=LOCALE_CACHE_SIZE,
+    flush_interval=LOCALE_FLUSH_INTERVAL,
+    run=database_executor.run,
+)
+
+webhook_reply = WebhookReplyMiddleware()  # Registered by create_app() when WEBHOOK_REPLY is on
+
+_bot = None
+_dp = None
+_app = None
+
+def get_bot() -> Bot:
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=TELEGRAM_TOKEN, session=KeyboardPayloadSession(keyboard_registry))
+        _bot.session.middleware(send_scheduler)
+    return _bot
+
+def get_dispatcher() -> Dispatcher:
+    global _dp
+    if _dp is None:
+        _dp = Dispatcher()
+        _dp.update.outer_middleware(deduplicator)
+        _dp.update.middleware(FSMI18nMiddleware(i18n))
+        _dp.startup.register(locale_store.start)
+        _dp.startup.register(user_cache.start)
+        _dp.shutdown.register(locale_store.close)
+        _dp.shutdown.register(user_cache.close)
+        if LEDGER_SNAPSHOT_INTERVAL > 0:
+            from ledger import Snapshotter  # Loads the database layer
+
+            snapshotter = Snapshotter(database_executor, interval=LEDGER_SNAPSHOT_INTERVAL)
+            _dp.startup.register(snapshotter.start)
+            _dp.shutdown.register(snapshotter.close)
+        _dp.shutdown.register(database_executor.close)
+        _dp.include_router(router)
+    return _dp
 
 async def get_user_locale(event_from_user):
     if event_from_user is None:
         return i18n.default_locale
-    return user_languages.get(event_from_user.id, i18n.default_locale)
-
-# Register i18n middleware
-dp.update.middleware(FSMI18nMiddleware(i18n))
+    return await locale_store.get(event_from_user.id) or i18n.default_locale
 
 # --- Keyboard Definitions ---
-def get_main_keyboard(locale: str):
+def build_main_keyboard(locale: str):
     _ = i18n.gettext
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -65,7 +167,7 @@ def get_main_keyboard(locale: str):
         one_time_keyboard=False
     )
 
-def get_about_project_keyboard(locale: str):
+def build_about_project_keyboard(locale: str):
     _ = i18n.gettext
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -76,7 +178,7 @@ def get_about_project_keyboard(locale: str):
         resize_keyboard=True
     )
 
-def get_socials_keyboard(locale: str):
+def build_socials_keyboard(locale: str):
     _ = i18n.gettext
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -86,7 +188,7 @@ def get_socials_keyboard(locale: str):
         resize_keyboard=True
     )
 
-def get_language_keyboard(locale: str):
+def build_language_keyboard(locale: str):
     _ = i18n.gettext
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -96,6 +198,30 @@ def get_language_keyboard(locale: str):
         resize_keyboard=True
     )
 
+keyboard_registry.register("main", build_main_keyboard)
+keyboard_registry.register("about_project", build_about_project_keyboard)
+keyboard_registry.register("socials", build_socials_keyboard)
+keyboard_registry.register("language", build_language_keyboard)
+
+def get_main_keyboard(locale: str):
+    return keyboard_registry.get("main", locale)
+
+def get_about_project_keyboard(locale: str):
+    return keyboard_registry.get("about_project", locale)
+
+def get_socials_keyboard(locale: str):
+    return keyboard_registry.get("socials", locale)
+
+def get_language_keyboard(locale: str):
+    return keyboard_registry.get("language", locale)
+
+def set_webapp_url(url: str):
+    """Point the GrapheneApp button to a new URL."""
+    global WEBAPP_URL
+    WEBAPP_URL = url
+    keyboard_registry.invalidate()
+    inline_menu.invalidate()
+
 # --- Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("GrapheneBot")
@@ -104,18 +230,19 @@ logger = logging.getLogger("GrapheneBot")
 @router.message(Command(commands=['start', 'help']))
 async def send_welcome(message: Message):
     user_id = message.from_user.id
-    if user_id not in user_languages:
+    await user_cache.get(user_id)  # Registers new users
+    if await locale_store.get(user_id) is None:
         user_tg_lang = message.from_user.language_code
         if user_tg_lang and user_tg_lang.startswith('ru'):
-            user_languages[user_id] = 'ru'
+            locale_store.set(user_id, 'ru')
         else:
-            user_languages[user_id] = i18n.default_locale
+            locale_store.set(user_id, i18n.default_locale)
 
     locale = await get_user_locale(message.from_user)
     _ = i18n.gettext
 
     welcome_text = _("👋 Добро пожаловать в Graphene Bot!\n\nИспользуйте кнопки ниже для навигации.", locale=locale)
-    await message.reply(welcome_text, reply_markup=get_main_keyboard(locale))
+    await respond(message.reply(welcome_text, reply_markup=main_menu_markup(locale)))
 
 @router.message(Command(commands=['language']))
 async def cmd_language_command(message: Message, command: CommandObject):
@@ -124,27 +251,25 @@ async def cmd_language_command(message: Message, command: CommandObject):
     _ = i18n.gettext
 
     if command.args and command.args in i18n.available_locales:
-        user_languages[user_id] = command.args
+        locale_store.set(user_id, command.args)
         new_locale = command.args
-        await message.reply(
-            _("Язык изменен на {lang_name}.", locale=new_locale).format(lang_name=LANG_NAME_MAP.get(new_locale, new_locale.upper())),
-            reply_markup=get_main_keyboard(new_locale)
-        )
+        await respond(message.reply(language_changed_text(new_locale), reply_markup=main_menu_markup(new_locale)))
     else:
-        await message.reply(
+        language_menu = inline_menu.keyboard("language", locale) if MENU_MODE == "inline" else get_language_keyboard(locale)
+        await respond(message.reply(
             _("Пожалуйста, выберите язык:", locale=locale),
-            reply_markup=get_language_keyboard(locale)
-        )
+            reply_markup=language_menu
+        ))
 
 @router.message(F.web_app_data)
 async def web_app_data_received(message: Message):
     locale = await get_user_locale(message.from_user)
     _ = i18n.gettext
     logger.info(f"Received WebApp data: {message.web_app_data.data}")
-    await message.reply(
+    await respond(message.reply(
         _("Данные из WebApp получены: {data}", locale=locale).format(data=message.web_app_data.data),
-        reply_markup=get_main_keyboard(locale)
-    )
+        reply_markup=main_menu_markup(locale)
+    ))
 
 # --- Navigation Handlers ---
 TEXT_ABOUT_EN = "ℹ️ About Project"
@@ -160,79 +285,223 @@ TEXT_BACK_EN = "⬅️ Back"
 TEXT_LANG_EN_BUTTON = "🇬🇧 English"
 TEXT_LANG_RU_BUTTON = "🇷🇺 Русский"
 
+# Button msgids per action; labels are translated once per locale into button_index
+BUTTON_LABELS = {
+    "about": TEXT_ABOUT_EN,
+    "whitepaper": TEXT_WHITEPAPER_EN,
+    "roadmap": TEXT_ROADMAP_EN,
+    "team": TEXT_TEAM_EN,
+    "our_website": TEXT_OUR_WEBSITE_EN,
+    "socials": TEXT_SOCIALS_EN,
+    "twitter": TEXT_TWITTER_EN,
+    "telegram_channel": TEXT_TELEGRAM_CHANNEL_EN,
+    "language": TEXT_LANGUAGE_EN,
+    "back": TEXT_BACK_EN,
+}
+LANGUAGE_BUTTONS = {
+    TEXT_LANG_EN_BUTTON: ButtonMatch("set_language", "en"),
+    TEXT_LANG_RU_BUTTON: ButtonMatch("set_language", "ru"),
+}
+button_index = ButtonIndex(i18n, BUTTON_LABELS, LANGUAGE_BUTTONS)
+
+def reload_locales():
+    """Hot reload the compiled catalogs and everything derived from them."""
+    i18n.reload()
+    button_index.rebuild()
+    keyboard_registry.invalidate()
+    inline_menu.invalidate()
+
+class Screen(NamedTuple):
+    text: str  # msgid of the message text
+    menu: str  # keyboard shown with the text
+    content: Optional[str] = None  # document sent before the text
+    url: Optional[str] = None  # fills {url} in the text
+
+# What every menu action shows; shared by the reply keyboard and the inline menu
+SCREENS = {
+    "about": Screen("Раздел 'О Проекте'. Выберите опцию:", "about_project"),
+    "whitepaper": Screen("Whitepaper был отправлен. Выберите другую опцию или вернитесь назад:", "about_project", content="whitepaper"),
+    "roadmap": Screen("Дорожная карта была отправлена. Выберите другую опцию или вернитесь назад:", "about_project", content="roadmap"),
+    "team": Screen("Информация о команде была отправлена. Выберите другую опцию или вернитесь назад:", "about_project", content="team"),
+    "our_website": Screen("Посетите наш сайт: {url}", "about_project", url=PROJECT_WEBSITE),
+    "socials": Screen("Наши социальные сети:", "socials"),
+    "twitter": Screen("Наш Twitter: {url}", "socials", url=SOCIAL_TWITTER),
+    "telegram_channel": Screen("Наш Telegram канал: {url}", "socials", url=SOCIAL_TELEGRAM_CHANNEL),
+    "language": Screen("Пожалуйста, выберите язык:", "language"),
+    "back": Screen("Главное меню.", "main"),
+}
+
+def screen_text(screen: Screen, locale: str) -> str:
+    text = i18n.gettext(screen.text, locale=locale)
+    return text.format(url=screen.url) if screen.url else text
+
+def language_changed_text(locale: str) -> str:
+    return i18n.gettext("Язык изменен на {lang_name}.", locale=locale).format(lang_name=LANG_NAME_MAP.get(locale, locale.upper()))
+
+async def send_document_content(message: Message, name: str, locale: str):
+    contents, chunks = DOCUMENTS[name]
+    if locale not in contents:
+        locale = 'en'
+    if DOCUMENT_DELIVERY == "file":
+        await document_cache.send(message.bot, message.chat.id, name, locale, contents[locale],
+                                  filename=f"Graphene_{name.capitalize()}_{locale}.txt")
+    else:
+        await send_long_message(message.chat.id, message.bot, chunks[locale])
+
+async def show_screen(message: Message, action: str, locale: str):
+    screen = SCREENS[action]
+    if screen.content:
+        await send_document_content(message, screen.content, locale)
+    await respond(message.reply(screen_text(screen, locale), reply_markup=keyboard_registry.get(screen.menu, locale)))
+
+async def set_language(message: Message, locale: str):
+    locale_store.set(message.from_user.id, locale)
+    await respond(message.reply(language_changed_text(locale), reply_markup=main_menu_markup(locale)))
+
 @router.message()
 async def handle_text_buttons(message: Message):
-    user_id = message.from_user.id
-    locale = user_languages.get(user_id, i18n.default_locale)
-    _ = i18n.gettext
-
-    if message.text == _(TEXT_ABOUT_EN, locale=locale):
-        await message.reply(_("Раздел 'О Проекте'. Выберите опцию:", locale=locale),
-                            reply_markup=get_about_project_keyboard(locale))
-    elif message.text == _(TEXT_WHITEPAPER_EN, locale=locale):
-        await send_long_message(message.chat.id, bot, WHITEPAPER_CONTENT.get(locale, WHITEPAPER_CONTENT['en']))
-        await message.reply(_("Whitepaper был отправлен. Выберите другую опцию или вернитесь назад:", locale=locale), reply_markup=get_about_project_keyboard(locale))
-    elif message.text == _(TEXT_ROADMAP_EN, locale=locale):
-        await send_long_message(message.chat.id, bot, ROADMAP_CONTENT.get(locale, ROADMAP_CONTENT['en']))
-        await message.reply(_("Дорожная карта была отправлена. Выберите другую опцию или вернитесь назад:", locale=locale), reply_markup=get_about_project_keyboard(locale))
-    elif message.text == _(TEXT_TEAM_EN, locale=locale):
-        await send_long_message(message.chat.id, bot, TEAM_CONTENT.get(locale, TEAM_CONTENT['en']))
-        await message.reply(_("Информация о команде была отправлена. Выберите другую опцию или вернитесь назад:", locale=locale), reply_markup=get_about_project_keyboard(locale))
-    elif message.text == _(TEXT_OUR_WEBSITE_EN, locale=locale):  # Handler for "Our Website"
-        await message.reply(_("Посетите наш сайт: {url}", locale=locale).format(url=PROJECT_WEBSITE),
-                            reply_markup=get_about_project_keyboard(locale))
-    elif message.text == _(TEXT_SOCIALS_EN, locale=locale):
-        await message.reply(_("Наши социальные сети:", locale=locale),
-                            reply_markup=get_socials_keyboard(locale))
-    elif message.text == _(TEXT_TWITTER_EN, locale=locale):
-        await message.reply(_("Наш Twitter: {url}", locale=locale).format(url=SOCIAL_TWITTER),
-                            reply_markup=get_socials_keyboard(locale))
-    elif message.text == _(TEXT_TELEGRAM_CHANNEL_EN, locale=locale):
-        await message.reply(_("Наш Telegram канал: {url}", locale=locale).format(url=SOCIAL_TELEGRAM_CHANNEL),
-                            reply_markup=get_socials_keyboard(locale))
-    elif message.text == _(TEXT_LANGUAGE_EN, locale=locale):
-        await message.reply(_("Пожалуйста, выберите язык:", locale=locale),
-                            reply_markup=get_language_keyboard(locale))
-    elif message.text == TEXT_LANG_EN_BUTTON:
-        user_languages[user_id] = "en"
-        new_locale = "en"
-        await message.reply(
-            _("Язык изменен на {lang_name}.", locale=new_locale).format(lang_name=LANG_NAME_MAP.get(new_locale, new_locale.upper())),
-            reply_markup=get_main_keyboard(new_locale)
-        )
-    elif message.text == TEXT_LANG_RU_BUTTON:
-        user_languages[user_id] = "ru"
-        new_locale = "ru"
-        await message.reply(
-            _("Язык изменен на {lang_name}.", locale=new_locale).format(lang_name=LANG_NAME_MAP.get(new_locale, new_locale.upper())),
-            reply_markup=get_main_keyboard(new_locale)
-        )
-    elif message.text == _(TEXT_BACK_EN, locale=locale):
-        await message.reply(_("Главное меню.", locale=locale),
-                            reply_markup=get_main_keyboard(locale))
+    match = button_index.match(message.text)
+    if match is None:
+        return
+    # Labels that exist in only one locale answer in that locale
+    locale = match.locale or await get_user_locale(message.from_user)
+    if match.action == "set_language":
+        await set_language(message, locale)
+    else:
+        await show_screen(message, match.action, locale)
+
+# --- Inline Menu (MENU_MODE=inline) ---
+# Same tree as the reply keyboards above
+INLINE_MENUS = {
+    "main": [
+        [MenuButton("🚀 GrapheneApp", web_app=True)],
+        [MenuButton("ℹ️ О Проекте", "about"), MenuButton("🌐 Язык", "language")],
+        [MenuButton("🔗 Соц. Сети", "socials")],
+    ],
+    "about_project": [
+        [MenuButton("📜 Whitepaper", "whitepaper"), MenuButton("🗺️ Дорожная карта", "roadmap")],
+        [MenuButton("👥 Команда", "team"), MenuButton("🌍 Наш сайт", "our_website")],
+        [MenuButton("⬅️ Назад", "back")],
+    ],
+    "socials": [
+        [MenuButton("🐦 Twitter", "twitter"), MenuButton("✈️ Telegram Канал", "telegram_channel")],
+        [MenuButton("⬅️ Назад", "back")],
+    ],
+    "language": [
+        [MenuButton(TEXT_LANG_EN_BUTTON, "set_language", "en", translate=False),
+         MenuButton(TEXT_LANG_RU_BUTTON, "set_language", "ru", translate=False)],
+        [MenuButton("⬅️ Назад", "back")],
+    ],
+}
+# Callback data codes; old menu messages keep working only while these stay the same
+INLINE_CODES = {
+    "about": "a", "whitepaper": "w", "roadmap": "r", "team": "t", "our_website": "o",
+    "socials": "s", "twitter": "x", "telegram_channel": "c", "language": "g",
+    "set_language": "l", "back": "b",
+}
+inline_menu = InlineMenu(i18n, INLINE_MENUS, INLINE_CODES, webapp_url=lambda: WEBAPP_URL)
+
+def main_menu_markup(locale: str):
+    if MENU_MODE == "inline":
+        return inline_menu.keyboard("main", locale)
+    return get_main_keyboard(locale)
+
+@router.callback_query(F.data.startswith(inline_menu.prefix))
+async def handle_menu_callback(callback: CallbackQuery):
+    # The button spins until the query is answered, so it is answered even if the menu fails
+    try:
+        await show_menu(callback)
+    finally:
+        await respond(callback.answer())
+
+async def show_menu(callback: CallbackQuery):
+    action, arg = inline_menu.decode(callback.data)
+    message = callback.message
+    if action is None or not isinstance(message, Message):
+        return
+    if action == "set_language":
+        if arg not in i18n.available_locales:
+            return
+        locale = arg
+        locale_store.set(callback.from_user.id, locale)
+        text, menu = language_changed_text(locale), "main"
+    else:
+        locale = await get_user_locale(callback.from_user)
+        screen = SCREENS[action]
+        text, menu = screen_text(screen, locale), screen.menu
+    markup = inline_menu.keyboard(menu, locale)
+    if action in SCREENS and SCREENS[action].content:
+        # The document pushes the menu up, so move the menu below it
+        await send_document_content(message, SCREENS[action].content, locale)
+        try:
+            await message.edit_reply_markup(reply_markup=None)
+        except TelegramBadRequest as e:
+            logger.info(f"Old menu kept: {e.message}")
+        await message.answer(text, reply_markup=markup)
+        return
+    try:
+        await message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" in e.message:
+            return
+        # Too old to edit or deleted: send the menu as a new message
+        logger.info(f"Menu sent anew: {e.message}")
+        await message.answer(text, reply_markup=markup)
 
 # --- Vercel Webhook Setup ---
 async def on_startup(dispatcher: Dispatcher):
     webhook_url = f"https://{APP_BASE_URL}/webhook/{TELEGRAM_TOKEN}"
-    await bot.set_webhook(webhook_url)
+    await get_bot().set_webhook(webhook_url)
     logger.info(f"Webhook set to: {webhook_url}")
 
 async def on_shutdown(dispatcher: Dispatcher):
     logger.warning('Shutting down..')
-    await bot.delete_webhook()
+    await get_bot().delete_webhook()
     await dispatcher.storage.close()
     await dispatcher.storage.wait_closed()
     logger.warning('Bye!')
 
-app = web.Application()
-SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=f"/webhook/{TELEGRAM_TOKEN}")
-setup_application(app, dp, bot=bot)
+def create_app() -> web.Application:
+    """Build the webhook application (once)."""
+    global _app
+    if _app is not None:
+        return _app
+    bot, dp = get_bot(), get_dispatcher()
+    _app = web.Application()
+    if WEBHOOK_REPLY:
+        # The handler result is written into the response, so wait for it
+        dp.update.outer_middleware(webhook_reply)
+        bot.session.middleware(WebhookReplyRequestMiddleware())
+        SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=False).register(_app, path=f"/webhook/{TELEGRAM_TOKEN}")
+    elif UPDATE_WORKERS > 0:
+        # Acknowledge at once; same-chat updates stay ordered, a full queue answers 503
+        QueuedRequestHandler(
+            dispatcher=dp, bot=bot, workers=UPDATE_WORKERS, max_queue=UPDATE_QUEUE_SIZE
+        ).register(_app, path=f"/webhook/{TELEGRAM_TOKEN}")
+    else:
+        SimpleRequestHandler(dispatcher=dp, bot=bot).register(_app, path=f"/webhook/{TELEGRAM_TOKEN}")
+    setup_application(_app, dp, bot=bot)
+    return _app
+
+def __getattr__(name):
+    # `main.app` (the Vercel entry point), `main.bot` and `main.dp` are built on first access
+    if name == "app":
+        return create_app()
+    if name == "bot":
+        return get_bot()
+    if name == "dp":
+        return get_dispatcher()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    # Vercel looks the entry point up with dir()
+    return sorted(list(globals()) + ["app", "bot", "dp"])
 
 # Helper function to send long messages
-async def send_long_message(chat_id: int, bot_instance: Bot, text: str, max_length: int = 4096):
-    """Splits a long message into parts and sends them."""
-    for i in range(0, len(text), max_length):
-        await bot_instance.send_message(chat_id, text[i:i + max_length])
+async def send_long_message(chat_id: int, bot_instance: Bot, text, max_length: int = 4096):
+    """Sends a long message (or its pre-split parts) as several messages."""
+    chunks = split_message(text, max_length) if isinstance(text, str) else text
+    await send_chunks(bot_instance, chat_id, chunks)
 
 # --- Content Constants ---
 WHITEPAPER_CONTENT = {
@@ -518,9 +787,21 @@ Alexander Moor Partner Intellectual property & product strategy""",
 Александр Моор Партнер Интеллектуальная собственность и продуктовая стратегия"""
 }
 
+# Split once at load time; handlers send the ready parts
+WHITEPAPER_CHUNKS = prechunk(WHITEPAPER_CONTENT)
+ROADMAP_CHUNKS = prechunk(ROADMAP_CONTENT)
+TEAM_CHUNKS = prechunk(TEAM_CONTENT)
+
+DOCUMENTS = {
+    "whitepaper": (WHITEPAPER_CONTENT, WHITEPAPER_CHUNKS),
+    "roadmap": (ROADMAP_CONTENT, ROADMAP_CHUNKS),
+    "team": (TEAM_CONTENT, TEAM_CHUNKS),
+}
+
 # --- Main execution ---
 async def run_polling():
     logger.info("Starting bot in polling mode...")
+    bot, dp = get_bot(), get_dispatcher()
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
 
@@ -0,0 +1,271 @@
+"""Versioned schema migrations.
+
+Each migration has a version and is recorded in ``schema_version`` once it has
+been applied. Migrations run as an explicit deploy step::
+
+    python migrations.py status
+    python migrations.py upgrade [--to VERSION]
+
+At startup ``database.init_db`` only runs ``check``: a single
+``SELECT MAX(version)`` that fails with ``SchemaOutdated`` when migrations are
+pending (set ``DB_AUTO_MIGRATE=1`` to apply them there instead, e.g. in
+development).
+
+A migration is a function of the engine and manages its own transactions, so
+long backfills commit chunk by chunk. It must be safe to run again: the
+version is recorded after it returns, and a run interrupted before that is
+repeated by the next ``upgrade``. ``backfill`` keeps its position in
+``job_checkpoints`` so a repeated run continues where it stopped;
+``create_index`` builds indexes without blocking readers.
+
+Tables are created from the definitions below, frozen as of the migration
+that added them, never from the live models in ``database.py``: a fresh
+database then goes through the same steps as an old one. Changing a model
+needs a new migration (and the test comparing the result with the models
+fails until it exists).
+"""
+import argparse
+import logging
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import BigInteger, Column, Float, ForeignKey, Index, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import DBAPIError
+
+import database
+from database import JobCheckpoint, SchemaVersion
+
+logger = logging.getLogger("GrapheneBot.migrations")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def create_index(bind, name: str, table: str, columns: Sequence[str], unique: bool = False):
+    """Build an index if it does not exist, without blocking reads and writes where possible.
+
+    PostgreSQL builds it ``CONCURRENTLY`` outside a transaction. SQLite has no
+    concurrent build: the statement holds the write lock while it runs, but
+    in WAL mode readers go on; writers wait up to ``busy_timeout``.
+    """
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    columns_sql = ", ".join(columns)
+    if bind.dialect.name == "postgresql":
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns_sql})"))
+    else:
+        with bind.begin() as conn:
+            conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns_sql})"))
+
+
+def backfill(bind, name: str, statement: str, table: str = "users", chunk_size: int = 5000,
+             params: Optional[Dict] = None) -> int:
+    """Run ``statement`` over ``table`` in id ranges, one transaction per range.
+
+    ``statement`` restricts itself with ``:low < id <= :high``. The end of
+    each committed range is checkpointed in ``job_checkpoints`` under
+    ``migration:<name>``, so an interrupted backfill resumes after it.
+    Returns the number of rows changed by this run.
+    """
+    checkpoints = JobCheckpoint.__table__
+    job = f"migration:{name}"
+    with bind.connect() as conn:
+        last_id = conn.execute(select(checkpoints.c.last_id).where(checkpoints.c.name == job)).scalar() or 0
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0
+    changed = 0
+    while last_id < max_id:
+        high = last_id + chunk_size
+        with bind.begin() as conn:
+            changed += conn.execute(text(statement), {**(params or {}), "low": last_id, "high": high}).rowcount
+            conn.execute(
+                insert(checkpoints).values(name=job, last_id=high, rows=changed, updated_at=time.time())
+                .on_conflict_do_update(index_elements=[checkpoints.c.name],
+                                       set_={"last_id": high, "rows": changed, "updated_at": time.time()})
+            )
+        last_id = high
+    if changed:
+        logger.info("Backfill %s: %d rows", name, changed)
+    return changed
+
+
+# Tables as first created by their migration
+frozen = MetaData()
+
+USERS_V1 = Table(
+    "users", frozen,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("telegram_id", String),
+    Column("language", String),
+    Column("balance", Integer),
+)
+PROCESSED_UPDATES_V1 = Table(
+    "processed_updates", frozen,
+    Column("update_id", BigInteger, primary_key=True),
+    Column("seen_at", Float, nullable=False, index=True),
+)
+DOCUMENT_FILES_V1 = Table(
+    "document_files", frozen,
+    Column("name", String, primary_key=True),
+    Column("locale", String, primary_key=True),
+    Column("content_hash", String, primary_key=True),
+    Column("file_id", String, nullable=False),
+)
+JOB_CHECKPOINTS_V1 = Table(
+    "job_checkpoints", frozen,
+    Column("name", String, primary_key=True),
+    Column("last_id", Integer, nullable=False),
+    Column("rows", Integer, nullable=False),
+    Column("updated_at", Float, nullable=False),
+)
+LEDGER_ENTRIES_V3 = Table(
+    "ledger_entries", frozen,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("amount", Integer, nullable=False),
+    Column("reason", String, nullable=False),
+    Column("operation", String, index=True),
+    Column("created_at", Float, nullable=False),
+    Index("ix_ledger_entries_user_time", "user_id", "created_at"),
+)
+BALANCE_SNAPSHOTS_V3 = Table(
+    "balance_snapshots", frozen,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("taken_at", Float, primary_key=True),
+    Column("balance", Integer, nullable=False),
+)
+WALLET_BALANCES_V5 = Table(
+    "wallet_balances", frozen,
+    Column("address", String, primary_key=True),
+    Column("lamports", BigInteger, nullable=False),
+    Column("slot", BigInteger, nullable=False),
+    Column("updated_at", Float, nullable=False),
+)
+AIRDROP_TRANSFERS_V6 = Table(
+    "airdrop_transfers", frozen,
+    Column("airdrop", String, primary_key=True),
+    Column("address", String, primary_key=True),
+    Column("lamports", BigInteger, nullable=False),
+    Column("status", String, nullable=False, index=True),
+    Column("signature", String, index=True),
+    Column("last_valid_block_height", BigInteger),
+    Column("error", String),
+    Column("updated_at", Float, nullable=False),
+)
+
+
+def create_tables(*tables: Table):
+    """Create frozen ``tables`` that do not exist yet."""
+    def apply(bind):
+        frozen.create_all(bind, tables=list(tables))
+    return apply
+
+
+def opening_balances(bind, chunk_size: int = 5000) -> int:
+    """One "opening" ledger entry per user with a balance and no entries."""
+    return backfill(bind, "opening_balances", (
+        "INSERT INTO ledger_entries (user_id, amount, reason, created_at) "
+        "SELECT u.id, u.balance, 'opening', 0 FROM users u "
+        "WHERE u.id > :low AND u.id <= :high AND u.balance != 0 "
+        "AND NOT EXISTS (SELECT 1 FROM ledger_entries e WHERE e.user_id = u.id)"
+    ), chunk_size=chunk_size)
+
+
+def _snapshot_entry_ids(bind):
+    """``balance_snapshots.last_entry_id``: the last ledger entry each snapshot covers."""
+    columns = {column["name"] for column in inspect(bind).get_columns("balance_snapshots")}
+    with bind.begin() as conn:
+        if "last_entry_id" not in columns:
+            conn.execute(text("ALTER TABLE balance_snapshots ADD COLUMN last_entry_id INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text(
+            "UPDATE balance_snapshots SET last_entry_id = COALESCE(("
+            "  SELECT MAX(e.id) FROM ledger_entries e "
+            "  WHERE e.user_id = balance_snapshots.user_id AND e.created_at <= balance_snapshots.taken_at"
+            "), 0) WHERE last_entry_id = 0"
+        ))
+
+
+def _ledger(bind):
+    create_tables(LEDGER_ENTRIES_V3, BALANCE_SNAPSHOTS_V3)(bind)
+    opening_balances(bind)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial tables", create_tables(USERS_V1, PROCESSED_UPDATES_V1, DOCUMENT_FILES_V1, JOB_CHECKPOINTS_V1)),
+    Migration(2, "blind index on users.telegram_id", lambda bind: database.migrate_blind_index(bind)),
+    Migration(3, "balance ledger", _ledger),
+    Migration(4, "index on users.balance", lambda bind: create_index(bind, "ix_users_balance", "users", ["balance"])),
+    Migration(5, "wallet balances", create_tables(WALLET_BALANCES_V5)),
+    Migration(6, "airdrop transfers", create_tables(AIRDROP_TRANSFERS_V6)),
+    Migration(7, "ledger snapshots by entry id", _snapshot_entry_ids),
+]
+HEAD = MIGRATIONS[-1].version
+
+
+def current_version(bind) -> int:
+    """Applied schema version, 0 for a database without ``schema_version``."""
+    try:
+        with bind.connect() as conn:
+            return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+def check(bind) -> int:
+    """Raise ``SchemaOutdated`` if migrations are pending; returns the version."""
+    version = current_version(bind)
+    if version < HEAD:
+        pending = ", ".join(f"{m.version} ({m.name})" for m in MIGRATIONS if m.version > version)
+        raise SchemaOutdated(f"Database schema is at version {version}, pending migrations: {pending}. "
+                             f"Run `python migrations.py upgrade`.")
+    if version > HEAD:
+        logger.warning("Database schema version %d is newer than this code (%d)", version, HEAD)
+    return version
+
+
+def upgrade(bind, target: Optional[int] = None) -> List[Migration]:
+    """Apply pending migrations up to ``target`` (all by default); returns the applied ones."""
+    SchemaVersion.__table__.create(bind, checkfirst=True)
+    version = current_version(bind)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        logger.info("Applying migration %d: %s", migration.version, migration.name)
+        start = time.perf_counter()
+        migration.apply(bind)
+        seconds = time.perf_counter() - start
+        with bind.begin() as conn:
+            conn.execute(SchemaVersion.__table__.insert().values(
+                version=migration.version, name=migration.name, applied_at=time.time(), seconds=seconds,
+            ))
+        logger.info("Migration %d applied in %.2f s", migration.version, seconds)
+        applied.append(migration)
+    return applied
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply or list database schema migrations.")
+    parser.add_argument("command", choices=("status", "upgrade"))
+    parser.add_argument("--to", type=int, help="upgrade: stop after this version")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "upgrade":
+        upgrade(database.engine, args.to)
+    version = current_version(database.engine)
+    for migration in MIGRATIONS:
+        state = "applied" if migration.version <= version else "pending"
+        print(f"{migration.version:>4}  {state:<8} {migration.name}")
+    return 0 if version >= HEAD else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,208 @@
+"""Local Solana JSON-RPC server for tests and benchmarks.
+
+Answers ``getBalance`` and ``getMultipleAccounts`` from an in-memory table of
+balances after an optional ``latency``, and counts requests per method, so the
+real ``solana.rpc.async_api.AsyncClient`` can be pointed at it.
+
+``sendTransaction`` verifies the signatures and the blockhash and applies
+system transfers at once; a signature is processed only once, like on the
+cluster. The block height advances every ``slot_time`` seconds and a
+blockhash expires ``blockhash_validity`` blocks after it was issued.
+``drop_next`` makes the next sends return a signature without landing.
+Like a real node, ``getSignatureStatuses`` only knows transactions from the
+last ``status_cache_slots`` slots unless ``searchTransactionHistory`` is set.
+``received`` counts the lamports each address was sent.
+
+Faults for client tests: ``http_status`` answers every request with that
+HTTP status (e.g. 429 or 503), ``fail_rate`` answers that share of requests
+with a "node is behind" JSON-RPC error, and ``latency`` can be changed at any
+time::
+
+    rpc = MockRpc(latency=0.02)
+    url = await rpc.start()
+    client = AsyncClient(url)
+    ...
+    await rpc.close()
+"""
+import asyncio
+import base64
+import hashlib
+import random
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+from solders.hash import Hash
+from solders.signature import Signature
+from solders.transaction import Transaction
+
+SYSTEM_PROGRAM = "11111111111111111111111111111111"
+TRANSFER = (2).to_bytes(4, "little")
+
+
+def default_balance(address: str) -> int:
+    """Deterministic balance for addresses without one set; some are empty accounts (0)."""
+    value = int.from_bytes(hashlib.sha256(address.encode()).digest()[:4], "big")
+    return 0 if value % 10 == 0 else value
+
+
+class MockRpc:
+    def __init__(self, latency: float = 0.0, balances: Optional[Dict[str, int]] = None, slot: int = 1000,
+                 slot_time: float = 0.4, blockhash_validity: int = 150, fee: int = 5000, seed: int = 0,
+                 status_cache_slots: int = 300):
+        self.latency = latency
+        self.http_status: Optional[int] = None
+        self.fail_rate = 0.0
+        self._random = random.Random(seed)
+        self.balances: Dict[str, int] = dict(balances or {})
+        self._slot = slot
+        self.slot_time = slot_time
+        self.blockhash_validity = blockhash_validity
+        self.status_cache_slots = status_cache_slots
+        self.fee = fee
+        self._started = time.monotonic()
+        self.blockhashes: Dict[str, int] = {}  # blockhash -> last valid block height
+        self.statuses: Dict[str, int] = {}  # signature -> slot it landed in
+        self.received = Counter()
+        self.drop_next = 0
+        self.requests = Counter()  # method -> count
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def balance(self, address: str) -> int:
+        return self.balances.get(address, default_balance(address))
+
+    def _account(self, address: str) -> Optional[dict]:
+        lamports = self.balance(address)
+        if not lamports:
+            return None
+        return {"lamports": lamports, "owner": SYSTEM_PROGRAM, "data": ["", "base64"],
+                "executable": False, "rentEpoch": 0, "space": 0}
+
+    @property
+    def slot(self) -> int:
+        return self._slot + int((time.monotonic() - self._started) / self.slot_time)
+
+    def _context(self) -> dict:
+        return {"slot": self.slot}
+
+    def handle_getBlockHeight(self, params):
+        return self.slot
+
+    def handle_getLatestBlockhash(self, params):
+        height = self.slot
+        blockhash = str(Hash(hashlib.sha256(f"block {height}".encode()).digest()))
+        last_valid = self.blockhashes[blockhash] = height + self.blockhash_validity
+        return {"context": self._context(), "value": {"blockhash": blockhash, "lastValidBlockHeight": last_valid}}
+
+    def handle_getFeeForMessage(self, params):
+        return {"context": self._context(), "value": self.fee}
+
+    def handle_sendTransaction(self, params):
+        tx = Transaction.from_bytes(base64.b64decode(params[0]))
+        try:
+            tx.verify()
+        except Exception:
+            raise RpcError(-32003, "Transaction signature verification failure")
+        signature = str(tx.signatures[0])
+        if signature in self.statuses:
+            return signature
+        last_valid = self.blockhashes.get(str(tx.message.recent_blockhash))
+        if last_valid is None or self.slot > last_valid:
+            raise RpcError(-32002, "Transaction simulation failed: Blockhash not found", {
+                "err": "BlockhashNotFound", "logs": [], "accounts": None, "unitsConsumed": 0, "returnData": None,
+            })
+        if self.drop_next:
+            self.drop_next -= 1
+            return signature
+        keys = [str(key) for key in tx.message.account_keys]
+        payer = keys[0]
+        self.balances[payer] = self.balance(payer) - self.fee
+        for instruction in tx.message.instructions:
+            data = bytes(instruction.data)
+            if keys[instruction.program_id_index] == SYSTEM_PROGRAM and data[:4] == TRANSFER:
+                lamports = int.from_bytes(data[4:12], "little")
+                source, destination = (keys[i] for i in bytes(instruction.accounts)[:2])
+                self.balances[source] = self.balance(source) - lamports
+                self.balances[destination] = self.balance(destination) + lamports
+                self.received[destination] += lamports
+        self.statuses[signature] = self.slot
+        return signature
+
+    def handle_getSignatureStatuses(self, params):
+        history = len(params) > 1 and bool((params[1] or {}).get("searchTransactionHistory"))
+        statuses = []
+        for signature in params[0]:
+            slot = self.statuses.get(signature)
+            if slot is not None and not history and self.slot - slot > self.status_cache_slots:
+                slot = None  # Evicted from the recent status cache
+            statuses.append(None if slot is None else {
+                "slot": slot, "confirmations": None, "err": None, "status": {"Ok": None},
+                "confirmationStatus": "confirmed",
+            })
+        return {"context": self._context(), "value": statuses}
+
+    def handle_requestAirdrop(self, params):
+        self.balances[params[0]] = self.balance(params[0]) + params[1]
+        self.received[params[0]] += params[1]
+        return str(Signature(hashlib.sha512(f"airdrop {params[0]} {self.requests['requestAirdrop']}".encode()).digest()))
+
+    def handle_getBalance(self, params):
+        return {"context": self._context(), "value": self.balance(params[0])}
+
+    def handle_getMultipleAccounts(self, params):
+        if len(params[0]) > 100:
+            raise RpcError(-32602, "Too many inputs provided; max 100")
+        return {"context": self._context(), "value": [self._account(address) for address in params[0]]}
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        method = body.get("method")
+        self.requests[method] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.http_status is not None:
+                return web.Response(status=self.http_status, text="mock fault")
+            if self.fail_rate and self._random.random() < self.fail_rate:
+                raise RpcError(-32005, "Node is behind by 42 slots", {"numSlotsBehind": 42})
+            handler = getattr(self, f"handle_{method}", None)
+            if handler is None:
+                raise RpcError(-32601, "Method not found")
+            reply = {"jsonrpc": "2.0", "id": body.get("id"), "result": handler(body.get("params") or [])}
+        except RpcError as exc:
+            error = {"code": exc.code, "message": exc.message}
+            if exc.data is not None:
+                error["data"] = exc.data
+            reply = {"jsonrpc": "2.0", "id": body.get("id"), "error": error}
+        finally:
+            self.in_flight -= 1
+        return web.json_response(reply)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class RpcError(Exception):
+    def __init__(self, code: int, message: str, data: Optional[dict] = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
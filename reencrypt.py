@@ -0,0 +1,158 @@
+"""Re-encrypt the ``users`` table under the primary key.
+
+Key rotation: put the new key first in ``SECRET_KEYS`` (keep the old ones
+after it), restart the bot, run this job, then remove the old keys. The
+blind index (``telegram_id_index``) uses its own ``BLIND_INDEX_KEY``, which a
+rotation does not touch, so lookups by Telegram ID keep working throughout.
+
+The table is streamed in primary-key order, ``chunk_size`` rows at a time, so
+memory stays constant whatever its size. Each chunk is re-encrypted in a
+process pool and written in one transaction together with a checkpoint row in
+``job_checkpoints``; an interrupted run loses at most the chunk in progress and
+the next run continues after the last committed one. Values are only replaced
+if they did not change in the meantime, so the bot can keep running.
+
+Usage::
+
+    python reencrypt.py [--chunk-size 1000] [--workers 4] [--restart] [--max-chunks N]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+logger = logging.getLogger("GrapheneBot.reencrypt")
+
+Row = Tuple[int, Optional[str], Optional[str]]
+
+
+def job_name(keys: List[str]) -> str:
+    """Checkpoint name; a rotation to another primary key starts from the beginning."""
+    return "reencrypt:" + hashlib.sha256(keys[0].encode()).hexdigest()[:16]
+
+
+def _rotate_rows(keys: List[str], rows: List[Row]) -> Tuple[list, int]:
+    ring = MultiFernet([Fernet(key) for key in keys])
+    changes, failed = [], 0
+    for row_id, *values in rows:
+        for column, value in zip(("telegram_id_encrypted", "language_encrypted"), values):
+            if value is None:
+                continue
+            try:
+                changes.append((column, {"row_id": row_id, "old": value, "new": ring.rotate(value.encode()).decode()}))
+            except InvalidToken:
+                failed += 1
+    return changes, failed
+
+
+def _rotate(keys: List[str], rows: List[Row], pool: Optional[Executor], parts: int) -> Tuple[list, int]:
+    if pool is None or parts < 2 or len(rows) < 2:
+        return _rotate_rows(keys, rows)
+    size = -(-len(rows) // parts)
+    pieces = [rows[i:i + size] for i in range(0, len(rows), size)]
+    changes, failed = [], 0
+    for piece_changes, piece_failed in pool.map(_rotate_rows, [keys] * len(pieces), pieces):
+        changes.extend(piece_changes)
+        failed += piece_failed
+    return changes, failed
+
+
+def reencrypt(bind=None, keys: Optional[List[str]] = None, chunk_size: int = 1000, pool: Optional[Executor] = None,
+              workers: int = 1, restart: bool = False, max_chunks: Optional[int] = None) -> dict:
+    """Run (or resume) the job; returns counters of this run."""
+    from sqlalchemy import bindparam, select
+    from sqlalchemy.dialects.sqlite import insert
+
+    import database
+    from database import JobCheckpoint, User
+
+    if bind is None:
+        database.init_db()
+        bind = database.engine
+    keys = keys or database.SECRET_KEYS
+    name = job_name(keys)
+    users = User.__table__
+    checkpoints = JobCheckpoint.__table__
+    updates = {
+        column: users.update()
+        .where(users.c.id == bindparam("row_id"), users.c[column] == bindparam("old"))
+        .values({column: bindparam("new")})
+        for column in ("telegram_id_encrypted", "language_encrypted")
+    }
+
+    with bind.connect() as conn:
+        checkpoint = conn.execute(select(checkpoints.c.last_id, checkpoints.c.rows)
+                                  .where(checkpoints.c.name == name)).first()
+    last_id, total = (0, 0) if restart or checkpoint is None else tuple(checkpoint)
+    if last_id:
+        logger.info("Resuming %s after id %d (%d rows done)", name, last_id, total)
+
+    stats = {"rows": 0, "values": 0, "failed": 0, "chunks": 0, "last_id": last_id, "done": False}
+    start = time.perf_counter()
+    while max_chunks is None or stats["chunks"] < max_chunks:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(users.c.id, users.c.telegram_id_encrypted, users.c.language_encrypted)
+                .where(users.c.id > last_id).order_by(users.c.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                stats["done"] = True
+                break
+            changes, failed = _rotate(keys, [tuple(row) for row in rows], pool, workers)
+            for column, statement in updates.items():
+                params = [change for change_column, change in changes if change_column == column]
+                if params:
+                    conn.execute(statement, params)
+            last_id = rows[-1].id
+            total += len(rows)
+            conn.execute(
+                insert(checkpoints)
+                .values(name=name, last_id=last_id, rows=total, updated_at=time.time())
+                .on_conflict_do_update(index_elements=[checkpoints.c.name],
+                                       set_={"last_id": last_id, "rows": total, "updated_at": time.time()})
+            )
+        stats["rows"] += len(rows)
+        stats["values"] += len(changes)
+        stats["failed"] += failed
+        stats["chunks"] += 1
+        stats["last_id"] = last_id
+        elapsed = time.perf_counter() - start
+        logger.info("%d rows re-encrypted (up to id %d), %.0f rows/s", stats["rows"], last_id,
+                    stats["rows"] / elapsed if elapsed else 0.0)
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    if stats["failed"]:
+        logger.warning("%d values could not be decrypted with any configured key", stats["failed"])
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Re-encrypt users under the primary key of SECRET_KEYS.")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first row")
+    parser.add_argument("--max-chunks", type=int, help="stop after this many chunks; run again to continue")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    with ProcessPoolExecutor(args.workers) if args.workers > 1 else nullcontext() as pool:
+        try:
+            stats = reencrypt(chunk_size=args.chunk_size, pool=pool, workers=args.workers,
+                              restart=args.restart, max_chunks=args.max_chunks)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; the last committed chunk is kept, run again to resume")
+            return 130
+    state = "finished" if stats["done"] else "paused"
+    print(f"{state}: {stats['rows']} rows, {stats['values']} values in {stats['seconds']:.1f} s "
+          f"({stats['rows_per_second']:.0f} rows/s), {stats['failed']} undecryptable, last id {stats['last_id']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
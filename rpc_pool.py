@@ -0,0 +1,299 @@
+"""Pool of Solana RPC endpoints behind the ``AsyncClient`` interface.
+
+``RpcPool(["https://a", "https://b"])`` is used like an ``AsyncClient``
+(``await pool.get_balance(pubkey)``). Each call goes to the healthy endpoint
+with the lowest latency: the low median of its last ``latency_samples``
+requests, so one stalled request (or the first one, which also opened the
+connection) does not sideline a fast endpoint. Endpoints with fewer than two
+samples are tried first. Every ``probe_every``-th call goes to the endpoint
+used least recently instead, so the latencies of the others stay current.
+Cancelled requests are not samples. All endpoints share one HTTP session and
+its connection pool.
+
+Reads (``get_*`` methods) are hedged: if the answer takes longer than
+``hedge_after`` (by default twice the endpoint's latency, within
+``hedge_min``..``hedge_max``), the same request is also sent to the next
+endpoint and the first answer wins. The slower request is left to finish in
+the background (within ``timeout``), so its real latency is measured. Other
+methods, such as sending a transaction, go to one endpoint at a time. A
+failed request is retried on the next endpoint, up to ``max_attempts``
+endpoints. ``pool.pin()`` returns a client bound to one endpoint, for reads
+that must agree with each other (a block height and the signature statuses
+checked against it).
+
+A failure is a transport error, an HTTP error status (429, 5xx), a timeout or
+a JSON-RPC error that blames the node (unhealthy, internal error). Errors
+about the request itself (invalid params, preflight failure, ...) are raised
+at once without retrying and do not count against the endpoint.
+
+Circuit breaker: after ``failure_threshold`` consecutive failures, or an
+error rate of ``error_threshold`` over the last ``window`` requests (with at
+least ``min_calls`` of them), an endpoint is skipped for ``cooldown`` seconds.
+Then one trial request is let through: success closes the breaker, failure
+opens it again. If every breaker is open, the endpoint that opened first is
+tried anyway.
+"""
+import asyncio
+import functools
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Any, List, Optional, Sequence
+
+logger = logging.getLogger("GrapheneBot.rpc_pool")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+WARMUP_SAMPLES = 2
+
+# Errors caused by the request, not by the node that answered it
+CLIENT_ERRORS = (
+    "InvalidParamsMessage",
+    "InvalidRequestMessage",
+    "MethodNotFoundMessage",
+    "ParseErrorMessage",
+    "RpcCustomErrorFieldless",
+    "SendTransactionPreflightFailureMessage",
+    "TransactionPrecompileVerificationFailureMessage",
+    "UnsupportedTransactionVersionMessage",
+)
+
+
+def is_client_error(exc: BaseException) -> bool:
+    """True for JSON-RPC errors about the request; every endpoint would answer the same."""
+    from solana.rpc.core import RPCException
+
+    return isinstance(exc, RPCException) and bool(exc.args) and type(exc.args[0]).__name__ in CLIENT_ERRORS
+
+
+class Endpoint:
+    def __init__(self, url: str, client, window: int, samples: int):
+        self.url = url
+        self.client = client
+        self.samples = deque(maxlen=samples)  # Latest latencies, seconds
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.trial = False  # A half-open trial request is in flight
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.trips = 0
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def latency(self) -> Optional[float]:
+        return statistics.median_low(self.samples) if self.samples else None
+
+    @property
+    def measured(self) -> bool:
+        return len(self.samples) >= WARMUP_SAMPLES
+
+    def observe_latency(self, seconds: float):
+        self.samples.append(seconds)
+
+
+class RpcPool:
+    def __init__(self, endpoints: Sequence[str], commitment: Optional[str] = None, timeout: float = 10.0,
+                 hedge_after: Optional[float] = None, hedge_min: float = 0.05, hedge_max: float = 1.0,
+                 max_attempts: int = 3, window: int = 20, error_threshold: float = 0.5, min_calls: int = 5,
+                 failure_threshold: int = 3, cooldown: float = 10.0, latency_samples: int = 5, probe_every: int = 10,
+                 clock=time.monotonic, **client_options: Any):
+        from solana.rpc.async_api import AsyncClient
+
+        if not endpoints:
+            raise ValueError("RpcPool needs at least one endpoint")
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.max_attempts = max_attempts
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_every = probe_every
+        self.clock = clock
+        self.calls = 0
+        self.endpoints: List[Endpoint] = []
+        self.session = None
+        for url in endpoints:
+            client = AsyncClient(url, commitment, timeout=timeout, **client_options)
+            # One session for all endpoints: the provider only posts to its own URL through it
+            if self.session is None:
+                self.session = client._provider.session
+            else:
+                client._provider.session = self.session
+            self.endpoints.append(Endpoint(url, client, window, latency_samples))
+        self._stragglers = set()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    def _ranked(self) -> List[Endpoint]:
+        now = self.clock()
+        available = []
+        for endpoint in self.endpoints:
+            if endpoint.state == OPEN and now >= endpoint.open_until:
+                endpoint.state = HALF_OPEN
+            if endpoint.state == CLOSED or (endpoint.state == HALF_OPEN and not endpoint.trial):
+                available.append(endpoint)
+        if not available:
+            return sorted(self.endpoints, key=lambda endpoint: endpoint.open_until)
+        ranked = sorted(available, key=lambda endpoint: (endpoint.measured, endpoint.latency or 0.0, endpoint.in_flight))
+        self.calls += 1
+        if self.probe_every and self.calls % self.probe_every == 0 and len(ranked) > 1:
+            probe = min(ranked, key=lambda endpoint: endpoint.last_used)
+            ranked.remove(probe)
+            ranked.insert(0, probe)
+        return ranked
+
+    def _hedge_delay(self, endpoint: Endpoint) -> float:
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if endpoint.latency is None:
+            return self.hedge_max
+        return min(max(2 * endpoint.latency, self.hedge_min), self.hedge_max)
+
+    def _succeeded(self, endpoint: Endpoint, seconds: float):
+        endpoint.observe_latency(seconds)
+        endpoint.outcomes.append(True)
+        endpoint.consecutive_failures = 0
+        if endpoint.state != CLOSED:
+            logger.info("RPC endpoint %s recovered", endpoint.url)
+            endpoint.state = CLOSED
+            endpoint.outcomes.clear()
+
+    def _failed(self, endpoint: Endpoint, exc: BaseException):
+        endpoint.failures += 1
+        endpoint.outcomes.append(False)
+        endpoint.consecutive_failures += 1
+        tripped = (endpoint.consecutive_failures >= self.failure_threshold
+                   or (len(endpoint.outcomes) >= self.min_calls and endpoint.error_rate() >= self.error_threshold))
+        if endpoint.state == HALF_OPEN or (endpoint.state == CLOSED and tripped):
+            endpoint.state = OPEN
+            endpoint.open_until = self.clock() + self.cooldown
+            endpoint.trips += 1
+            logger.warning("RPC endpoint %s disabled for %.0f s: %r", endpoint.url, self.cooldown, exc)
+
+    async def _request(self, endpoint: Endpoint, method: str, args, kwargs):
+        if endpoint.state == HALF_OPEN:
+            endpoint.trial = True
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        endpoint.last_used = time.monotonic()
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(getattr(endpoint.client, method)(*args, **kwargs), self.timeout)
+        except Exception as exc:
+            if is_client_error(exc):
+                self._succeeded(endpoint, time.perf_counter() - start)
+            else:
+                self._failed(endpoint, exc)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+            endpoint.trial = False
+        self._succeeded(endpoint, time.perf_counter() - start)
+        return result
+
+    async def call(self, method: str, *args, **kwargs):
+        """``AsyncClient.<method>(*args, **kwargs)`` on the best endpoint(s)."""
+        candidates = self._ranked()[:self.max_attempts]
+        hedge = method.startswith("get_") and len(candidates) > 1
+        running = {}  # task -> endpoint
+        error: Optional[BaseException] = None
+        answered = False
+        try:
+            while True:
+                if candidates and (not running or hedge):
+                    endpoint = candidates.pop(0)
+                    if running:
+                        self.hedges += 1
+                    elif error is not None:
+                        self.failovers += 1
+                    running[asyncio.ensure_future(self._request(endpoint, method, args, kwargs))] = endpoint
+                if not running:
+                    raise error
+                primary = next(iter(running.values()))
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=self._hedge_delay(primary) if hedge and candidates else None)
+                for task in done:
+                    endpoint = running.pop(task)
+                    if task.exception() is None:
+                        if endpoint is not primary:
+                            self.hedge_wins += 1
+                        answered = True
+                        return task.result()
+                    error = task.exception()
+                    if is_client_error(error):
+                        raise error
+        finally:
+            for task in running:
+                if task.done():
+                    task.exception()  # Retrieved, so asyncio does not log it
+                elif answered:
+                    # A lost hedge: its answer still measures the endpoint
+                    self._stragglers.add(task)
+                    task.add_done_callback(self._straggler_done)
+                else:
+                    task.cancel()
+
+    def _straggler_done(self, task: asyncio.Task):
+        self._stragglers.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    def pin(self) -> "PinnedEndpoint":
+        """Client bound to the best endpoint now, for reads that must come from one node.
+
+        Its calls are neither hedged nor retried elsewhere, but still count for
+        the endpoint's latency and circuit breaker.
+        """
+        return PinnedEndpoint(self, self._ranked()[0])
+
+    async def close(self):
+        for task in list(self._stragglers):
+            task.cancel()
+        if self.session is not None:
+            await self.session.aclose()
+            self.session = None
+
+    def stats(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "endpoints": [{
+                "url": endpoint.url,
+                "state": endpoint.state,
+                "latency_ms": None if endpoint.latency is None else endpoint.latency * 1000,
+                "error_rate": endpoint.error_rate(),
+                "requests": endpoint.requests,
+                "failures": endpoint.failures,
+                "trips": endpoint.trips,
+            } for endpoint in self.endpoints],
+        }
+
+
+class PinnedEndpoint:
+    def __init__(self, pool: RpcPool, endpoint: Endpoint):
+        self.pool = pool
+        self.endpoint = endpoint
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.pool._request(self.endpoint, name, args, kwargs)
+        return call
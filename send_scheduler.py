@@ -0,0 +1,216 @@
+"""Outbound rate limiting for Telegram API calls.
+
+Telegram allows roughly one message per second per chat and about thirty per
+second overall, and answers with 429 ``retry_after`` when a bot goes faster.
+``SendScheduler`` makes every outgoing call wait for a token from a global and
+a per-chat bucket. Calls to the same chat are granted strictly in FIFO order;
+across chats, interactive calls are granted before bulk ones.
+
+It is registered as an aiogram session middleware (``bot.session.middleware``)
+and can wrap any other coroutine through ``submit``.
+"""
+import asyncio
+import contextvars
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+INTERACTIVE = 0
+BULK = 1
+
+THROTTLED_PREFIXES = ("send", "copy", "forward", "edit")
+
+_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    """Mark calls made inside the block as bulk traffic (broadcasts, airdrops)."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def default_retry_after(exc: BaseException) -> Optional[float]:
+    # aiogram.exceptions.TelegramRetryAfter
+    return getattr(exc, "retry_after", None)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Seconds until a token can be taken."""
+        now = self.clock() if now is None else now
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def consume(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class _Waiter:
+    __slots__ = ("chat_id", "priority", "seq", "future", "enqueued")
+
+    def __init__(self, chat_id, priority, seq, future, enqueued):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.enqueued = enqueued
+
+
+class SendScheduler:
+    def __init__(
+        self,
+        global_rate: float = 30,
+        per_chat_rate: float = 1,
+        per_chat_burst: float = 3,
+        max_retries: int = 3,
+        retry_after: Callable[[BaseException], Optional[float]] = default_retry_after,
+        clock=time.monotonic,
+    ):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.retry_after = retry_after
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, deque] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.retries = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst, self.clock)
+        return bucket
+
+    async def _acquire(self, chat_id, priority: int, seq: int, retry: bool = False):
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(chat_id, priority, seq, future, self.clock())
+        queue = self._queues.setdefault(chat_id, deque())
+        # A retried call keeps its place in front of later calls to the chat
+        queue.appendleft(waiter) if retry else queue.append(waiter)
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    def _grant(self, waiter: _Waiter, now: float):
+        self._queues[waiter.chat_id].popleft()
+        if not self._queues[waiter.chat_id]:
+            del self._queues[waiter.chat_id]
+        self.global_bucket.consume()
+        self._chat_bucket(waiter.chat_id).consume()
+        waited = now - waiter.enqueued
+        self.granted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        waiter.future.set_result(None)
+
+    async def _sleep(self, seconds: float):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _pump(self):
+        while self._queues:
+            now = self.clock()
+            global_wait = self.global_bucket.delay(now)
+            if global_wait > 0:
+                await self._sleep(global_wait)
+                continue
+            best, min_wait = None, float("inf")
+            for chat_id, queue in list(self._queues.items()):
+                while queue and queue[0].future.done():  # Cancelled callers
+                    queue.popleft()
+                if not queue:
+                    del self._queues[chat_id]
+                    continue
+                head = queue[0]
+                chat_wait = self._chat_bucket(chat_id).delay(now)
+                if chat_wait > 0:
+                    min_wait = min(min_wait, chat_wait)
+                elif best is None or (head.priority, head.seq) < (best.priority, best.seq):
+                    best = head
+            if best is not None:
+                self._grant(best, now)
+            elif self._queues:
+                await self._sleep(min_wait)
+            self._forget_idle_buckets(now)
+
+    def _forget_idle_buckets(self, now: float):
+        # Full buckets carry no state, so they don't need to be kept
+        if len(self._chat_buckets) > 1000:
+            for chat_id in [c for c, b in self._chat_buckets.items() if c not in self._queues and b.full(now)]:
+                del self._chat_buckets[chat_id]
+
+    async def submit(self, chat_id, call: Callable[[], Awaitable], priority: Optional[int] = None):
+        """Run ``call()`` once tokens are available; retries on 429."""
+        if chat_id is None:
+            return await call()
+        priority = _priority.get() if priority is None else priority
+        seq = next(self._seq)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority, seq, retry=attempt > 0)
+            try:
+                return await call()
+            except Exception as exc:
+                delay = self.retry_after(exc)
+                if delay is None or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                self._chat_bucket(chat_id).pause(delay)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if not getattr(method, "__api_method__", "").startswith(THROTTLED_PREFIXES):
+            chat_id = None
+        return await self.submit(chat_id, lambda: make_request(bot, method))
+
+    def stats(self) -> dict:
+        depth = {INTERACTIVE: 0, BULK: 0}
+        for queue in self._queues.values():
+            for waiter in queue:
+                depth[waiter.priority] = depth.get(waiter.priority, 0) + 1
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_interactive": depth[INTERACTIVE],
+            "queue_depth_bulk": depth[BULK],
+            "chats_waiting": len(self._queues),
+            "granted": self.granted,
+            "retries": self.retries,
+            "wait_avg": self.wait_total / self.granted if self.granted else 0.0,
+            "wait_max": self.wait_max,
+        }
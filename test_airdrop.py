@@ -0,0 +1,135 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from solana.rpc.async_api import AsyncClient
+from solders.keypair import Keypair
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from airdrop import AirdropEngine, add_recipients, summary, transfers_per_transaction
+from async_db import DatabaseExecutor
+from database import Base
+from mock_rpc import MockRpc
+from rpc_pool import RpcPool
+
+
+class Crash(BaseException):
+    pass
+
+
+class CrashingClient:
+    """Crashes at the ``crash_at``-th send, after sending it or instead of it."""
+
+    def __init__(self, client, crash_at: int, before_send: bool = False):
+        self.client = client
+        self.crash_at = crash_at
+        self.before_send = before_send
+        self.sends = 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def send_raw_transaction(self, txn, opts=None):
+        self.sends += 1
+        if self.sends == self.crash_at and self.before_send:
+            raise Crash()
+        result = await self.client.send_raw_transaction(txn, opts)
+        if self.sends == self.crash_at:
+            raise Crash()
+        return result
+
+
+class TestAirdrop(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rpc = MockRpc(slot_time=0.01, blockhash_validity=20)
+        self.client = AsyncClient(await self.rpc.start())
+        self.payer = Keypair()
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.db')}")
+        Base.metadata.create_all(self.engine)
+        self.factory = sessionmaker(bind=self.engine)
+        self.database = DatabaseExecutor(workers=1, session_factory=self.factory)
+        self.recipients = {str(Keypair().pubkey()): 1000 + i for i in range(50)}
+        await self.database.transaction(add_recipients, "test", self.recipients.items())
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.rpc.close()
+        self.database.close()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def airdrop(self, client=None, **kwargs):
+        return AirdropEngine(client or self.client, self.database, self.payer, "test", poll_interval=0.01, **kwargs)
+
+    def summary(self):
+        db = self.factory()
+        try:
+            return summary(db, "test")
+        finally:
+            db.close()
+
+    def assertPaidOnce(self):
+        self.assertEqual(dict(self.rpc.received), self.recipients)
+        self.assertEqual(self.summary(), {"confirmed": (50, sum(self.recipients.values()))})
+
+    async def test_packs_transfers_and_reports_fees(self):
+        self.assertEqual(transfers_per_transaction(self.payer), 21)
+        stats = await self.airdrop().run()
+        self.assertPaidOnce()
+        self.assertEqual(self.rpc.requests["sendTransaction"], 3)
+        self.assertEqual(self.rpc.requests["getLatestBlockhash"], 1)
+        self.assertEqual((stats["confirmed_transactions"], stats["confirmed_recipients"]), (3, 50))
+        self.assertEqual(stats["fee_per_recipient"], 3 * 5000 / 50)
+        self.assertGreater(stats["transactions_per_second"], 0)
+        self.assertEqual(await self.database.transaction(add_recipients, "test", self.recipients.items()), 0)
+
+    async def test_dropped_transaction_is_sent_again(self):
+        self.rpc.drop_next = 1
+        stats = await self.airdrop(blockhash_ttl=0).run()
+        self.assertPaidOnce()
+        self.assertEqual((stats["expired"], stats["transactions"]), (1, 4))
+
+    async def test_crash_after_send_does_not_pay_twice(self):
+        with self.assertRaises(Crash):
+            await self.airdrop(CrashingClient(self.client, crash_at=2), concurrency=1).run()
+        self.assertEqual(self.rpc.requests["sendTransaction"], 2)
+        stats = await self.airdrop().run()
+        self.assertPaidOnce()
+        self.assertEqual(stats["confirmed_recipients"], 50)
+        self.assertEqual(self.rpc.requests["sendTransaction"], 3)
+
+    async def test_late_resume_searches_status_history(self):
+        self.rpc.status_cache_slots = 5
+        with self.assertRaises(Crash):
+            await self.airdrop(CrashingClient(self.client, crash_at=2), concurrency=1).run()
+        # Resumed after the blockhash expired and the statuses left the recent cache
+        await asyncio.sleep(30 * self.rpc.slot_time)
+        stats = await self.airdrop().run()
+        self.assertPaidOnce()
+        self.assertEqual(stats["confirmed_recipients"], 50)
+        self.assertEqual(self.rpc.requests["sendTransaction"], 3)
+
+    async def test_crash_before_send_waits_for_expiry(self):
+        with self.assertRaises(Crash):
+            await self.airdrop(CrashingClient(self.client, crash_at=2, before_send=True), concurrency=1).run()
+        self.assertEqual(self.rpc.requests["sendTransaction"], 1)
+        stats = await self.airdrop().run()
+        self.assertPaidOnce()
+        self.assertGreaterEqual(stats["expired"], 1)
+        self.assertEqual(self.rpc.requests["sendTransaction"], 3)
+
+    async def test_runs_through_rpc_pool(self):
+        pool = RpcPool([self.rpc.url])
+        try:
+            stats = await self.airdrop(pool).run()
+        finally:
+            await pool.close()
+        self.assertPaidOnce()
+        self.assertEqual(stats["confirmed_recipients"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from async_db import DatabaseExecutor, DatabaseSessionMiddleware, SingleFlight
+from database import Base, User, get_or_create_user
+
+
+class TestAsyncDatabase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.db')}")
+        Base.metadata.create_all(self.engine)
+        self.factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.database = DatabaseExecutor(workers=2, session_factory=self.factory)
+        self.middleware = DatabaseSessionMiddleware(self.database)
+
+    async def asyncTearDown(self):
+        self.database.close()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def count(self):
+        db = self.factory()
+        try:
+            return db.query(User).count()
+        finally:
+            db.close()
+
+    async def test_loop_keeps_running(self):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await self.database.run(time.sleep, 0.1)
+        task.cancel()
+        self.assertGreater(ticks, 5)
+
+    async def test_session_per_update(self):
+        async def handler(event, data):
+            user = await data["db"].transaction(get_or_create_user, event)
+            return user.telegram_id
+
+        self.assertEqual(await asyncio.gather(*(self.middleware(handler, 7, {}) for _ in range(3))), ["7"] * 3)
+        self.assertEqual(await self.middleware(handler, 8, {}), "8")
+        self.assertEqual(self.count(), 2)
+
+    async def test_rollback_on_error(self):
+        async def handler(event, data):
+            await data["db"].run(lambda db: db.add(User(telegram_id=event)))
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            await self.middleware(handler, 9, {})
+        self.assertEqual(self.count(), 0)
+
+    async def test_single_flight(self):
+        flight = SingleFlight()
+        users = await asyncio.gather(*(flight.do(5, self.database.transaction, get_or_create_user, 5) for _ in range(10)))
+        self.assertEqual((flight.calls, flight.shared), (1, 9))
+        self.assertTrue(all(user is users[0] for user in users))
+        # Finished calls are not cached
+        await flight.do(5, self.database.transaction, get_or_create_user, 5)
+        self.assertEqual(flight.calls, 2)
+        self.assertEqual(self.count(), 1)
+
+    async def test_single_flight_error(self):
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise ValueError
+
+        results = await asyncio.gather(flight.do(1, fail), flight.do(1, fail), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(flight.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
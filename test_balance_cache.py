@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+
+from balance_cache import BalanceCache, InvalidAddress
+
+ADDRESS = "11111111111111111111111111111111"
+OTHER = "So11111111111111111111111111111111111111112"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRpc:
+    def __init__(self):
+        self.calls = []
+        self.balance = 100
+        self.fail = False
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, pubkey, commitment):
+        self.calls.append((str(pubkey), commitment))
+        await self.release.wait()
+        if self.fail:
+            raise ConnectionError("rpc down")
+        return self.balance
+
+
+class TestBalanceCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rpc = FakeRpc()
+        self.clock = Clock()
+        self.cache = BalanceCache(self.rpc, ttl=10, stale_ttl=60, clock=self.clock)
+
+    async def asyncTearDown(self):
+        await self.cache.close()
+
+    async def test_invalid_address_makes_no_call(self):
+        for address in ("", "/airdrop", "not-an-address", ADDRESS[:-1]):
+            with self.assertRaises(InvalidAddress):
+                await self.cache.get_balance(address)
+        self.assertEqual(self.rpc.calls, [])
+
+    async def test_cached_per_address_and_commitment(self):
+        self.assertEqual(await self.cache.get_balance(ADDRESS), 100)
+        self.rpc.balance = 200
+        self.assertEqual(await self.cache.get_balance(f" {ADDRESS} "), 100)
+        self.assertEqual(await self.cache.get_balance(ADDRESS, "finalized"), 200)
+        self.assertEqual(await self.cache.get_balance(OTHER), 200)
+        self.assertEqual(len(self.rpc.calls), 3)
+        self.assertEqual(self.cache.stats()["saved_calls"], 1)
+
+    async def test_concurrent_lookups_share_one_call(self):
+        self.rpc.release.clear()
+        lookups = [asyncio.create_task(self.cache.get_balance(ADDRESS)) for _ in range(20)]
+        await asyncio.sleep(0)
+        self.rpc.release.set()
+        self.assertEqual(await asyncio.gather(*lookups), [100] * 20)
+        self.assertEqual(len(self.rpc.calls), 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats["coalesced"], stats["saved_calls"]), (19, 19))
+
+    async def test_stale_value_served_while_refreshing(self):
+        await self.cache.get_balance(ADDRESS)
+        self.rpc.balance = 150
+        self.rpc.release.clear()
+        self.clock.now = 30
+        self.assertEqual(await self.cache.get_balance(ADDRESS), 100)
+        self.assertEqual(await self.cache.get_balance(ADDRESS), 100)
+        self.rpc.release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self.rpc.calls), 2)
+        self.assertEqual(await self.cache.get_balance(ADDRESS), 150)
+        self.assertEqual(len(self.rpc.calls), 2)
+
+    async def test_failed_refresh_keeps_value(self):
+        await self.cache.get_balance(ADDRESS)
+        self.rpc.fail = True
+        self.clock.now = 30
+        self.assertEqual(await self.cache.get_balance(ADDRESS), 100)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.cache.stats()["errors"], 1)
+        self.clock.now = 61
+        with self.assertRaises(ConnectionError):
+            await self.cache.get_balance(ADDRESS)
+
+
+if __name__ == "__main__":
+    unittest.main()
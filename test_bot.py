@@ -1,11 +1,65 @@
 import unittest
+from unittest import mock
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+from solders.keypair import Keypair
+
+import bot
 from bot import get_or_create_user
+from mock_rpc import MockRpc
+
+class TestBot(unittest.IsolatedAsyncioTestCase):
+    async def rpc(self, count=1):
+        """Point bot.py at fresh mock RPC servers for this test."""
+        servers = [MockRpc(latency=0) for _ in range(count)]
+        urls = [await server.start() for server in servers]
+        with mock.patch.object(bot, "SOLANA_RPC_URLS", urls):
+            bot._solana_client = None
+            bot.get_solana_client()
+
+        async def close():
+            await bot._solana_client.close()
+            bot._solana_client = None
+            for server in servers:
+                await server.close()
 
-class TestBot(unittest.TestCase):
-    def test_get_or_create_user(self):
-        user = get_or_create_user("123456")
+        self.addAsyncCleanup(close)
+        return servers
+
+    async def test_get_or_create_user(self):
+        user = await get_or_create_user("123456")
         self.assertEqual(user.telegram_id, "123456")
         self.assertEqual(user.balance, 0)
 
+    async def test_sends_go_through_the_scheduler(self):
+        message = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi"}
+        before = bot.send_scheduler.stats()
+        with mock.patch.object(Bot, "request", mock.AsyncMock(side_effect=[RetryAfter(0), message])) as request:
+            sent = await bot.bot.send_message(1, "hi")
+        self.assertEqual(sent.text, "hi")
+        self.assertEqual(request.await_count, 2)  # Retried after the 429
+        after = bot.send_scheduler.stats()
+        self.assertEqual((after["granted"] - before["granted"], after["retries"] - before["retries"]), (2, 1))
+
+    async def test_wallet_balance_is_cached(self):
+        server, = await self.rpc()
+        address = str(Keypair().pubkey())
+        expected = f"Ваш баланс: {server.balance(address)} лампортов."
+        self.assertEqual(await bot.connect_wallet(address), expected)
+        self.assertEqual(await bot.connect_wallet(address), expected)
+        self.assertEqual(server.requests["getBalance"], 1)
+        self.assertEqual(await bot.connect_wallet("not-an-address"), "Неверный адрес кошелька Solana.")
+        self.assertEqual(server.requests["getBalance"], 1)
+
+    async def test_wallet_lookup_fails_over_between_rpc_urls(self):
+        down, up = await self.rpc(count=2)
+        down.http_status = 503
+        for _ in range(5):
+            address = str(Keypair().pubkey())
+            self.assertEqual(await bot.connect_wallet(address), f"Ваш баланс: {up.balance(address)} лампортов.")
+        self.assertGreater(down.requests["getBalance"], 0)
+        self.assertGreater(bot.get_solana_client().failovers, 0)
+
 if __name__ == "__main__":
     unittest.main()
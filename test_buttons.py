@@ -0,0 +1,35 @@
+import os
+import unittest
+
+from aiogram.utils.i18n import I18n
+
+from buttons import ButtonIndex, ButtonMatch
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+
+class TestButtonIndex(unittest.TestCase):
+    def setUp(self):
+        self.i18n = I18n(path=LOCALES_DIR, default_locale="en", domain="graphene_bot")
+        self.index = ButtonIndex(
+            self.i18n,
+            {"about": "ℹ️ About Project", "whitepaper": "📜 Whitepaper", "back": "⬅️ Back"},
+            {"🇷🇺 Русский": ButtonMatch("set_language", "ru")},
+        )
+
+    def test_localized_labels(self):
+        self.assertEqual(self.index.match("ℹ️ About Project"), ButtonMatch("about", "en"))
+        self.assertEqual(self.index.match("ℹ️ О Проекте"), ButtonMatch("about", "ru"))
+        self.assertEqual(self.index.match("⬅️ Назад"), ButtonMatch("back", "ru"))
+
+    def test_shared_label_keeps_user_locale(self):
+        self.assertEqual(self.index.match("📜 Whitepaper"), ButtonMatch("whitepaper", None))
+
+    def test_static_and_unknown(self):
+        self.assertEqual(self.index.match("🇷🇺 Русский"), ButtonMatch("set_language", "ru"))
+        self.assertIsNone(self.index.match("hello"))
+        self.assertIsNone(self.index.match(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
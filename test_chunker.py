@@ -0,0 +1,44 @@
+import asyncio
+import random
+import unittest
+
+from chunker import send_chunks, split_message, utf16_len
+
+
+class TestSplitMessage(unittest.TestCase):
+    def test_counts_utf16_code_units(self):
+        self.assertEqual(utf16_len("a😀"), 3)
+        chunks = split_message("😀" * 100, limit=10)
+        self.assertTrue(all(utf16_len(chunk) <= 10 for chunk in chunks))
+        self.assertEqual("".join(chunks), "😀" * 100)
+
+    def test_prefers_section_boundaries(self):
+        text = "1. Intro\nline one\n\nnote\n\n2. Next\nline two"
+        self.assertEqual(split_message(text, limit=30), ["1. Intro\nline one\n\nnote", "2. Next\nline two"])
+
+    def test_splits_lines_then_words(self):
+        chunks = split_message("row one\nrow two\nthree four five", limit=10)
+        self.assertEqual(chunks, ["row one", "row two", "three four", "five"])
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_message("hello"), ["hello"])
+
+
+class TestSendChunks(unittest.IsolatedAsyncioTestCase):
+    async def test_chunks_arrive_in_order(self):
+        delivered = []
+        latencies = random.Random(4)
+
+        class Bot:
+            async def send_message(self, chat_id, text):
+                await asyncio.sleep(latencies.uniform(0, 0.02))
+                delivered.append(text)
+                return text
+
+        chunks = [f"part {i}" for i in range(10)]
+        self.assertEqual(await send_chunks(Bot(), 1, chunks), chunks)
+        self.assertEqual(delivered, chunks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+import database
+from database import User, blind_index, decrypt_many, encrypt, get_or_create_user, make_engine, migrate_blind_index
+
+
+class TestBlindIndex(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_lookup_by_telegram_id(self):
+        User.metadata.create_all(self.engine)
+        db = sessionmaker(bind=self.engine)()
+        db.add(User(telegram_id=42))
+        db.commit()
+        user = db.query(User).filter(User.by_telegram_id(42)).one()
+        self.assertEqual(user.telegram_id, "42")
+        self.assertEqual(user.telegram_id_index, blind_index("42"))
+        self.assertIsNone(db.query(User).filter(User.by_telegram_id(43)).first())
+        db.close()
+
+    def test_existing_user_is_one_read(self):
+        User.metadata.create_all(self.engine)
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        db = sessionmaker(bind=self.engine)()
+        user = get_or_create_user(db, 42)
+        db.commit()
+        self.assertEqual([statement.split()[0] for statement in statements], ["SELECT", "INSERT"])
+        user.balance = 10
+        db.commit()
+        statements.clear()
+        again = get_or_create_user(db, 42)
+        self.assertEqual([statement.split()[0] for statement in statements], ["SELECT"])
+        self.assertEqual((again.id, again.telegram_id, again.balance, again.language), (user.id, "42", 10, "en"))
+        self.assertEqual(db.query(User).count(), 1)
+        db.close()
+
+    def test_concurrent_insert_is_read(self):
+        User.metadata.create_all(self.engine)
+        db = sessionmaker(bind=self.engine)()
+        first = get_or_create_user(db, 42)
+        db.commit()
+        scalars = db.scalars
+        calls = []
+
+        def racing_scalars(statement, *args, **kwargs):
+            calls.append(statement)
+            result = scalars(statement, *args, **kwargs)
+            # The first read misses: another process inserts the user right after it
+            return mock.Mock(first=lambda: None) if len(calls) == 1 else result
+
+        with mock.patch.object(db, "scalars", racing_scalars):
+            again = get_or_create_user(db, 42)
+        self.assertEqual(len(calls), 3)  # Read, insert that did nothing, read again
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(db.query(User).count(), 1)
+        db.close()
+
+    def test_decrypt_on_read(self):
+        User.metadata.create_all(self.engine)
+        db = sessionmaker(bind=self.engine)()
+        db.add(User(telegram_id=42, language="ru", balance=3))
+        db.commit()
+        db.close()
+        database.decrypt.cache_clear()
+        db = sessionmaker(bind=self.engine)()
+        user = db.query(User).one()
+        self.assertEqual(user.balance, 3)
+        self.assertEqual(database.decrypt.cache_info().currsize, 0)
+        self.assertEqual(user.language, "ru")
+        self.assertEqual(user.language, "ru")
+        self.assertEqual(database.decrypt.cache_info().hits, 1)
+        user.language = "en"
+        db.commit()
+        self.assertEqual(db.query(User).one().language, "en")
+        db.close()
+
+    def test_decrypt_many(self):
+        values = [str(i) for i in range(10)] + [None]
+        ciphertexts = [encrypt(value) if value is not None else None for value in values]
+        self.assertEqual(decrypt_many(ciphertexts, chunk_size=3), values)
+        with ThreadPoolExecutor(2) as pool:
+            self.assertEqual(decrypt_many(ciphertexts, pool, chunk_size=3), values)
+
+    def test_backfill_merges_duplicates(self):
+        with self.engine.begin() as conn:
+            # Schema before the blind index
+            conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id VARCHAR, "
+                              "language VARCHAR, balance INTEGER)"))
+            rows = [(1, "7", "en", 5), (2, "8", "en", 0), (3, "7", "ru", 2), (4, "7", "en", 1), (5, "9", "en", 0)]
+            for user_id, telegram_id, language, balance in rows:
+                conn.execute(text("INSERT INTO users VALUES (:id, :tid, :lang, :balance)"),
+                             {"id": user_id, "tid": encrypt(telegram_id), "lang": encrypt(language), "balance": balance})
+            conn.execute(text("INSERT INTO users VALUES (6, 'not-a-token', NULL, 0)"))
+
+        self.assertEqual(migrate_blind_index(self.engine, chunk_size=2), 5)
+
+        db = sessionmaker(bind=self.engine)()
+        user = db.query(User).filter(User.by_telegram_id(7)).one()
+        self.assertEqual((user.id, user.balance, user.language), (1, 8, "en"))
+        self.assertEqual(db.query(User).filter(User.by_telegram_id("8")).one().id, 2)
+        self.assertEqual(db.query(User).count(), 4)
+        db.close()
+        indexes = {index["name"]: index["unique"] for index in inspect(self.engine).get_indexes("users")}
+        self.assertTrue(indexes["ix_users_telegram_id_index"])
+        # Nothing left to do on a second run
+        self.assertEqual(migrate_blind_index(self.engine), 0)
+
+    def test_rebuild_moves_ledger_of_duplicates(self):
+        import ledger
+
+        User.metadata.create_all(self.engine)
+        db = sessionmaker(bind=self.engine)()
+        # Two rows of one Telegram ID, indexed with another key
+        users = [User(telegram_id_encrypted=encrypt("7"), telegram_id_index=f"old-{i}", balance=0) for i in range(2)]
+        db.add_all(users)
+        db.flush()
+        ledger.credit(db, users[0].id, 5, "reward", now=1)
+        ledger.credit(db, users[1].id, 3, "reward", now=2)
+        ledger.snapshot(db, until=10)
+        db.commit()
+        db.close()
+
+        self.assertEqual(migrate_blind_index(self.engine, rebuild=True), 2)
+
+        db = sessionmaker(bind=self.engine)()
+        user = db.query(User).filter(User.by_telegram_id(7)).one()
+        self.assertEqual(user.balance, 8)
+        self.assertEqual(ledger.balance_as_of(db, user.id, 20), 8)
+        self.assertEqual({entry.user_id for entry in db.query(database.LedgerEntry)}, {user.id})
+        self.assertEqual(db.query(database.BalanceSnapshot).count(), 0)
+        db.close()
+
+    def test_key_is_persisted_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.key")
+            self.assertEqual(database._persisted_key(path, "first", "BLIND_INDEX_KEY"), "first")
+            # Later runs keep the stored key, whatever the key ring derives now
+            self.assertEqual(database._persisted_key(path, "second", "BLIND_INDEX_KEY"), "first")
+
+    def test_startup_check_rejects_another_key(self):
+        User.metadata.create_all(self.engine)
+        database.check_blind_index(self.engine)  # Empty table
+        db = sessionmaker(bind=self.engine)()
+        db.add(User(telegram_id=42))
+        db.commit()
+        db.close()
+        database.check_blind_index(self.engine)
+        with mock.patch.object(database, "BLIND_INDEX_KEY", "another key"):
+            with self.assertRaises(database.BlindIndexMismatch):
+                database.check_blind_index(self.engine)
+
+
+class TestEngineProfile(unittest.TestCase):
+    def pragmas(self, profile):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_engine(f"sqlite:///{os.path.join(directory, 'test.db')}", profile)
+            with engine.connect() as conn:
+                values = {name: conn.execute(text(f"PRAGMA {name}")).scalar()
+                          for name in ("journal_mode", "synchronous", "busy_timeout")}
+            engine.dispose()
+        return values
+
+    def test_tuned(self):
+        self.assertEqual(self.pragmas("tuned"), {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000})
+
+    def test_default(self):
+        self.assertEqual(self.pragmas("default")["journal_mode"], "delete")
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            make_engine("sqlite://", "fast")
+
+
+if __name__ == "__main__":
+    unittest.main()
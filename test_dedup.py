@@ -0,0 +1,99 @@
+import unittest
+
+from dedup import UpdateDeduplicator
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeUpdate:
+    def __init__(self, update_id):
+        self.update_id = update_id
+
+
+class TestUpdateDeduplicator(unittest.IsolatedAsyncioTestCase):
+    def test_ttl_and_size_bound(self):
+        clock = FakeClock()
+        dedup = UpdateDeduplicator(ttl=10, maxsize=3, clock=clock)
+        self.assertFalse(dedup.seen(1))
+        self.assertTrue(dedup.seen(1))
+        clock.now = 11
+        self.assertFalse(dedup.seen(1))  # Expired
+        for update_id in (2, 3, 4):
+            dedup.seen(update_id)
+        self.assertFalse(dedup.seen(1))  # Pushed out of the ring
+        self.assertLessEqual(dedup.stats()["tracked"], 3)
+
+    async def test_middleware_drops_duplicates(self):
+        dedup = UpdateDeduplicator()
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event.update_id)
+            return "done"
+
+        self.assertEqual(await dedup(handler, FakeUpdate(5), {}), "done")
+        self.assertIsNone(await dedup(handler, FakeUpdate(5), {}))
+        self.assertEqual(handled, [5])
+        self.assertEqual(dedup.stats()["dropped"], 1)
+
+    async def test_failed_update_is_handled_when_redelivered(self):
+        claimed = set()
+
+        class Store:
+            def claim(self, update_id):
+                if update_id in claimed:
+                    return False
+                claimed.add(update_id)
+                return True
+
+            def release(self, update_id):
+                claimed.discard(update_id)
+
+        async def run(function, *args):
+            return function(*args)
+
+        dedup = UpdateDeduplicator(store=Store(), run=run)
+        attempts = []
+
+        async def handler(event, data):
+            attempts.append(event.update_id)
+            if len(attempts) == 1:
+                raise RuntimeError("database is locked")
+            return "done"
+
+        with self.assertRaises(RuntimeError):
+            await dedup(handler, FakeUpdate(7), {})
+        self.assertEqual((claimed, dedup.stats()["tracked"]), (set(), 0))
+        self.assertEqual(await dedup(handler, FakeUpdate(7), {}), "done")
+        self.assertIsNone(await dedup(handler, FakeUpdate(7), {}))
+        self.assertEqual(attempts, [7, 7])
+
+    async def test_failed_claim_is_forgotten(self):
+        failures = [RuntimeError("database is locked")]
+
+        class Store:
+            def claim(self, update_id):
+                if failures:
+                    raise failures.pop()
+                return True
+
+        async def run(function, *args):
+            return function(*args)
+
+        async def handler(event, data):
+            return "done"
+
+        dedup = UpdateDeduplicator(store=Store(), run=run)
+        with self.assertRaises(RuntimeError):
+            await dedup(handler, FakeUpdate(8), {})
+        self.assertEqual(await dedup(handler, FakeUpdate(8), {}), "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+from document_cache import DocumentCache
+
+
+class FakeBot:
+    def __init__(self, delay=0.0, errors=None):
+        self.calls = []
+        self.delay = delay
+        self.errors = errors or {}  # chat_id -> error description
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_document(self, chat_id, document, **kwargs):
+        if chat_id in self.errors:
+            raise TelegramBadRequest(method=None, message=self.errors[chat_id])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        uploaded = isinstance(document, BufferedInputFile)
+        self.calls.append("upload" if uploaded else document)
+        file_id = f"file-{len(self.calls)}" if uploaded else document
+        return SimpleNamespace(document=SimpleNamespace(file_id=file_id))
+
+
+class TestDocumentCache(unittest.IsolatedAsyncioTestCase):
+    async def test_upload_once_then_reuse(self):
+        bot, cache = FakeBot(), DocumentCache()
+        await cache.send(bot, 1, "whitepaper", "en", "text v1")
+        await cache.send(bot, 2, "whitepaper", "en", "text v1")
+        await cache.send(bot, 3, "whitepaper", "ru", "текст v1")
+        self.assertEqual(bot.calls, ["upload", "file-1", "upload"])
+        self.assertEqual(cache.stats()["reuses"], 1)
+
+    async def test_changed_text_is_uploaded_again(self):
+        bot, cache = FakeBot(), DocumentCache()
+        await cache.send(bot, 1, "roadmap", "en", "old")
+        await cache.send(bot, 1, "roadmap", "en", "new")
+        self.assertEqual(bot.calls, ["upload", "upload"])
+
+    async def test_file_id_survives_restart(self):
+        bot, cache = FakeBot(), DocumentCache()
+        await cache.send(bot, 1, "team", "en", "team")
+        restarted = DocumentCache(cache.store)
+        await restarted.send(bot, 1, "team", "en", "team")
+        self.assertEqual(bot.calls, ["upload", "file-1"])
+
+    async def test_cached_sends_run_in_parallel(self):
+        bot, cache = FakeBot(delay=0.01), DocumentCache()
+        await cache.send(bot, 1, "whitepaper", "en", "text")
+        await asyncio.gather(*(cache.send(bot, chat_id, "whitepaper", "en", "text") for chat_id in range(2, 12)))
+        self.assertEqual(bot.calls.count("upload"), 1)
+        self.assertEqual(bot.max_in_flight, 10)
+
+    async def test_concurrent_first_sends_upload_once(self):
+        bot, cache = FakeBot(delay=0.01), DocumentCache()
+        await asyncio.gather(*(cache.send(bot, chat_id, "whitepaper", "en", "text") for chat_id in range(5)))
+        self.assertEqual(bot.calls.count("upload"), 1)
+
+    async def test_only_invalid_file_id_is_dropped(self):
+        bot, cache = FakeBot(), DocumentCache()
+        await cache.send(bot, 1, "team", "en", "team")
+        bot.errors[2] = "Bad Request: chat not found"
+        with self.assertRaises(TelegramBadRequest):
+            await cache.send(bot, 2, "team", "en", "team")
+        self.assertEqual(cache.stats()["cached"], 1)
+        bot.errors[3] = "Bad Request: wrong file identifier/HTTP URL specified"
+        with self.assertRaises(TelegramBadRequest):
+            await cache.send(bot, 3, "team", "en", "team")
+        self.assertEqual(cache.stats()["cached"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
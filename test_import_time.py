@@ -0,0 +1,54 @@
+"""Startup budget for `import main`, measured with `python -X importtime`.
+
+Only time spent in this project's own modules is budgeted (IMPORT_BUDGET_MS);
+third-party import cost depends on the machine. Heavy subsystems must not be
+imported at startup at all.
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "150"))
+LAZY_MODULES = ("database", "sqlalchemy", "cryptography", "solana", "solders", "bot")
+
+
+def local_modules():
+    return {name[:-3] for name in os.listdir(BASE_DIR) if name.endswith(".py")}
+
+
+def import_times(module="main"):
+    """{module: (self_us, cumulative_us)} from -X importtime output."""
+    env = dict(os.environ, TELEGRAM_TOKEN=os.getenv("TELEGRAM_TOKEN", "42:TEST"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import_times()  # Warm up the bytecode cache
+        cls.times = import_times()
+
+    def test_heavy_subsystems_are_lazy(self):
+        loaded = [name for name in self.times if name.split(".")[0] in LAZY_MODULES]
+        self.assertEqual(loaded, [])
+
+    def test_own_modules_within_budget(self):
+        own = local_modules()
+        spent_ms = sum(self_us for name, (self_us, _) in self.times.items() if name in own) / 1000
+        self.assertLessEqual(spent_ms, IMPORT_BUDGET_MS, f"project modules took {spent_ms:.1f} ms to import")
+
+
+if __name__ == "__main__":
+    unittest.main()
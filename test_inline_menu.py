@@ -0,0 +1,87 @@
+import os
+import unittest
+from unittest import mock
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, Message
+from aiogram.utils.i18n import I18n
+
+from inline_menu import InlineMenu, MenuButton
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+
+class TestInlineMenu(unittest.TestCase):
+    def setUp(self):
+        self.i18n = I18n(path=LOCALES_DIR, default_locale="en", domain="graphene_bot")
+        self.url = "https://example.com/app"
+        self.menu = InlineMenu(
+            self.i18n,
+            {"main": [[MenuButton("🚀 GrapheneApp", web_app=True)],
+                      [MenuButton("⬅️ Назад", "back"), MenuButton("🇷🇺 Русский", "set_language", "ru", translate=False)]]},
+            {"back": "b", "set_language": "l"},
+            webapp_url=lambda: self.url,
+        )
+
+    def test_round_trip(self):
+        self.assertEqual(self.menu.encode("back"), "n:b")
+        self.assertEqual(self.menu.decode("n:b"), ("back", None))
+        self.assertEqual(self.menu.decode(self.menu.encode("set_language", "ru")), ("set_language", "ru"))
+
+    def test_foreign_data(self):
+        self.assertEqual(self.menu.decode("n:zz"), (None, None))
+        self.assertEqual(self.menu.decode("other"), (None, None))
+        self.assertEqual(self.menu.decode(None), (None, None))
+
+    def test_keyboard(self):
+        markup = self.menu.keyboard("main", "ru")
+        rows = markup.inline_keyboard
+        self.assertEqual(rows[0][0].web_app.url, self.url)
+        self.assertEqual(rows[1][0].text, "⬅️ Назад")
+        self.assertEqual(rows[1][0].callback_data, "n:b")
+        self.assertEqual(rows[1][1].text, "🇷🇺 Русский")
+        self.assertLessEqual(max(len(b.callback_data or "") for row in rows for b in row), 64)
+
+    def test_cached_until_invalidated(self):
+        markup = self.menu.keyboard("main", "en")
+        self.assertIs(self.menu.keyboard("main", "en"), markup)
+        self.url = "https://example.com/new"
+        self.menu.invalidate()
+        self.assertEqual(self.menu.keyboard("main", "en").inline_keyboard[0][0].web_app.url, self.url)
+
+
+class TestMenuCallback(unittest.IsolatedAsyncioTestCase):
+    def callback(self, action):
+        import main
+
+        chat = {"id": 1, "type": "private"}
+        return CallbackQuery.model_validate({
+            "id": "1", "from": {"id": 1, "is_bot": False, "first_name": "T"}, "chat_instance": "1",
+            "data": main.inline_menu.encode(action),
+            "message": {"message_id": 1, "date": 0, "chat": chat, "text": "menu"},
+        })
+
+    async def test_menu_is_sent_anew_when_it_cannot_be_edited(self):
+        import main
+
+        error = TelegramBadRequest(method=None, message="Bad Request: message can't be edited")
+        with mock.patch.object(main, "respond", mock.AsyncMock()) as respond, \
+                mock.patch.object(main, "get_user_locale", mock.AsyncMock(return_value="en")), \
+                mock.patch.object(Message, "edit_text", mock.AsyncMock(side_effect=error)), \
+                mock.patch.object(Message, "answer", mock.AsyncMock()) as answer:
+            await main.handle_menu_callback(self.callback("about"))
+        answer.assert_awaited_once()
+        respond.assert_awaited_once()
+
+    async def test_query_is_answered_when_the_menu_fails(self):
+        import main
+
+        with mock.patch.object(main, "respond", mock.AsyncMock()) as respond, \
+                mock.patch.object(main, "get_user_locale", mock.AsyncMock(side_effect=RuntimeError)):
+            with self.assertRaises(RuntimeError):
+                await main.handle_menu_callback(self.callback("about"))
+        respond.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
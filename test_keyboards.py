@@ -0,0 +1,49 @@
+import unittest
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+from keyboards import KeyboardPayloadSession, KeyboardRegistry
+
+
+def build_keyboard(locale):
+    return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=f"Back ({locale})")]], resize_keyboard=True)
+
+
+class TestKeyboardRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = KeyboardRegistry({"back": build_keyboard})
+        self.session = KeyboardPayloadSession(self.registry)
+        self.bot = Bot(token="42:TEST", session=self.session)
+
+    def test_markup_is_built_once_per_locale(self):
+        markup = self.registry.get("back", "en")
+        self.assertIs(markup, self.registry.get("back", "en"))
+        self.assertIsNot(markup, self.registry.get("back", "ru"))
+        self.registry.invalidate()
+        self.assertIsNot(markup, self.registry.get("back", "en"))
+
+    def test_register_drops_payloads_with_markups(self):
+        old = self.registry.get("back", "en")
+        self.registry.get("back", "ru")
+        self.registry.register("back", build_keyboard)
+        self.assertIsNone(self.registry.payload(old))
+        self.assertEqual(self.registry._payloads, {})
+        new = self.registry.get("back", "en")
+        self.assertIsNotNone(self.registry.payload(new))
+        self.assertEqual(len(self.registry._payloads), len(self.registry))
+
+    def test_payload_matches_default_serialization(self):
+        method = SendMessage(chat_id=1, text="hi", reply_markup=self.registry.get("back", "ru"))
+        cached = self.session.build_form_data(self.bot, method)
+        plain = AiohttpSession.build_form_data(self.session, self.bot, method)
+        self.assertEqual(cached._fields, plain._fields)
+
+    def test_foreign_markup_has_no_payload(self):
+        self.assertIsNone(self.registry.payload(build_keyboard("en")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+import ledger
+from async_db import DatabaseExecutor
+from database import Base, LedgerEntry, User, get_or_create_user
+from migrations import opening_balances
+
+
+class TestLedger(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.db')}")
+        Base.metadata.create_all(self.engine)
+        self.factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.database = DatabaseExecutor(workers=4, session_factory=self.factory)
+        db = self.factory()
+        self.ids = [get_or_create_user(db, telegram_id).id for telegram_id in range(1, 6)]
+        db.commit()
+        db.close()
+
+    async def asyncTearDown(self):
+        self.database.close()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def query(self, fn, *args):
+        db = self.factory()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    def balances(self):
+        return self.query(lambda db: [db.get(User, user_id).balance for user_id in self.ids])
+
+    def ledger_sums(self):
+        return self.query(lambda db: [db.execute(select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+                                                 .where(LedgerEntry.user_id == user_id)).scalar()
+                                      for user_id in self.ids])
+
+    async def test_concurrent_credits_are_not_lost(self):
+        user_id = self.ids[0]
+        await asyncio.gather(*(self.database.transaction(ledger.credit, user_id, 1, "reward") for _ in range(50)))
+        self.assertEqual(self.balances()[0], 50)
+        self.assertEqual(self.ledger_sums()[0], 50)
+
+    async def test_debit_cannot_go_negative(self):
+        user_id = self.ids[0]
+        await self.database.transaction(ledger.credit, user_id, 5, "reward")
+        with self.assertRaises(ledger.InsufficientBalance):
+            await self.database.transaction(ledger.credit, user_id, -6, "purchase")
+        await self.database.transaction(ledger.credit, user_id, -5, "purchase")
+        self.assertEqual(self.balances()[0], 0)
+        with self.assertRaises(LookupError):
+            await self.database.transaction(ledger.credit, 999, 1, "reward")
+
+    async def test_bulk_credit(self):
+        await self.database.transaction(ledger.bulk_credit, [(self.ids[0], 10), (self.ids[1], 20), (self.ids[0], 1)],
+                                        "airdrop")
+        self.assertEqual(self.balances(), [11, 20, 0, 0, 0])
+        credited = await self.database.transaction(ledger.credit_all, 3, "bonus", User.id > self.ids[2])
+        self.assertEqual(credited, 2)
+        self.assertEqual(self.balances(), [11, 20, 0, 3, 3])
+        self.assertEqual(self.ledger_sums(), self.balances())
+
+    async def test_balance_as_of_with_snapshots(self):
+        user_id = self.ids[0]
+        for at, amount in ((10.0, 5), (20.0, 7), (30.0, -2)):
+            await self.database.transaction(ledger.credit, user_id, amount, "test", False, at)
+        self.assertEqual(await self.database.transaction(ledger.snapshot, 20.0), 1)
+        self.assertEqual(await self.database.transaction(ledger.snapshot, 20.0), 0)
+        await self.database.transaction(ledger.credit, user_id, 100, "test", False, 40.0)
+        self.assertEqual(await self.database.transaction(ledger.snapshot, 35.0), 1)
+        for at, expected in ((5.0, 0), (10.0, 5), (25.0, 12), (30.0, 10), (35.0, 10), (50.0, 110)):
+            self.assertEqual(self.query(ledger.balance_as_of, user_id, at), expected, at)
+
+    async def test_late_entry_is_counted_once(self):
+        user_id = self.ids[0]
+        for at, amount in ((10.0, 5), (20.0, 7), (30.0, -2)):
+            await self.database.transaction(ledger.credit, user_id, amount, "test", False, at)
+        self.assertEqual(await self.database.transaction(ledger.snapshot, 20.0), 1)
+        # Written after that snapshot with an older timestamp (e.g. a retried write)
+        await self.database.transaction(ledger.credit, user_id, 50, "test", False, 15.0)
+        self.assertEqual(await self.database.transaction(ledger.snapshot, 35.0), 1)
+        self.assertEqual(await self.database.transaction(ledger.snapshot, 35.0), 0)
+        self.assertEqual(self.query(ledger.balance_as_of, user_id, 50.0), 60)
+        self.assertEqual(self.query(ledger.balance_as_of, user_id, 25.0), 62)
+        self.assertEqual(self.balances()[0], 60)
+
+    def test_opening_balances(self):
+        db = self.factory()
+        db.get(User, self.ids[1]).balance = 42
+        db.commit()
+        db.close()
+        self.assertEqual(opening_balances(self.engine), 1)
+        self.assertEqual(opening_balances(self.engine), 0)
+        self.assertEqual(self.ledger_sums(), self.balances())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from locale_store import LocaleStore, MemoryLocaleBackend
+
+
+class CountingBackend(MemoryLocaleBackend):
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+        self.saves = []
+
+    def load(self, user_id):
+        self.loads += 1
+        return super().load(user_id)
+
+    def save_many(self, locales):
+        self.saves.append(dict(locales))
+        super().save_many(locales)
+
+
+class TestLocaleStore(unittest.IsolatedAsyncioTestCase):
+    async def test_write_behind_and_hit_rate(self):
+        backend = CountingBackend()
+        store = LocaleStore(backend, maxsize=10, batch_size=100)
+        self.assertIsNone(await store.get(1))
+        self.assertIsNone(await store.get(1))  # Negative result is cached
+        store.set(1, "ru")
+        store.set(2, "en")
+        self.assertEqual(await store.get(1), "ru")
+        self.assertEqual(backend.saves, [])
+        await store.close()
+        self.assertEqual(backend.saves, [{1: "ru", 2: "en"}])
+        self.assertEqual(backend.loads, 1)
+        self.assertEqual(store.stats()["hit_rate"], 2 / 3)
+
+    async def test_lru_bound_keeps_unflushed_changes(self):
+        backend = CountingBackend()
+        store = LocaleStore(backend, maxsize=2, batch_size=100)
+        for user_id in range(5):
+            store.set(user_id, "ru")
+        self.assertEqual(store.stats()["size"], 2)
+        self.assertEqual(await store.get(0), "ru")
+        await store.flush()
+        self.assertEqual(await store.get(0), "ru")  # Reloaded from the backend
+        self.assertEqual(backend.loads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect, text
+
+import migrations
+from database import Base, JobCheckpoint, encrypt
+
+
+def schema(engine):
+    inspector = inspect(engine)
+    return {table: ({column["name"] for column in inspector.get_columns(table)},
+                    {index["name"] for index in inspector.get_indexes(table)})
+            for table in inspector.get_table_names() if table != "schema_version"}
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.db')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_fresh_database_matches_models(self):
+        with self.assertRaises(migrations.SchemaOutdated):
+            migrations.check(self.engine)
+        applied = migrations.upgrade(self.engine)
+        self.assertEqual([m.version for m in applied], [m.version for m in migrations.MIGRATIONS])
+        self.assertEqual(migrations.check(self.engine), migrations.HEAD)
+        self.assertEqual(migrations.upgrade(self.engine), [])
+
+        reference = create_engine("sqlite://")
+        Base.metadata.create_all(reference)
+        self.assertEqual(schema(self.engine), schema(reference))
+        reference.dispose()
+
+    def test_upgrade_in_steps(self):
+        migrations.upgrade(self.engine, target=2)
+        self.assertEqual(migrations.current_version(self.engine), 2)
+        self.assertNotIn("ledger_entries", inspect(self.engine).get_table_names())
+        self.assertEqual([m.version for m in migrations.upgrade(self.engine)], [3, 4, 5, 6, 7])
+
+    def test_first_version_is_frozen(self):
+        # Later columns and indexes come from their own migrations, not from the models
+        migrations.upgrade(self.engine, target=1)
+        columns, indexes = schema(self.engine)["users"]
+        self.assertEqual(columns, {"id", "telegram_id", "language", "balance"})
+        self.assertEqual(indexes, {"ix_users_id"})
+
+    def test_upgrade_legacy_database(self):
+        # Schema written by create_all before the blind index and the ledger
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id VARCHAR, "
+                              "language VARCHAR, balance INTEGER)"))
+            conn.execute(text("INSERT INTO users (telegram_id, language, balance) VALUES (:t, :l, :b)"),
+                         [{"t": encrypt(str(i)), "l": encrypt("en"), "b": i % 2 * 10} for i in range(1, 11)])
+        migrations.upgrade(self.engine)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT COUNT(*) FROM users WHERE telegram_id_index IS NULL")).scalar(), 0)
+            self.assertEqual(conn.execute(text("SELECT COUNT(*), SUM(amount) FROM ledger_entries")).one(), (5, 50))
+        self.assertIn("ix_users_balance", {index["name"] for index in inspect(self.engine).get_indexes("users")})
+
+    def test_backfill_resumes_after_checkpoint(self):
+        migrations.upgrade(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (id, balance) VALUES (:id, 0)"), [{"id": i} for i in range(1, 26)])
+            conn.execute(JobCheckpoint.__table__.insert().values(name="migration:bump", last_id=10, rows=10,
+                                                                 updated_at=0))
+        statement = "UPDATE users SET balance = balance + 1 WHERE id > :low AND id <= :high"
+        self.assertEqual(migrations.backfill(self.engine, "bump", statement, chunk_size=4), 15)
+        self.assertEqual(migrations.backfill(self.engine, "bump", statement, chunk_size=4), 0)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT SUM(balance) FROM users WHERE id <= 10")).scalar(), 0)
+            self.assertEqual(conn.execute(text("SELECT SUM(balance) FROM users WHERE id > 10")).scalar(), 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
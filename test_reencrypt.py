@@ -0,0 +1,54 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, insert, select
+
+from database import Base, JobCheckpoint, User
+from reencrypt import job_name, reencrypt
+
+
+class TestReencrypt(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(self.engine)
+        self.old, self.new = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+        old = Fernet(self.old)
+        rows = [{"id": i, "telegram_id_encrypted": old.encrypt(str(i).encode()).decode(),
+                 "language_encrypted": old.encrypt(b"ru").decode(), "balance": i} for i in range(1, 6)]
+        rows.append({"id": 6, "telegram_id_encrypted": "broken", "language_encrypted": None, "balance": 0})
+        with self.engine.begin() as conn:
+            conn.execute(insert(User), rows)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def stored(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(User.telegram_id_encrypted, User.language_encrypted).order_by(User.id)).all()
+
+    def test_resumable_rotation(self):
+        keys = [self.new, self.old]
+        stats = reencrypt(self.engine, keys, chunk_size=2, max_chunks=1)
+        self.assertEqual((stats["rows"], stats["last_id"], stats["done"]), (2, 2, False))
+        with self.engine.connect() as conn:
+            checkpoint = conn.execute(select(JobCheckpoint.last_id, JobCheckpoint.rows)
+                                      .where(JobCheckpoint.name == job_name(keys))).one()
+        self.assertEqual(tuple(checkpoint), (2, 2))
+
+        with ThreadPoolExecutor(2) as pool:
+            stats = reencrypt(self.engine, keys, chunk_size=2, pool=pool, workers=2)
+        self.assertEqual((stats["rows"], stats["failed"], stats["done"]), (4, 1, True))
+
+        new = Fernet(self.new)
+        stored = self.stored()
+        for telegram_id, (token, language) in enumerate(stored[:5], start=1):
+            self.assertEqual(new.decrypt(token.encode()).decode(), str(telegram_id))
+            self.assertEqual(new.decrypt(language.encode()), b"ru")
+        self.assertEqual(tuple(stored[5]), ("broken", None))
+        # Finished: nothing left for this key
+        self.assertEqual(reencrypt(self.engine, keys)["rows"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import time
+import unittest
+
+from solana.rpc.core import RPCException
+from solders.keypair import Keypair
+
+from mock_rpc import MockRpc
+from rpc_pool import CLOSED, OPEN, RpcPool
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRpcPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.servers = [MockRpc(latency=latency) for latency in (0.03, 0.002, 0.015)]
+        self.urls = [await server.start() for server in self.servers]
+        self.clock = Clock()
+        self.pool = RpcPool(self.urls, clock=self.clock, cooldown=10, max_attempts=3)
+        self.pubkey = Keypair().pubkey()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        for server in self.servers:
+            await server.close()
+
+    def requests(self, method="getBalance"):
+        return [server.requests[method] for server in self.servers]
+
+    def endpoint(self, index):
+        return self.pool.endpoints[index]
+
+    async def balances(self, count):
+        for _ in range(count):
+            self.assertEqual((await self.pool.get_balance(self.pubkey)).value, self.servers[0].balance(str(self.pubkey)))
+
+    def first(self):
+        """Index of the endpoint the next call would go to."""
+        return self.pool.endpoints.index(min(self.pool.endpoints, key=lambda endpoint: endpoint.latency))
+
+    def measured(self, *latencies):
+        for endpoint, latency in zip(self.pool.endpoints, latencies):
+            for _ in range(5):
+                endpoint.observe_latency(latency)
+
+    async def test_routes_to_the_fastest_endpoint(self):
+        self.measured(0.3, 0.001, 0.1)
+        for server in self.servers:
+            server.latency = 0
+        self.pool.hedge_after = 10
+        await self.balances(40)
+        # Every 10th call probes the endpoint used least recently
+        self.assertEqual(self.requests(), [2, 36, 2])
+
+    async def test_one_stall_does_not_sideline_the_fastest(self):
+        self.measured(0.3, 0.001, 0.1)
+        self.endpoint(1).observe_latency(2.0)  # e.g. the event loop was blocked
+        self.assertIs(self.pool._ranked()[0], self.endpoint(1))
+        self.assertEqual(self.endpoint(1).latency, 0.001)
+
+    async def test_cancelled_calls_are_not_samples(self):
+        await self.balances(6)
+        samples = [list(endpoint.samples) for endpoint in self.pool.endpoints]
+        for server in self.servers:
+            server.latency = 0.3
+        self.pool.hedge_after = 10
+        task = asyncio.ensure_future(self.pool.get_balance(self.pubkey))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual([list(endpoint.samples) for endpoint in self.pool.endpoints], samples)
+        self.assertTrue(all(endpoint.failures == 0 for endpoint in self.pool.endpoints))
+
+    async def test_shares_one_session(self):
+        sessions = {id(endpoint.client._provider.session) for endpoint in self.pool.endpoints}
+        self.assertEqual(sessions, {id(self.pool.session)})
+        session = self.pool.session
+        await self.pool.close()
+        self.assertTrue(session.is_closed)
+
+    async def test_failing_endpoint_trips_and_recovers(self):
+        await self.balances(6)
+        first = self.first()
+        endpoint, server = self.endpoint(first), self.servers[first]
+        for other in self.servers:
+            other.latency = 0.05  # Failovers must not overtake the failing endpoint
+        server.http_status = 503
+        await self.balances(10)
+        self.assertEqual((endpoint.state, endpoint.trips), (OPEN, 1))
+        failed = server.requests["getBalance"]
+        await self.balances(10)
+        self.assertEqual(server.requests["getBalance"], failed)  # Skipped while open
+
+        self.clock.now = 11
+        await self.balances(1)  # The half-open trial fails: open again
+        self.assertEqual(server.requests["getBalance"], failed + 1)
+        self.assertEqual((endpoint.state, endpoint.trips), (OPEN, 2))
+
+        server.http_status = None
+        self.clock.now = 22
+        await self.balances(1)
+        self.assertEqual(endpoint.state, CLOSED)
+        self.assertEqual(server.requests["getBalance"], failed + 2)
+
+    async def test_unhealthy_node_errors_fail_over(self):
+        self.servers[1].fail_rate = 1.0
+        await self.balances(10)
+        self.assertEqual(self.endpoint(1).state, OPEN)
+        self.assertGreater(self.pool.failovers, 0)
+
+    async def test_random_faults_on_most_endpoints(self):
+        self.servers[0].fail_rate = 0.3
+        self.servers[1].fail_rate = 0.3
+        self.servers[2].http_status = 429
+        for server in self.servers:
+            server.latency = 0.001
+        self.pool.max_attempts = 3
+        succeeded = 0
+        for _ in range(40):
+            try:
+                await self.pool.get_balance(self.pubkey)
+                succeeded += 1
+            except Exception:
+                pass
+        self.assertGreaterEqual(succeeded, 30)
+        self.assertEqual(self.endpoint(2).state, OPEN)
+
+    async def test_slow_read_is_hedged(self):
+        await self.balances(6)
+        first = self.first()
+        self.servers[first].latency = 0.3
+        self.pool.hedge_after = 0.1
+        start = time.perf_counter()
+        await self.balances(1)
+        self.assertLess(time.perf_counter() - start, 0.25)
+        self.assertEqual((self.pool.hedges, self.pool.hedge_wins), (1, 1))
+        # The slower request finishes in the background and is measured
+        while self.pool._stragglers:
+            await asyncio.sleep(0.01)
+        self.assertGreaterEqual(self.endpoint(first).samples[-1], 0.3)
+
+    async def test_writes_are_not_hedged(self):
+        await self.balances(6)
+        first = self.first()
+        self.servers[first].latency = 0.3
+        self.pool.hedge_after = 0.02
+        await self.pool.request_airdrop(self.pubkey, 5)
+        self.assertEqual(self.requests("requestAirdrop"), [int(index == first) for index in range(3)])
+        self.assertEqual(sum(server.received[str(self.pubkey)] for server in self.servers), 5)
+
+    async def test_pinned_reads_use_one_endpoint(self):
+        await self.balances(6)
+        before = self.requests()
+        pinned = self.pool.pin()
+        for _ in range(5):
+            await pinned.get_balance(self.pubkey)
+        after = self.requests()
+        self.assertEqual([b - a for a, b in zip(before, after)].count(5), 1)
+        self.assertEqual(sum(after) - sum(before), 5)
+
+    async def test_request_errors_are_not_retried(self):
+        pubkeys = [Keypair().pubkey() for _ in range(101)]
+        with self.assertRaises(RPCException):
+            await self.pool.get_multiple_accounts(pubkeys)
+        self.assertEqual(sum(self.requests("getMultipleAccounts")), 1)
+        self.assertTrue(all(endpoint.failures == 0 for endpoint in self.pool.endpoints))
+
+    async def test_all_endpoints_down(self):
+        for server in self.servers:
+            server.http_status = 503
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                await self.pool.get_balance(self.pubkey)
+        self.assertTrue(all(endpoint.state == OPEN for endpoint in self.pool.endpoints))
+        # Still tried, earliest opened first
+        self.servers[0].http_status = None
+        self.servers[1].http_status = None
+        self.servers[2].http_status = None
+        await self.balances(1)
+        self.assertEqual(sum(endpoint.state == CLOSED for endpoint in self.pool.endpoints), 1)
+
+    async def test_timeout_counts_as_failure(self):
+        self.pool.timeout = 0.1
+        self.pool.hedge_after = 10
+        await self.balances(6)
+        first = self.first()
+        self.servers[first].latency = 0.5
+        await self.balances(6)
+        self.assertEqual(self.endpoint(first).state, OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
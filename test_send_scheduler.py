@@ -0,0 +1,55 @@
+import asyncio
+import time
+import unittest
+
+from send_scheduler import BULK, INTERACTIVE, SendScheduler
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Flood control exceeded")
+        self.retry_after = retry_after
+
+
+class TestSendScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_per_chat_fifo_and_rate(self):
+        scheduler = SendScheduler(per_chat_rate=20, per_chat_burst=1)
+        sent = []
+
+        async def send(i):
+            sent.append((i, time.monotonic()))
+
+        await asyncio.gather(*(scheduler.submit(1, lambda i=i: send(i)) for i in range(4)))
+        self.assertEqual([i for i, _ in sent], [0, 1, 2, 3])
+        self.assertGreaterEqual(sent[-1][1] - sent[0][1], 0.14)
+        self.assertEqual(scheduler.stats()["granted"], 4)
+
+    async def test_interactive_before_bulk(self):
+        scheduler = SendScheduler(global_rate=2)
+        sent = []
+
+        async def send(chat_id):
+            sent.append(chat_id)
+
+        calls = [scheduler.submit(chat_id, lambda c=chat_id: send(c), priority=BULK) for chat_id in range(1, 4)]
+        calls.append(scheduler.submit(99, lambda: send(99), priority=INTERACTIVE))
+        await asyncio.gather(*calls)
+        self.assertEqual(sent[0], 99)
+
+    async def test_retry_after_is_honoured(self):
+        scheduler = SendScheduler()
+        attempts = []
+
+        async def send():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.1)
+            return "ok"
+
+        self.assertEqual(await scheduler.submit(1, send), "ok")
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.09)
+        self.assertEqual(scheduler.stats()["retries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
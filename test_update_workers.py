@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+
+from update_workers import UpdateWorkerPool, update_chat_key
+
+
+def make_update(update_id, chat_id):
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id}}}
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.log = []
+
+    async def feed_raw_update(self, bot, update):
+        chat_id = update["message"]["chat"]["id"]
+        self.log.append(("start", chat_id, update["update_id"]))
+        await asyncio.sleep(0.05 if chat_id == 1 else 0.01)
+        self.log.append(("end", chat_id, update["update_id"]))
+
+
+class TestUpdateWorkerPool(unittest.IsolatedAsyncioTestCase):
+    def test_chat_key(self):
+        self.assertEqual(update_chat_key(make_update(1, 42)), 42)
+        callback = {"update_id": 2, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 42}}}}
+        self.assertEqual(update_chat_key(callback), 42)
+
+    async def test_same_chat_in_order_other_chats_in_parallel(self):
+        dispatcher = FakeDispatcher()
+        pool = UpdateWorkerPool(dispatcher, bot=None, workers=4)
+        await pool.start()
+        for update_id, chat_id in [(1, 1), (2, 1), (3, 2), (4, 1)]:
+            self.assertTrue(pool.submit(make_update(update_id, chat_id)))
+        await pool.close()
+        chat_1 = [entry for entry in dispatcher.log if entry[1] == 1]
+        self.assertEqual(chat_1, [("start", 1, 1), ("end", 1, 1), ("start", 1, 2), ("end", 1, 2),
+                                  ("start", 1, 4), ("end", 1, 4)])
+        # Chat 2 finished while chat 1 was still busy with its first update
+        self.assertLess(dispatcher.log.index(("end", 2, 3)), dispatcher.log.index(("end", 1, 1)))
+        self.assertEqual(pool.stats()["processed"], 4)
+
+    async def test_backpressure(self):
+        pool = UpdateWorkerPool(FakeDispatcher(), bot=None, workers=1, max_queue=2)
+        self.assertTrue(pool.submit(make_update(1, 1)))
+        self.assertTrue(pool.submit(make_update(2, 2)))
+        self.assertFalse(pool.submit(make_update(3, 3)))
+        await pool.start()
+        await pool.close()
+        self.assertFalse(pool.submit(make_update(4, 4)))
+        self.assertEqual(pool.stats()["rejected"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
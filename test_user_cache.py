@@ -0,0 +1,104 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from async_db import DatabaseExecutor
+from database import Base, User
+from ledger import InsufficientBalance
+from user_cache import UserCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.db')}")
+        Base.metadata.create_all(self.engine)
+        self.factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.database = DatabaseExecutor(workers=2, session_factory=self.factory)
+        self.clock = Clock()
+        self.cache = UserCache(self.database, maxsize=2, ttl=60, batch_size=100, clock=self.clock)
+
+    async def asyncTearDown(self):
+        self.database.close()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def stored(self, telegram_id):
+        db = self.factory()
+        try:
+            user = db.query(User).filter(User.by_telegram_id(telegram_id)).one()
+            return user.balance, user.language
+        finally:
+            db.close()
+
+    async def test_hits_and_ttl(self):
+        users = await asyncio.gather(*(self.cache.get(1) for _ in range(5)))
+        self.assertTrue(all(user is users[0] for user in users))
+        self.assertEqual(self.database.calls, 1)
+        await self.cache.get(1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.clock.now = 61
+        await self.cache.get(1)
+        self.assertEqual(self.database.calls, 2)
+
+    async def test_write_behind(self):
+        await self.cache.add_balance(1, 5)
+        self.assertEqual(await self.cache.add_balance(1, 3), 8)
+        self.assertEqual(self.stored(1), (0, "en"))
+        await self.cache.close()
+        self.assertEqual(self.stored(1), (8, "en"))
+        self.assertEqual(self.cache.stats()["flushes"], 1)
+
+    async def test_unsaved_changes_survive_eviction_and_invalidate(self):
+        await self.cache.add_balance(1, 5)
+        await self.cache.get(2)
+        await self.cache.get(3)  # Evicts 1
+        self.cache.invalidate(1)
+        self.assertEqual((await self.cache.get(1)).balance, 5)
+        await self.cache.flush()
+        self.cache.invalidate(1)
+        self.assertEqual((await self.cache.get(1)).balance, 5)
+        self.assertEqual(self.stored(1), (5, "en"))
+
+    async def test_invalidate_reads_external_changes(self):
+        await self.cache.get(1)
+        db = self.factory()
+        db.query(User).filter(User.by_telegram_id(1)).update({"balance": 42})
+        db.commit()
+        db.close()
+        self.assertEqual((await self.cache.get(1)).balance, 0)
+        self.cache.invalidate(1)
+        self.assertEqual((await self.cache.get(1)).balance, 42)
+
+
+    async def test_debit_below_zero_is_refused(self):
+        await self.cache.add_balance(1, 5)
+        with self.assertRaises(InsufficientBalance):
+            await self.cache.add_balance(1, -6)
+        self.assertEqual(await self.cache.add_balance(1, -5), 0)
+        self.assertEqual(await self.cache.add_balance(1, -1, allow_negative=True), -1)
+
+    async def test_ledger_credits_update_cached_balances(self):
+        first, second = await self.cache.get(1), await self.cache.get(2)
+        await self.cache.add_balance(1, 5)  # Not flushed yet
+        await self.cache.credit(first.id, 10, "reward")
+        await self.cache.bulk_credit([(first.id, 1), (second.id, 2), (first.id, 3)], "airdrop")
+        self.assertEqual(((await self.cache.get(1)).balance, (await self.cache.get(2)).balance), (19, 2))
+        await self.cache.flush()
+        self.assertEqual((self.stored(1)[0], self.stored(2)[0]), (19, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import io
+import time
+import unittest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from database import Base, User, blind_index
+from ledger import balance_as_of, snapshot
+from users_io import export_rows, import_rows, read_file, write_file
+
+
+class TestUsersIO(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def export(self, fmt):
+        out = io.StringIO()
+        write_file(out, export_rows(self.engine, batch_size=2), fmt)
+        return out.getvalue()
+
+    def test_round_trip(self):
+        source = io.StringIO('{"telegram_id": "1", "language": "ru", "balance": 5}\n\n'
+                             '{"telegram_id": 2, "language": "en", "balance": 0}\n'
+                             '{"telegram_id": "3", "language": null}\n')
+        self.assertEqual(import_rows(self.engine, read_file(source, "jsonl"), batch_size=2), 3)
+        self.assertEqual(self.export("csv").splitlines(),
+                         ["telegram_id,language,balance", "1,ru,5", "2,en,0", "3,,0"])
+        with self.engine.connect() as conn:
+            index = conn.execute(select(User.telegram_id_index).where(User.id == 1)).scalar()
+        self.assertEqual(index, blind_index(1))
+
+    def test_conflicts(self):
+        import_rows(self.engine, [{"telegram_id": "1", "language": "en", "balance": 1}])
+        import_rows(self.engine, read_file(io.StringIO("telegram_id,language,balance\n1,ru,9\n"), "csv"))
+        self.assertEqual(self.export("jsonl"), '{"telegram_id": "1", "language": "en", "balance": 1}\n')
+        import_rows(self.engine, [{"telegram_id": "1", "language": "ru", "balance": 9}], on_conflict="update")
+        self.assertEqual(self.export("jsonl"), '{"telegram_id": "1", "language": "ru", "balance": 9}\n')
+
+    def test_balances_are_ledger_entries(self):
+        import_rows(self.engine, [{"telegram_id": "1", "balance": 5}, {"telegram_id": "2", "balance": 0}])
+        with Session(self.engine) as db:
+            snapshot(db, until=time.time())
+            db.commit()
+        import_rows(self.engine, [{"telegram_id": "1", "balance": 3}, {"telegram_id": "1", "balance": 7},
+                                  {"telegram_id": "3", "balance": 4}], on_conflict="update")
+        with Session(self.engine) as db:
+            users = db.query(User).order_by(User.id).all()
+            self.assertEqual([user.balance for user in users], [7, 0, 4])
+            self.assertEqual([balance_as_of(db, user.id, time.time()) for user in users], [7, 0, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
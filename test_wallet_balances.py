@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from solana.rpc.async_api import AsyncClient
+from solders.keypair import Keypair
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from async_db import DatabaseExecutor
+from balance_cache import BalanceCache
+from database import Base, WalletBalance
+from mock_rpc import MockRpc
+from wallet_balances import fetch_balances, refresh_balances, store_balances
+
+
+class FailingClient:
+    def __init__(self, client):
+        self.client = client
+        self.calls = 0
+
+    async def get_multiple_accounts(self, pubkeys, commitment=None):
+        self.calls += 1
+        if self.calls == 2:
+            raise ConnectionError("rpc down")
+        return await self.client.get_multiple_accounts(pubkeys, commitment)
+
+
+class TestWalletBalances(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rpc = MockRpc(latency=0.01)
+        self.client = AsyncClient(await self.rpc.start())
+        self.addresses = [str(Keypair().pubkey()) for _ in range(250)]
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.db')}")
+        Base.metadata.create_all(self.engine)
+        self.factory = sessionmaker(bind=self.engine)
+        self.database = DatabaseExecutor(workers=1, session_factory=self.factory)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.rpc.close()
+        self.database.close()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def stored(self):
+        with self.engine.connect() as conn:
+            return {row.address: (row.lamports, row.slot) for row in conn.execute(select(WalletBalance.__table__))}
+
+    async def rpc_fetch(self, pubkey, commitment):
+        return (await self.client.get_balance(pubkey, commitment)).value
+
+    async def test_batches_of_100_with_bounded_concurrency(self):
+        refresh = await fetch_balances(self.client, self.addresses + self.addresses[:10] + ["bad"], concurrency=2)
+        self.assertEqual(self.rpc.requests["getMultipleAccounts"], 3)
+        self.assertEqual(self.rpc.requests["getBalance"], 0)
+        self.assertLessEqual(self.rpc.max_in_flight, 2)
+        self.assertEqual(refresh.invalid, ["bad"])
+        self.assertEqual(refresh.rpc_calls, 3)
+        self.assertEqual({address: lamports for address, (lamports, _) in refresh.balances.items()},
+                         {address: self.rpc.balance(address) for address in self.addresses})
+
+    async def test_refresh_writes_in_bulk_and_primes_cache(self):
+        cache = BalanceCache(self.rpc_fetch)
+        await refresh_balances(self.client, self.database, self.addresses, cache=cache)
+        stored = self.stored()
+        self.assertEqual({address: lamports for address, (lamports, _) in stored.items()},
+                         {address: self.rpc.balance(address) for address in self.addresses})
+        self.assertTrue(all(slot >= 1000 for _, slot in stored.values()))
+        self.assertEqual(await cache.get_balance(self.addresses[0]), self.rpc.balance(self.addresses[0]))
+        self.assertEqual(self.rpc.requests["getBalance"], 0)
+
+    async def test_failed_chunk_is_reported(self):
+        refresh = await fetch_balances(FailingClient(self.client), self.addresses, concurrency=1)
+        self.assertEqual(len(refresh.failed), 100)
+        self.assertEqual(len(refresh.balances), 150)
+        self.assertFalse(set(refresh.failed) & set(refresh.balances))
+
+    def test_older_slot_does_not_overwrite(self):
+        db = self.factory()
+        store_balances(db, {"a": (10, 5)})
+        store_balances(db, {"a": (7, 4), "b": (1, 4)})
+        store_balances(db, {"b": (2, 6)})
+        db.commit()
+        db.close()
+        self.assertEqual(self.stored(), {"a": (10, 5), "b": (2, 6)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from aiogram.types import Message
+
+from webhook_reply import WebhookReplyMiddleware, WebhookReplyRequestMiddleware, respond
+
+
+class RecordingSession(AiohttpSession):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.sent.append(method.text)
+        return Message.model_validate({"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}})
+
+
+def make_update(text):
+    return {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+                                        "from": {"id": 1, "is_bot": False, "first_name": "T"}, "text": text}}
+
+
+class TestWebhookReply(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = RecordingSession()
+        self.bot = Bot(token="42:TEST", session=self.session)
+        self.bot.session.middleware(WebhookReplyRequestMiddleware())
+        router = Router()
+
+        @router.message()
+        async def handler(message: Message):
+            await respond(message.answer("first"))
+            if message.text == "two":
+                await message.bot.send_message(1, "second")
+            if message.text == "fail":
+                raise RuntimeError("handler failed")
+
+        self.middleware = WebhookReplyMiddleware()
+        self.dp = Dispatcher()
+        self.dp.update.outer_middleware(self.middleware)
+        self.dp.include_router(router)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+
+    async def test_single_reply_is_returned_inline(self):
+        result = await self.dp.feed_webhook_update(self.bot, make_update("one"))
+        self.assertIsInstance(result, SendMessage)
+        self.assertEqual(result.text, "first")
+        self.assertEqual(self.session.sent, [])
+
+    async def test_second_message_falls_back_in_order(self):
+        result = await self.dp.feed_webhook_update(self.bot, make_update("two"))
+        self.assertIsNone(result)
+        self.assertEqual(self.session.sent, ["first", "second"])
+        self.assertEqual(self.middleware.fallback, 1)
+
+    async def test_reply_is_sent_when_handler_fails(self):
+        with self.assertRaises(RuntimeError):
+            await self.dp.feed_webhook_update(self.bot, make_update("fail"))
+        self.assertEqual(self.session.sent, ["first"])
+        self.assertEqual(self.middleware.fallback, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Background processing of webhook updates.
+
+``QueuedRequestHandler`` acknowledges every webhook request at once and hands
+the update to an ``UpdateWorkerPool``. The pool runs a fixed number of workers;
+updates of one chat are processed one after another in arrival order, while
+different chats are processed in parallel. When the pool holds ``max_queue``
+updates the webhook answers 503 so Telegram delivers the update again later.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods.base import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+logger = logging.getLogger("GrapheneBot.update_workers")
+
+
+def update_chat_key(update: Dict[str, Any]):
+    """Chat (or user) an update belongs to; updates with the same key stay ordered."""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user and "id" in user:
+            return user["id"]
+    return ("update", update.get("update_id"))
+
+
+class UpdateWorkerPool:
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = 8, max_queue: int = 1000, **data: Any):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.max_queue = max_queue
+        self.data = data
+        self._pending: Dict[Any, Deque[dict]] = {}
+        self._active: Set[Any] = set()
+        self._ready: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._size = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = []
+        self._closing = False
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """Queue an update; False when the pool is full or shutting down."""
+        if self._closing or self._size >= self.max_queue:
+            self.rejected += 1
+            return False
+        key = update_chat_key(update)
+        queue = self._pending.setdefault(key, deque())
+        queue.append(update)
+        self._size += 1
+        self._idle.clear()
+        if len(queue) == 1 and key not in self._active:
+            self._ready.put_nowait(key)
+        return True
+
+    async def _process(self, update: Dict[str, Any]):
+        result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            update = queue.popleft()
+            self._active.add(key)
+            try:
+                await self._process(update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to process update %s", update.get("update_id"))
+            finally:
+                self._active.discard(key)
+                self._size -= 1
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                if not self._size:
+                    self._idle.set()
+
+    async def start(self):
+        self._closing = False
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: Optional[float] = 30):
+        """Stop accepting updates and wait for queued ones to finish."""
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d unprocessed updates on shutdown", self._size)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._size,
+            "chats": len(self._pending),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Webhook handler that answers at once and processes updates in a worker pool."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = 8, max_queue: int = 1000,
+                 retry_after: int = 5, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.pool = UpdateWorkerPool(dispatcher, bot, workers=workers, max_queue=max_queue, **self.data)
+        self.retry_after = retry_after
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._handle_start)
+        super().register(app, path=path, **kwargs)
+
+    async def _handle_start(self, *a: Any, **kw: Any) -> None:
+        await self.pool.start()
+
+    async def close(self) -> None:
+        await self.pool.close()
+        await super().close()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.pool.submit(update):
+            # Not a 2xx, so Telegram keeps the update and delivers it again
+            return web.Response(status=503, headers={"Retry-After": str(self.retry_after)})
+        return web.json_response({}, dumps=bot.session.json_dumps)
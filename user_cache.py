@@ -0,0 +1,233 @@
+"""In-process cache of ``database.User`` records.
+
+Users are loaded once (created if missing), decrypted once and kept in a
+bounded LRU dict keyed by Telegram ID for ``ttl`` seconds. Balance changes
+are applied to the cached record at once and written behind: pending changes
+are saved in batched transactions by a background task, when the batch is
+full, or on shutdown. Balances are flushed as increments with one ledger
+entry per change (see ``ledger.py``), so concurrent writers elsewhere are not
+overwritten. A user with unsaved changes is never reloaded, so a reload
+cannot lose or repeat them. Credits made with ``ledger.credit`` and
+``bulk_credit`` should go through ``UserCache.credit`` and ``bulk_credit``,
+which also update the cached balances.
+
+The language is not cached here: ``locale_store.LocaleStore`` owns it.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from async_db import DatabaseExecutor, SingleFlight
+
+logger = logging.getLogger("GrapheneBot.user_cache")
+
+
+class CachedUser:
+    __slots__ = ("id", "telegram_id", "balance", "expires")
+
+    def __init__(self, id: int, telegram_id: str, balance: int, expires: float = 0.0):
+        self.id = id
+        self.telegram_id = telegram_id
+        self.balance = balance
+        self.expires = expires
+
+
+class _Pending:
+    __slots__ = ("user", "balance_delta", "entries")
+
+    def __init__(self, user: CachedUser):
+        self.user = user
+        self.balance_delta = 0
+        self.entries: List[Tuple[int, str]] = []  # (amount, reason)
+
+
+def _load(db, telegram_id: int) -> CachedUser:
+    from database import get_or_create_user
+
+    user = get_or_create_user(db, telegram_id)
+    return CachedUser(user.id, user.telegram_id, user.balance or 0)
+
+
+def _save(db, changes: Dict[int, _Pending]):
+    from sqlalchemy import insert, update
+
+    from database import LedgerEntry, User
+
+    # Entries are stamped when they are written, like every other ledger entry
+    now = time.time()
+    entries = []
+    for telegram_id, pending in changes.items():
+        if pending.balance_delta:
+            db.execute(update(User).where(User.by_telegram_id(telegram_id))
+                       .values(balance=User.balance + pending.balance_delta))
+        entries.extend({"user_id": pending.user.id, "amount": amount, "reason": reason, "created_at": now}
+                       for amount, reason in pending.entries)
+    if entries:
+        db.execute(insert(LedgerEntry), entries)
+
+
+class UserCache:
+    def __init__(self, database: DatabaseExecutor, maxsize: int = 10000, ttl: float = 300,
+                 flush_interval: float = 5.0, batch_size: int = 100, clock=time.monotonic):
+        self.database = database
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self._cache: "OrderedDict[int, CachedUser]" = OrderedDict()
+        self._dirty: Dict[int, _Pending] = {}
+        self._saving: Dict[int, _Pending] = {}  # Batch being flushed
+        self._flight = SingleFlight()
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_users = 0
+
+    def _remember(self, user: CachedUser):
+        self._cache[int(user.telegram_id)] = user
+        self._cache.move_to_end(int(user.telegram_id))
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    async def _fetch(self, telegram_id: int) -> CachedUser:
+        user = await self.database.transaction(_load, telegram_id)
+        user.expires = self.clock() + self.ttl
+        self._remember(user)
+        return user
+
+    async def get(self, telegram_id: int) -> CachedUser:
+        """Cached user, loaded or created on a miss; concurrent misses share one query."""
+        user = self._cache.get(telegram_id)
+        if user is not None and user.expires > self.clock():
+            self.hits += 1
+            self._cache.move_to_end(telegram_id)
+            return user
+        pending = self._dirty.get(telegram_id) or self._saving.get(telegram_id)
+        if pending is not None:
+            # The stored row is behind the cached one until the flush
+            self.hits += 1
+            pending.user.expires = self.clock() + self.ttl
+            self._remember(pending.user)
+            return pending.user
+        self.misses += 1
+        return await self._flight.do(telegram_id, self._fetch, telegram_id)
+
+    def _mark(self, user: CachedUser) -> _Pending:
+        telegram_id = int(user.telegram_id)
+        pending = self._dirty.get(telegram_id)
+        if pending is None:
+            pending = self._dirty[telegram_id] = _Pending(user)
+            if len(self._dirty) >= self.batch_size:
+                asyncio.get_running_loop().create_task(self.flush())
+        return pending
+
+    async def add_balance(self, telegram_id: int, amount: int, reason: str = "adjustment",
+                          allow_negative: bool = False) -> int:
+        """Change a balance by ``amount``; returns the new cached balance.
+
+        A debit below zero raises ``ledger.InsufficientBalance`` unless ``allow_negative``.
+        """
+        user = await self.get(telegram_id)
+        if amount < 0 and not allow_negative and user.balance + amount < 0:
+            from ledger import InsufficientBalance
+
+            raise InsufficientBalance(f"User {telegram_id} cannot pay {-amount}")
+        user.balance += amount
+        pending = self._mark(user)
+        pending.balance_delta += amount
+        pending.entries.append((amount, reason))
+        return user.balance
+
+    def _apply(self, deltas: Dict[int, int]):
+        """Add balance changes already committed by the ledger to the cached users (by user id)."""
+        users = {}
+        for user in itertools.chain(self._cache.values(), (pending.user for pending in self._dirty.values()),
+                                    (pending.user for pending in self._saving.values())):
+            if user.id in deltas:
+                users[id(user)] = user
+        for user in users.values():
+            user.balance += deltas[user.id]
+
+    async def credit(self, user_id: int, amount: int, reason: str, allow_negative: bool = False) -> int:
+        """``ledger.credit`` in the database threads; returns the entry id."""
+        import ledger
+
+        entry = await self.database.transaction(ledger.credit, user_id, amount, reason, allow_negative)
+        self._apply({user_id: amount})
+        return entry
+
+    async def bulk_credit(self, credits: Iterable[Tuple[int, int]], reason: str) -> str:
+        """``ledger.bulk_credit`` in the database threads; returns the operation id."""
+        import ledger
+
+        credits = list(credits)
+        operation = await self.database.transaction(ledger.bulk_credit, credits, reason)
+        deltas: Dict[int, int] = {}
+        for user_id, amount in credits:
+            deltas[user_id] = deltas.get(user_id, 0) + amount
+        self._apply(deltas)
+        return operation
+
+    def invalidate(self, telegram_id: int):
+        """Drop a cached user so it is read again; users with unsaved changes are read after the flush."""
+        self._cache.pop(telegram_id, None)
+
+    async def flush(self):
+        """Save all pending changes in one transaction."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch = self._saving = self._dirty
+            self._dirty = {}
+            try:
+                await self.database.transaction(_save, batch)
+            except Exception:
+                logger.exception("Failed to save %d users", len(batch))
+                # Merge back in front of changes made while saving
+                for telegram_id, pending in batch.items():
+                    newer = self._dirty.get(telegram_id)
+                    if newer is not None:
+                        pending.balance_delta += newer.balance_delta
+                        pending.entries.extend(newer.entries)
+                    self._dirty[telegram_id] = pending
+                return
+            finally:
+                self._saving = {}
+            self.flushes += 1
+            self.flushed_users += len(batch)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "flushed_users": self.flushed_users,
+        }
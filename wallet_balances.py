@@ -0,0 +1,101 @@
+"""Batched balance refresh for many Solana wallets.
+
+Instead of one ``getBalance`` round trip per address, addresses are sent in
+``getMultipleAccounts`` calls of up to 100 (the RPC limit), ``concurrency``
+calls at a time. Accounts that do not exist have a balance of 0. Results are
+upserted into ``wallet_balances`` with one executemany; a row is only
+replaced by a response from the same or a later slot.
+
+``bench_wallet_balances.py`` compares this with the per-address loop against
+``mock_rpc.MockRpc``.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from balance_cache import InvalidAddress, parse_pubkey
+
+logger = logging.getLogger("GrapheneBot.wallet_balances")
+
+MAX_ACCOUNTS_PER_CALL = 100
+
+
+class Refresh(NamedTuple):
+    balances: Dict[str, Tuple[int, int]]  # address -> (lamports, slot)
+    invalid: List[str]
+    failed: List[str]
+    rpc_calls: int
+
+
+async def fetch_balances(client, addresses: Iterable[str], commitment: Optional[str] = None,
+                         chunk_size: int = MAX_ACCOUNTS_PER_CALL, concurrency: int = 4) -> Refresh:
+    """Balances of ``addresses`` via ``client.get_multiple_accounts``.
+
+    Invalid addresses are reported without a call; a failed chunk is logged
+    and its addresses are reported as failed, the other chunks still count.
+    """
+    pubkeys, invalid = {}, []
+    for address in addresses:
+        try:
+            pubkeys.setdefault(str(parse_pubkey(address)), None)
+        except InvalidAddress:
+            invalid.append(address)
+    unique = [parse_pubkey(address) for address in pubkeys]
+    chunk_size = min(chunk_size, MAX_ACCOUNTS_PER_CALL)
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+    semaphore = asyncio.Semaphore(concurrency)
+    balances: Dict[str, Tuple[int, int]] = {}
+    failed: List[str] = []
+
+    async def fetch(chunk):
+        async with semaphore:
+            try:
+                response = await client.get_multiple_accounts(chunk, commitment)
+            except Exception:
+                logger.warning("getMultipleAccounts for %d addresses failed", len(chunk), exc_info=True)
+                failed.extend(str(pubkey) for pubkey in chunk)
+                return
+        slot = response.context.slot
+        for pubkey, account in zip(chunk, response.value):
+            balances[str(pubkey)] = (account.lamports if account is not None else 0, slot)
+
+    await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+    return Refresh(balances, invalid, failed, len(chunks))
+
+
+def store_balances(db, balances: Dict[str, Tuple[int, int]], updated_at: Optional[float] = None) -> int:
+    """Upsert ``address -> (lamports, slot)`` into ``wallet_balances``; commit is the caller's."""
+    from sqlalchemy.dialects.sqlite import insert
+
+    from database import WalletBalance
+
+    if not balances:
+        return 0
+    updated_at = time.time() if updated_at is None else updated_at
+    table = WalletBalance.__table__
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.address],
+        set_={"lamports": statement.excluded.lamports, "slot": statement.excluded.slot,
+              "updated_at": statement.excluded.updated_at},
+        where=statement.excluded.slot >= table.c.slot,
+    )
+    db.execute(statement, [{"address": address, "lamports": lamports, "slot": slot, "updated_at": updated_at}
+                           for address, (lamports, slot) in balances.items()])
+    return len(balances)
+
+
+async def refresh_balances(client, database, addresses: Iterable[str], commitment: Optional[str] = None,
+                           chunk_size: int = MAX_ACCOUNTS_PER_CALL, concurrency: int = 4,
+                           cache=None) -> Refresh:
+    """Fetch balances in batches and save them in one transaction of ``database`` (a ``DatabaseExecutor``).
+
+    With ``cache`` (a ``BalanceCache``) the fresh values are also served to
+    later single lookups.
+    """
+    refresh = await fetch_balances(client, addresses, commitment, chunk_size, concurrency)
+    await database.transaction(store_balances, refresh.balances)
+    if cache is not None:
+        cache.prime({address: lamports for address, (lamports, _) in refresh.balances.items()}, commitment)
+    return refresh
@@ -0,0 +1,106 @@
+"""Answering webhook updates in the HTTP response.
+
+The Bot API lets a webhook response carry one method call, which saves the
+separate HTTPS round trip of calling the API. Handlers pass their reply to
+``respond``: while an update is handled by ``WebhookReplyMiddleware`` the first
+reply is held back and returned as the handler result, which aiogram writes
+into the webhook response. As soon as the handler makes any other API call the
+held reply is sent normally first, so message order never changes. If the
+handler raises, the held reply is sent normally before the error propagates.
+
+Only useful with ``SimpleRequestHandler(..., handle_in_background=False)``.
+"""
+import contextvars
+import logging
+from typing import Any, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+from aiogram.methods.base import TelegramMethod
+
+logger = logging.getLogger("GrapheneBot.webhook_reply")
+
+
+class _ReplySlot:
+    __slots__ = ("method", "open")
+
+    def __init__(self):
+        self.method: Optional[TelegramMethod] = None
+        self.open = True
+
+    async def release(self):
+        """Close the slot and send the held reply, if any, as a normal call."""
+        self.open = False
+        method, self.method = self.method, None
+        if method is not None:
+            await method
+
+
+_slot: contextvars.ContextVar[Optional[_ReplySlot]] = contextvars.ContextVar("webhook_reply_slot", default=None)
+
+# Methods that may be answered inline; their result is not needed by handlers
+INLINE_METHODS = (SendMessage, AnswerCallbackQuery)
+
+
+async def respond(method: TelegramMethod) -> Any:
+    """Send a handler's reply, inline in the webhook response when possible."""
+    slot = _slot.get()
+    if slot is None or not slot.open or not isinstance(method, INLINE_METHODS):
+        if slot is not None:
+            await slot.release()
+        return await method
+    if slot.method is None:
+        slot.method = method
+        return None
+    # A second message: fall back to normal calls for the rest of the update
+    await slot.release()
+    return await method
+
+
+class WebhookReplyMiddleware(BaseMiddleware):
+    """Outer update middleware that returns the held reply to the webhook."""
+
+    def __init__(self):
+        self.inline = 0
+        self.fallback = 0
+
+    async def __call__(self, handler, event, data):
+        slot = _ReplySlot()
+        token = _slot.set(slot)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            # The handler already replied: the reply must not be lost with the update
+            if slot.method is not None:
+                self.fallback += 1
+                try:
+                    await slot.release()
+                except Exception:
+                    logger.exception("Failed to send the reply held for a failed update")
+            raise
+        finally:
+            _slot.reset(token)
+        if slot.method is None:
+            if not slot.open:
+                self.fallback += 1
+            return result
+        if isinstance(result, TelegramMethod):
+            await slot.release()
+            self.fallback += 1
+            return result
+        self.inline += 1
+        return slot.method
+
+
+class WebhookReplyRequestMiddleware:
+    """Session middleware: any other API call releases the held reply first.
+
+    Calls made before anything is held leave the slot open, so a handler that
+    edits a message and then answers the callback query still answers inline.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        slot = _slot.get()
+        if slot is not None and slot.method is not None:
+            await slot.release()
+        return await make_request(bot, method)